@@ -20,6 +20,19 @@ open = api.open
 config_from_dir = api.config_from_dir
 Config = api.Config
 
+import importlib
+
+def open_async(config: Config) -> 'AsyncAmeritradeAPI':
+    """Open an asyncio endpoint. This requires the 'async' extra; see async_api.py."""
+    return importlib.import_module('ameritrade.async_api').open_async(config)
+
+def __getattr__(name):
+    # Import the asyncio API on first use only, as it requires 'aiohttp'.
+    if name in ('async_api', 'AsyncAmeritradeAPI'):
+        async_api = importlib.import_module('ameritrade.async_api')
+        return async_api if name == 'async_api' else async_api.AsyncAmeritradeAPI
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 from ameritrade import scripts
 add_args = scripts.add_args
 config_from_args = scripts.config_from_args
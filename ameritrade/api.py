@@ -5,26 +5,35 @@ __license__ = "GNU GPLv2"
 
 from decimal import Decimal
 from os import path
-from typing import Tuple, Dict, Optional, NamedTuple, Optional
+from typing import Any, Iterable, List, Tuple, Dict, Optional, NamedTuple, Optional
 import builtins
-import collections
+import concurrent.futures
+import datetime
+import functools
 import hashlib
+import inspect
+import itertools
+import json
 import logging
 import os
-import pickle
 import re
 import requests
+import requests.adapters
+import threading
 import time
 
-# We need use_decimal.
-# TODO(blais): Remove this when the default JSON gets updated to 2.1 and above.
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 from ameritrade import auth
+from ameritrade import cache
+from ameritrade import coalesce
+from ameritrade import credentials
+from ameritrade import decoding
+from ameritrade import hooks
+from ameritrade import hours
+from ameritrade import metrics
+from ameritrade import retry
 from ameritrade import schema
+from ameritrade import throttle
+from ameritrade import transport
 
 
 DEFAULT_CONFIG_DIR = os.environ.get(
@@ -66,6 +75,90 @@ _Config = NamedTuple(
         ("lazy", bool),
         # Enable debug traces.
         ("debug", bool),
+        # Number of per-host connection pools to keep in the shared HTTP session.
+        ("pool_connections", int),
+        # Maximum number of connections to keep open to a single host. Raise
+        # this if you issue many calls concurrently from multiple threads.
+        ("pool_maxsize", int),
+        # Keep connections to the server open between calls (HTTP keep-alive).
+        # This avoids paying for a TCP connect and TLS handshake on each call.
+        ("keep_alive", bool),
+        # Number of calls that may be made back-to-back before being throttled,
+        # within the limit of 'rate_per_minute'.
+        ("rate_burst", int),
+        # A file in which to share the throttling window with all the other
+        # processes using the same file (and credentials). If not set, calls
+        # are throttled for this process only.
+        ("rate_limit_file", Optional[str]),
+        # If set, adapt the rate to the responses of the server: lower it when
+        # calls get rate-limited, and raise it slowly while they don't, up to
+        # this many calls per minute.
+        ("max_rate_per_minute", Optional[int]),
+        # Number of times a rate-limited call gets retried, after a delay.
+        ("rate_limit_retries", int),
+        # Timeout (in seconds) for the server to respond to a call.
+        ("request_timeout", Optional[float]),
+        # The policy for retrying calls on transient errors. See retry.py. Set
+        # this to None to disable retries.
+        ("retry_policy", Optional[retry.RetryPolicy]),
+        # If set, hedge GET calls: send a duplicate request if a call hasn't
+        # returned after this percentile of the recent latencies of its method,
+        # e.g., 95. The first response wins.
+        ("hedge_percentile", Optional[float]),
+        # The decoder for the JSON responses: 'decimal', 'float', 'fast' or
+        # 'lazy'. See decoding.py.
+        ("json_decoder", str),
+        # Maximum size (in bytes) of the compressed responses in the cache.
+        # The least recently used ones are evicted beyond it. See cache.py.
+        ("cache_max_bytes", Optional[int]),
+        # Time-to-live (in seconds) of the responses in the cache. None keeps
+        # them until they get evicted.
+        ("cache_ttl", Optional[float]),
+        # Overrides of the time-to-live of the cached responses, by method name,
+        # e.g., {'GetQuotes': 60}.
+        ("cache_ttls", Optional[Dict[str, Optional[float]]]),
+        # Time-to-live (in seconds) of empty and error responses in the caches,
+        # so that doomed calls aren't repeated too often. None disables their
+        # caching.
+        ("cache_negative_ttl", Optional[float]),
+        # Keep the responses of market data and instrument methods in memory,
+        # in front of the cache directory and the server. Their time-to-lives
+        # depend on whether the market is open. See cache.MemoryCache.
+        ("memory_cache", bool),
+        # Maximum number of responses, and of bytes of their JSON bodies, to
+        # keep in memory.
+        ("memory_cache_entries", int),
+        ("memory_cache_bytes", int),
+        # Overrides of the time-to-lives of the responses in memory, by method
+        # name, as cache.MemoryTtl. Methods can be disabled with None.
+        ("memory_cache_ttls", Optional[Dict[str, Optional[cache.MemoryTtl]]]),
+        # Coalesce identical GET calls made concurrently, so that they share a
+        # single request and its result. See coalesce.py.
+        ("coalesce", bool),
+        # Give each caller sharing a coalesced result its own copy of it.
+        ("coalesce_copy", bool),
+        # A journal file to append all the HTTP traffic to, for replay. See
+        # transport.py.
+        ("record_file", Optional[str]),
+        # A journal file (or a list of them) to serve the responses from,
+        # instead of connecting to the server. No authentication is done.
+        ("replay_file", Optional[Any]),
+        # The speed of the replay, relative to the original latency of the
+        # responses, e.g., 10 for ten times faster. None replays instantly.
+        ("replay_speed", Optional[float]),
+        # The base URL of the API. Set this to the URL of a local mock server,
+        # e.g., 'http://localhost:8080/v1', to run without the network. See
+        # mockserver.py.
+        ("api_url", str),
+        # If set, serve the metrics of the calls in the Prometheus text format
+        # on this port, for scraping. See metrics.py.
+        ("metrics_port", Optional[int]),
+        # The address to serve the metrics on.
+        ("metrics_host", str),
+        # Refresh the access token in the background this many seconds before
+        # it expires, so that calls don't get 401 responses. None disables
+        # this; calls then refresh the token when it's found expired.
+        ("refresh_ahead", Optional[float]),
     ],
 )
 
@@ -77,6 +170,24 @@ _ConfigDefaults = {
     "readonly": True,
     "lazy": False,
     "debug": False,
+    "pool_connections": 4,
+    "pool_maxsize": 10,
+    "keep_alive": True,
+    "rate_burst": 10,
+    "rate_limit_retries": 3,
+    "request_timeout": 60,
+    "retry_policy": retry.DEFAULT_RETRY_POLICY,
+    "json_decoder": "decimal",
+    "cache_max_bytes": 512 * 1024 * 1024,
+    "cache_negative_ttl": 60,
+    "memory_cache": False,
+    "memory_cache_entries": 1024,
+    "memory_cache_bytes": 64 * 1024 * 1024,
+    "coalesce": False,
+    "coalesce_copy": False,
+    "api_url": auth.DEFAULT_API_URL,
+    "metrics_host": "127.0.0.1",
+    "refresh_ahead": 60,
 }
 
 
@@ -110,6 +221,8 @@ def config_from_dir(config_dir: Optional[str] = None, **kwargs) -> Config:
         newargs["certificate_file"] = path.join(config_dir, "certificate.pem")
     if newargs.get("secrets_file", None) is None:
         newargs["secrets_file"] = path.join(config_dir, "secrets.json")
+    if newargs.get("rate_limit_file", None) is None:
+        newargs["rate_limit_file"] = path.join(config_dir, "ratelimit")
 
     # Read the client id from the 'config/client_id' file.
     if newargs.get("client_id", None) is None:
@@ -120,62 +233,244 @@ def config_from_dir(config_dir: Optional[str] = None, **kwargs) -> Config:
     return Config(**newargs)
 
 
-class JsonWrapper(dict):
-    """A convenience wrapper for JSON dicts with attribute access."""
-
-    def __getattr__(self, key):
-        try:
-            return super().__getitem__(key)
-        except KeyError as exc:
-            raise AttributeError from exc
-
-
-# TODO(blais): Make these configurable.
-JSON_KWARGS = dict(object_hook=JsonWrapper, use_decimal=True)
+# For backwards compatibility. The decoding of responses is now selected with
+# the 'json_decoder' option; see decoding.py.
+JsonWrapper = decoding.JsonWrapper
+JSON_KWARGS = dict(object_hook=JsonWrapper, parse_float=Decimal)
 
 
 # A dict of secrets. Contains the access token and Bearer type.
 Secrets = Dict[str, str]
 
+# The secrets used when replaying recorded traffic.
+REPLAY_SECRETS = {"token_type": "Bearer", "access_token": transport.REDACTED}
+
 
 class AmeritradeAPI:
     """An Ameritrade endpoint, with credentials."""
 
     def __init__(self, config: Config):
         self.config = config
+        self.decode = decoding.get_decoder(config.json_decoder)
+        self.session = make_session(config)
         self.secrets = None
+        self.refresh_lock = threading.Lock()
+        self.secrets_store = (None if config.replay_file else
+                              credentials.open_store(config))
+        self.metrics = metrics.Metrics()
         if not config.lazy:
             self.get_secrets()
-        self.time_queue = collections.deque()
+        # The token refresher is started by the first call.
+        self.refresher = None
+        self.refresh_ahead = None if config.replay_file else config.refresh_ahead
+        self.limiter = throttle.make_limiter(config)
+        self.rate_control = throttle.make_rate_control(config, self.limiter)
+        self.latencies = retry.LatencyTracker()
+        self.hooks = hooks.Hooks()
+        self.metrics_server = None
+        if config.metrics_port is not None:
+            self.metrics_server = metrics.serve(self.metrics_snapshot,
+                                                config.metrics_host,
+                                                config.metrics_port)
+        self.hedge_executor = None
+        self.headers = None
+        self.headers_secrets = None
+        self.cache = None
+        if config.cache_dir:
+            self.cache = cache.open_store(config.cache_dir, config.cache_max_bytes,
+                                          config.cache_ttl, config.cache_ttls,
+                                          config.cache_negative_ttl)
+
+        self.memory_cache = None
+        self.market_hours = None
+        if config.memory_cache:
+            self.memory_cache = cache.MemoryCache(config.memory_cache_entries,
+                                                  config.memory_cache_bytes)
+        memory_ttls = dict(cache.DEFAULT_MEMORY_TTLS, **(config.memory_cache_ttls or {}))
+        self.flight = None
+        if config.coalesce:
+            self.flight = coalesce.SingleFlight(config.coalesce_copy)
+
+        # Bind all the allowed methods once, so that accessing them is a
+        # simple attribute lookup.
+        for name, plan in compile_plans().items():
+            if config.readonly and plan.http_method != "GET":
+                continue
+            method = CallableMethod(plan, self)
+            # Methods which change state are never cached.
+            if self.cache is not None and plan.http_method == "GET":
+                method = CachedMethod(self.cache, name, method, config.debug,
+                                      self.decode, self.metrics)
+            if self.flight is not None and plan.http_method == "GET":
+                method = CoalescedMethod(self.flight, name, method)
+            if name == "GetHoursMultipleMarkets":
+                # Fetch the hours bypassing the memory cache, whose expiry
+                # depends on them.
+                self.market_hours = hours.MarketHours(method)
+            if (self.memory_cache is not None and plan.http_method == "GET" and
+                memory_ttls.get(name) is not None):
+                method = MemoryCachedMethod(self.memory_cache, name, method,
+                                            memory_ttls[name], self)
+            setattr(self, name, method)
 
     def get_secrets(self):
         if self.secrets is None:
-            self.secrets = auth.read_or_create_secrets(self.config)
+            if self.config.replay_file:
+                self.secrets = REPLAY_SECRETS
+            else:
+                self.secrets = auth.read_or_create_secrets(self.config,
+                                                           self.secrets_store)
+        elif self.secrets_store is not None:
+            # Pick up the secrets refreshed by other processes.
+            self.secrets = self.secrets_store.reload(self.secrets)
         return self.secrets
 
-    def refresh_secrets(self):
-        if self.secrets is None:
+    def start_refresher(self):
+        """Start refreshing the token ahead of its expiry, if enabled."""
+        with self.refresh_lock:
+            if self.refresher is None and self.refresh_ahead is not None:
+                self.refresher = auth.TokenRefresher(
+                    lambda: self.secrets,
+                    lambda secrets: self.refresh_secrets(secrets, proactive=True),
+                    self.refresh_ahead)
+
+    def get_headers(self, secrets: Secrets) -> Dict[str, str]:
+        """Get the authorization headers for some secrets, cached."""
+        if secrets is not self.headers_secrets:
+            self.headers = auth.get_headers(secrets)
+            self.headers_secrets = secrets
+        return self.headers
+
+    def refresh_secrets(self, expired_secrets: Optional[Secrets] = None,
+                        proactive: bool = False):
+        """Refresh the secrets, once for all the threads which found them expired.
+
+        Args:
+          expired_secrets: The secrets found expired, if any.
+          proactive: True if refreshing ahead of the expiry, in the background.
+            The user is then never asked to authenticate again.
+        """
+        if self.config.replay_file:
             return self.get_secrets()
-        else:
-            self.secrets = auth.refresh_secrets(self.config, self.secrets)
+        with self.refresh_lock:
+            # Another thread may have refreshed them while we were waiting.
+            if (self.secrets is not None and expired_secrets is not None and
+                self.secrets is not expired_secrets):
+                return self.secrets
+            if self.secrets is None:
+                return self.get_secrets()
+
+            def refresh(expired):
+                self.metrics.record_refresh(proactive)
+                return auth.refresh_token(self.config, expired, self.session,
+                                          interactive=not proactive)
+            if self.secrets_store is None:
+                self.secrets = refresh(self.secrets)
+            else:
+                # Only one process refreshes; the others load its secrets.
+                self.secrets = self.secrets_store.refresh(self.secrets, refresh)
         return self.secrets
 
+    def metrics_snapshot(self) -> metrics.MetricsSnapshot:
+        """Return a copy of the metrics of the calls made so far."""
+        return self.metrics.snapshot(self.limiter)
+
+    def get_hedge_executor(self) -> concurrent.futures.Executor:
+        """Get the thread pool used to hedge calls, creating it on first use."""
+        if self.hedge_executor is None:
+            self.hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                2 * self.config.pool_maxsize, thread_name_prefix="hedge")
+        return self.hedge_executor
+
+    def close(self):
+        """Close the pooled connections to the server, and the cache."""
+        self.refresh_ahead = None
+        if self.refresher is not None:
+            self.refresher.stop()
+            self.refresher = None
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=False)
+
+    def map(self, method_name: str, kwargs_list: Iterable[Dict[str, Any]],
+            max_workers: Optional[int] = None) -> List['BatchResult']:
+        """Call a single method concurrently with many sets of arguments.
+
+        For example:
+
+            results = api.map('GetPriceHistory',
+                              [dict(symbol=symbol, periodType='year')
+                               for symbol in symbols])
+
+        See batch() for details.
+        """
+        return self.batch([(method_name, kw) for kw in kwargs_list], max_workers)
+
+    def batch(self, calls: Iterable[Tuple[str, Dict[str, Any]]],
+              max_workers: Optional[int] = None) -> List['BatchResult']:
+        """Run a list of (method-name, kwargs) calls concurrently on a thread pool.
+
+        The calls share the rate limiter of this instance, so the overall rate
+        stays within 'rate_per_minute'. Results are returned in the same order as
+        the calls, and a call raising an exception does not interrupt the others;
+        its exception is returned in the 'error' field of its result instead.
+
+        Args:
+          calls: An iterable of (method-name, kwargs) pairs.
+          max_workers: The number of calls to run concurrently. This defaults to
+            the size of the connection pool ('pool_maxsize').
+        Returns:
+          A list of BatchResult, one per call.
+        """
+        # Resolve all the methods first, so that invalid names and methods
+        # disallowed in readonly mode fail the entire batch upfront.
+        calls = [(getattr(self, method_name), kw) for method_name, kw in calls]
+        if not calls:
+            return []
+
+        def run_call(call):
+            method, kw = call
+            # Let the hooks time the wait for a worker.
+            hooks.set_queued(queued)
+            try:
+                return BatchResult(method(**kw), None)
+            except Exception as exc:
+                logging.warning("Error in batch call: %s", exc)
+                return BatchResult(None, exc)
+            finally:
+                hooks.set_queued(None)
+
+        max_workers = max_workers or self.config.pool_maxsize
+        queued = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(run_call, calls))
+
     def __getattr__(self, key):
+        # Only called for methods which haven't been bound.
         method = schema.SCHEMA[key]
-        config = self.config
 
         # Disallow read-only methods.
-        if config.readonly and method.http_method != "GET":
-            raise NameError(
-                "Method {} is not allowed in read-only mode.".format(method.name)
-            )
-        else:
-            # Create a method, with caching or not.
-            method = CallableMethod(method, self, config.debug,
-                                    self.time_queue, config.rate_per_minute)
-            if config.cache_dir:
-                method = CachedMethod(config.cache_dir, key, method, config.debug)
-            return method
+        raise NameError(
+            "Method {} is not allowed in read-only mode.".format(method.name)
+        )
+
+
+# The result of a call made in a batch. Only one of 'value' or 'error' is set.
+BatchResult = NamedTuple(
+    "BatchResult",
+    [
+        # The decoded response of the call, if it succeeded.
+        ("value", Any),
+        # The exception raised by the call, if it failed.
+        ("error", Optional[Exception]),
+    ],
+)
 
 
 def open(config: Config) -> AmeritradeAPI:
@@ -183,194 +478,531 @@ def open(config: Config) -> AmeritradeAPI:
     return AmeritradeAPI(config)
 
 
-# An extra buffer of time to ensure we don't go over the threshold.
-BUFFER = 3  # secs
+def make_session(config: Config) -> requests.Session:
+    """Create an HTTP session with a pool of persistent connections.
+
+    A single session is owned by each AmeritradeAPI instance and shared by all
+    its methods and by the token refresh, so that calls reuse established
+    connections instead of paying for a new TCP connect and TLS handshake each
+    time. The transport of the session records or replays the traffic if
+    configured to.
+    """
+    session = requests.Session()
+    if config.replay_file:
+        filenames = config.replay_file
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        adapter = transport.ReplayAdapter(filenames, config.replay_speed)
+    elif config.record_file:
+        adapter = transport.RecordingAdapter(
+            config.record_file,
+            pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize
+        )
+    else:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize
+        )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not config.keep_alive:
+        session.headers["Connection"] = "close"
+    return session
 
 
-def maybe_throttle(time_queue: collections.deque, rate_per_minute: int):
-    now = time.time()
+# A prepared HTTP request for a method call.
+Request = NamedTuple(
+    "Request",
+    [
+        ("http_method", str),
+        ("url", str),
+        ("params", Dict[str, str]),
+        # The JSON payload, for POST, PUT and PATCH methods.
+        ("payload", Optional[object]),
+        ("extra_headers", Dict[str, str]),
+    ],
+)
 
-    if time_queue:
-        first = time_queue[0]
-        last = time_queue[-1]
-    else:
-        first = last = None
 
-    # Clear out timestamps before the past minute.
-    start_t = now - 60 + BUFFER # secs
-    while time_queue:
-        t = time_queue.popleft()
-        if t > start_t:
-            time_queue.appendleft(t)
-            break
+API_URL = auth.DEFAULT_API_URL
 
-    # Sleep until the next item if we have to.
-    if len(time_queue) >= rate_per_minute:
-        t = time_queue.popleft()
-        dt = t - start_t
-        logging.info(f"Throttling for {dt:.1f} secs ({start_t} {t})")
-        time.sleep(dt)
+# HTTP status codes, looked up once.
+HTTP_OK = requests.codes["ok"]
+HTTP_UNAUTHORIZED = requests.codes["unauthorized"]
+HTTP_TOO_MANY_REQUESTS = requests.codes["too_many_requests"]
 
-    now = time.time()
-    time_queue.append(now)
 
+class CallPlan:
+    """A method of the schema compiled into a plan to build its requests.
 
-class CallableMethod:
-    """Callable method."""
+    This precomputes everything about a method that does not depend on the
+    arguments of a call: the URL template, the sets of fields to check, the
+    validators, the extra headers and a Python signature for introspection.
+    """
 
-    def __init__(
-        self,
-        method: schema.PreparedMethod,
-        api: AmeritradeAPI,
-        debug: bool,
-        time_queue: Optional[collections.deque],
-        rate_per_minute: Optional[int],
-    ):
+    def __init__(self, method: schema.PreparedMethod):
         self.method = method
-        self.api = api
-        self.rate_per_minute = rate_per_minute
-        self.time_queue = time_queue
-        self.debug = debug
-
-    def __call__(self, **kw):
-        method = self.method
+        self.name = method.name
+        self.http_method = method.http_method
+        self.url_template = method.path
+        self.url_fields = frozenset(method.url_fields)
+        self.all_fields = frozenset(method.all_fields)
+        self.required_fields = frozenset(method.required_fields)
+        self.validators = tuple((field.name, field.validator)
+                                for field in method.fields
+                                if field.validator is not None)
+        self.comma_list_fields = frozenset(schema.COMMA_LIST_FIELDS.get(method.name, ()))
+        if method.http_method in {"GET", "DELETE"}:
+            # Those methods have query params (something none of them), never a
+            # payload, but always a JSON response.
+            self.has_payload = False
+            self.extra_headers = {}
+        elif method.http_method in {"POST", "PUT", "PATCH"}:
+            # These methods never have query params but all have a payload.
+            self.has_payload = True
+            self.extra_headers = {"Content-Type": "application/json"}
+        else:
+            # TODO(blais): Implement the other methods along with their schemas.
+            assert False, "Unsupported HTTP method for {}: {}".format(
+                method.name, method.http_method
+            )
+        self.signature = inspect.Signature([
+            inspect.Parameter(field.name, inspect.Parameter.KEYWORD_ONLY,
+                              default=(inspect.Parameter.empty
+                                       if field.required
+                                       else None))
+            for field in sorted(method.fields, key=lambda field: not field.required)
+        ])
 
-        # Apply throttling.
-        if self.rate_per_minute:
-            maybe_throttle(self.time_queue, self.rate_per_minute)
+    def prepare(self, kw: Dict[str, object], api_url: str = API_URL) -> Request:
+        """Validate the arguments of a method call and build its HTTP request."""
 
         # Remove values which are None.
         kw = {key: value for key, value in kw.items() if value is not None}
 
-        # Check that all the required fields are being provided.
-        provided_fields = set(kw.keys())
-        uncovered_fields = method.required_fields - provided_fields
-        if uncovered_fields:
-            raise TypeError("Missing required fields: {}".format(uncovered_fields))
-
-        # Check that there aren't any extra fields.
-        invalid_fields = provided_fields - method.all_fields
-        if invalid_fields:
-            raise TypeError("Invalid fields: {}".format(invalid_fields))
+        # Check that all the required fields are being provided, and that there
+        # aren't any extra fields.
+        keys = kw.keys()
+        if not self.required_fields <= keys:
+            raise TypeError("Missing required fields: {}".format(
+                set(self.required_fields - keys)))
+        if not keys <= self.all_fields:
+            raise TypeError("Invalid fields: {}".format(keys - self.all_fields))
 
         # Run the validations if there are any.
-        fieldmap = {field.name: field for field in method.fields}
-        for fname, value in kw.items():
-            field = fieldmap[fname]
-            if field.validator is None:
-                continue
-            # TODO(blais): Remove this, this isn't working. Convert schemas
-            # instead of using validators.
-            exc = field.validator(value)
-            if exc:
-                raise exc
-
-        # Build the headers and URL path to call.
-        path_kw = {field: kw.pop(field) for field in method.url_fields}
-        path = method.path.format(**path_kw)
-        url = "https://api.tdameritrade.com/v1{}".format(path)
+        for fname, validator in self.validators:
+            if fname in kw:
+                # TODO(blais): Remove this, this isn't working. Convert schemas
+                # instead of using validators.
+                exc = validator(kw[fname])
+                if exc:
+                    raise exc
+
+        # Build the URL to call.
+        url = api_url + (self.url_template.format_map(kw)
+                         if self.url_fields
+                         else self.url_template)
         logging.info("Opening URL: %s", url)
 
-        # Call the resources with parameters.
-        # TODO(blais): Clean this up with methods.
-        params = {key: str(value) for key, value in kw.items()}
-        extra_headers = {}
-        if self.method.http_method == "GET":
-            # Those methods have query params (something none of them), never a
-            # payload, but always a JSON response.
+        if self.has_payload:
+            logging.debug("With payload: %s", kw["payload"])
+            return Request(self.http_method, url, {}, kw["payload"], self.extra_headers)
+        else:
+            url_fields = self.url_fields
+            params = {key: str(value)
+                      for key, value in kw.items()
+                      if key not in url_fields}
             logging.debug("With params: %s", params)
-            call = lambda hdrs: requests.get(url, params=params, headers=hdrs)
-            retvalue = lambda r: r.json(**JSON_KWARGS) if r.text else None
+            return Request(self.http_method, url, params, None, self.extra_headers)
+
+    def cache_key(self, kw: Dict[str, object]) -> str:
+        """Compute a digest of a call, the same for all equivalent arguments.
+
+        None values are ignored, the elements of comma-separated lists are
+        sorted, and dates and numbers are converted to canonical strings, so
+        that, e.g., GetQuotes(symbol='SPY,QQQ') and GetQuotes(symbol='QQQ,SPY')
+        share the same key.
+        """
+        args = []
+        for key, value in sorted(kw.items()):
+            if value is None:
+                continue
+            value = canonical_value(value)
+            if key in self.comma_list_fields:
+                value = ",".join(sorted(set(elem.strip() for elem in value.split(","))))
+            args.append((key, value))
+        data = json.dumps([self.name, args], separators=(",", ":"))
+        return hashlib.md5(data.encode("utf8")).hexdigest()
 
-        elif self.method.http_method == "DELETE":
-            # Those methods only have the URL, no query params nor payload.
-            # Never a response body.
-            call = lambda hdrs: requests.delete(url, params=params, headers=hdrs)
-            retvalue = lambda r: r.json(**JSON_KWARGS) if r.text else None
 
-        elif self.method.http_method in {"POST", "PUT", "PATCH"}:
-            # These methods never have query params but all have a payload.
-            # Never a response body.
-            logging.debug("With payload: %s", kw["payload"])
-            extra_headers["Content-Type"] = "application/json"
-            method = getattr(requests, self.method.http_method.lower())
-            call = lambda hdrs: method(url, json=kw["payload"], headers=hdrs)
-            retvalue = lambda r: r.json(**JSON_KWARGS) if r.text else None
+def canonical_value(value: object) -> str:
+    """Convert the value of an argument to a canonical string."""
+    if isinstance(value, (float, Decimal)):
+        # Drop the trailing zeros, e.g., 5.0 and Decimal('5.00') become '5'.
+        return format(Decimal(str(value)).normalize(), "f")
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_plans() -> Dict[str, CallPlan]:
+    """Compile the call plans of all the methods of the schema, once."""
+    return {name: CallPlan(method) for name, method in schema.SCHEMA.items()}
+
 
+class CallableMethod:
+    """Callable method."""
+
+    def __init__(self, plan: CallPlan, api: AmeritradeAPI):
+        self.plan = plan
+        self.method = plan.method
+        self.api = api
+        self.limiter = api.limiter
+        self.debug = api.config.debug
+        self.__name__ = plan.name
+        self.__doc__ = plan.method.description
+        self.__signature__ = plan.signature
+
+    def __call__(self, **kw):
+        return self.call_sized(**kw)[0]
+
+    def call_sized(self, **kw) -> Tuple[Any, int]:
+        """Call the method. Return its response and the size of its JSON body."""
+        # Only build a context for the hooks if there are any.
+        call_hooks = self.api.hooks
+        context = None
+        if call_hooks.active:
+            context = call_hooks.start(self.method.name)
+            validate_start = time.perf_counter()
+            request = self.plan.prepare(kw, self.api.config.api_url)
+            context.add_span("validation", validate_start, time.perf_counter())
+            context.request = request
+            call_hooks.emit("before_request", context)
         else:
-            # TODO(blais): Implement the other methods along with their schemas.
-            assert False, "Unsupported HTTP method for {}: {}".format(
-                method.name, method.http_method
-            )
+            request = self.plan.prepare(kw, self.api.config.api_url)
+
+        control = self.api.rate_control
+        start = time.perf_counter()
+        response_bytes = 0
+        size = 0
+        decode_seconds = 0.
+        error = True
+        try:
+            for attempt in range(self.api.config.rate_limit_retries + 1):
+                # Apply throttling.
+                self.wait_for_slot(context)
+
+                # Call the method and decode the JSON response, if there is one.
+                resp = self.send(request, context=context)
+                if resp.status_code == HTTP_TOO_MANY_REQUESTS:
+                    response = None
+                else:
+                    content = resp.content
+                    size = len(content)
+                    response_bytes += size
+                    decode_start = time.perf_counter()
+                    response = self.api.decode(content) if content else None
+                    decode_end = time.perf_counter()
+                    decode_seconds += decode_end - decode_start
+                    if context is not None:
+                        context.add_span("decode", decode_start, decode_end)
+
+                # Back off and retry if we're over the rate limit.
+                if not throttle.is_rate_limited(resp.status_code, response):
+                    if control is not None:
+                        control.on_success()
+                    break
+                self.api.metrics.record_rate_limited(self.method.name)
+                if control is not None:
+                    control.on_rate_limited()
+                if attempt < self.api.config.rate_limit_retries:
+                    delay = throttle.retry_delay(resp.headers.get("Retry-After"),
+                                                 attempt)
+                    logging.warning("Rate limited calling %s; retrying in %.1f secs",
+                                    self.method.name, delay)
+                    if context is not None:
+                        call_hooks.emit("on_retry", context, resp.status_code)
+                    time.sleep(delay)
+                elif resp.status_code == HTTP_TOO_MANY_REQUESTS:
+                    # Out of retries; don't return None as if the response was
+                    # empty.
+                    if context is not None:
+                        context.status = resp.status_code
+                    raise IOError(
+                        "HTTP Error {}: {} ({})".format(
+                            resp.status_code, resp.reason, resp.text
+                        )
+                    )
+            error = resp.status_code >= 400
+            if context is not None:
+                context.status = resp.status_code
+                context.response = response
+        except BaseException as exc:
+            if context is not None:
+                context.error = exc
+            raise
+        finally:
+            self.api.metrics.record_call(self.method.name, time.perf_counter() - start,
+                                         response_bytes, decode_seconds, error)
+            if context is not None:
+                call_hooks.emit("after_response", context)
+
+        return response, size
+
+    def wait_for_slot(self, context: Optional[hooks.CallContext] = None):
+        """Wait for the rate limiter, if any, and record the time waited."""
+        waited = throttle.maybe_throttle(self.limiter)
+        if waited:
+            self.api.metrics.record_throttle(self.method.name, waited)
+            if context is not None:
+                end = time.perf_counter()
+                context.add_span("throttle", end - waited, end)
+                self.api.hooks.emit("on_throttle", context, waited)
+
+    def stream(self, **kw) -> requests.Response:
+        """Call the method without reading the body of the response.
+
+        The response is returned as soon as its headers are received, for the
+        caller to read its body incrementally, e.g., with streaming.py. Calls
+        rejected with HTTP 429 are retried like regular calls. The response
+        should be closed after use.
+        """
+        request = self.plan.prepare(kw, self.api.config.api_url)
+        control = self.api.rate_control
+        for attempt in range(self.api.config.rate_limit_retries + 1):
+            self.wait_for_slot()
+            resp = self.send(request, stream=True)
+            if resp.status_code != HTTP_TOO_MANY_REQUESTS:
+                if control is not None:
+                    control.on_success()
+                break
+            self.api.metrics.record_rate_limited(self.method.name)
+            if control is not None:
+                control.on_rate_limited()
+            if attempt == self.api.config.rate_limit_retries:
+                break
+            resp.close()
+            delay = throttle.retry_delay(resp.headers.get("Retry-After"), attempt)
+            logging.warning("Rate limited calling %s; retrying in %.1f secs",
+                            self.method.name, delay)
+            time.sleep(delay)
+        return resp
+
+    def send(self, request: Request, stream: bool = False,
+             context: Optional[hooks.CallContext] = None) -> requests.Response:
+        """Issue the HTTP request, refreshing the token if necessary."""
 
         # Make the first attempt to call the method.
         secrets = self.api.get_secrets()
-        headers = auth.get_headers(secrets)
-        headers.update(extra_headers)
-        resp = call(headers)
-        if resp.status_code == requests.codes["unauthorized"]:  # HTTP error 401
+        if self.api.refresher is None and self.api.refresh_ahead is not None:
+            self.api.start_refresher()
+        resp = self.send_with_retries(request, secrets, stream, context)
+        if resp.status_code == HTTP_UNAUTHORIZED:
             # If the token is expired, refresh the token automatically and retry
-            # once, maybe even a few times, if we need some resilience for a job
-            # that needs to run all week (e.g., a monitoring job).
-            num_retries = 1  # TODO(blais): Add configuration.
-            for _ in range(num_retries):
-                secrets = self.api.refresh_secrets()
-                headers = auth.get_headers(secrets)
-                resp = call(headers)
-                if resp.status_code == requests.codes.ok:
-                    break
-                time.sleep(0.3)  # TODO(blais): Add configuration.
-            else:
+            # once.
+            resp.close()
+            if context is not None:
+                self.api.hooks.emit("on_refresh", context)
+            secrets = self.api.refresh_secrets(secrets)
+            resp = self.send_with_retries(request, secrets, stream, context)
+            if resp.status_code != HTTP_OK:
                 # Oh well, still failed. Bail out.
                 raise IOError(
                     "HTTP Error {}: {} ({})".format(
                         resp.status_code, resp.reason, resp.text
                     )
                 )
-
-        # Return either JSON or text, depending on method.
-        return retvalue(resp)
+        return resp
+
+    def send_with_retries(self, request: Request, secrets: Secrets,
+                          stream: bool = False,
+                          context: Optional[hooks.CallContext] = None) -> requests.Response:
+        """Issue the HTTP request, retrying transient errors per the policy."""
+        policy = self.api.config.retry_policy
+        retriable = policy is not None and request.http_method in policy.methods
+        exceptions = policy.retry_exceptions if retriable else ()
+        for attempt in itertools.count():
+            if attempt > 0:
+                time.sleep(retry.backoff_delay(policy, attempt - 1))
+                self.wait_for_slot(context)
+            last_attempt = not retriable or attempt + 1 >= policy.max_attempts
+            try:
+                resp = self.send_once(request, secrets, stream, context)
+            except exceptions as exc:
+                if last_attempt:
+                    raise
+                logging.warning("Error calling %s: %s; retrying", self.method.name, exc)
+                if context is not None:
+                    self.api.hooks.emit("on_retry", context, exc)
+            else:
+                if last_attempt or resp.status_code not in policy.retry_statuses:
+                    return resp
+                resp.close()
+                logging.warning("HTTP Error %s calling %s; retrying",
+                                resp.status_code, self.method.name)
+                if context is not None:
+                    self.api.hooks.emit("on_retry", context, resp.status_code)
+
+    def send_once(self, request: Request, secrets: Secrets,
+                  stream: bool = False,
+                  context: Optional[hooks.CallContext] = None) -> requests.Response:
+        """Issue the HTTP request, hedging it if configured."""
+        headers = self.api.get_headers(secrets)
+        if request.extra_headers:
+            headers = dict(headers, **request.extra_headers)
+        if request.payload is None:
+            kwargs = dict(params=request.params)
+        else:
+            kwargs = dict(json=request.payload)
+        session = self.api.session
+        timeout = self.api.config.request_timeout
+
+        def call():
+            start = time.perf_counter()
+            resp = session.request(request.http_method, request.url, headers=headers,
+                                   timeout=timeout, stream=stream, **kwargs)
+            end = time.perf_counter()
+            self.api.latencies.record(self.method.name, end - start)
+            if context is not None:
+                context.add_span("network", start, end)
+            return resp
+
+        percentile = self.api.config.hedge_percentile
+        if percentile and request.http_method == "GET" and not stream:
+            delay = self.api.latencies.percentile(self.method.name, percentile)
+            if delay is not None:
+                def hedge():
+                    self.wait_for_slot(context)
+                    return call()
+                return retry.hedged_call(self.api.get_hedge_executor(),
+                                         call, delay, hedge)
+        return call()
 
 
 class CachedMethod:
     """A caching proxy for any callable methods."""
 
-    def __init__(self, cache_dir, method_name, method, debug):
-        self.cache_dir = cache_dir
+    def __init__(self, store: cache.CacheStore, method_name, method, debug,
+                 decode=decoding.decode_decimal,
+                 metrics: Optional[metrics.Metrics] = None):
+        self.store = store
+        self.plan = compile_plans()[method_name]
         self.method_name = method_name
         self.method = method
         self.debug = debug
-        assert cache_dir
+        self.decode = decode
+        self.metrics = metrics
+        self.__name__ = method_name
+        self.__doc__ = getattr(method, "__doc__", None)
+        self.__signature__ = getattr(method, "__signature__", None)
+
+    def stream(self, **kw) -> requests.Response:
+        """Call the method without reading its response; this bypasses the cache."""
+        return self.method.stream(**kw)
 
     def __call__(self, **kw):
-        # Ensure the cache directory exists the first time a method is called.
-        if not path.exists(self.cache_dir):
-            os.makedirs(self.cache_dir)
+        return self.call_sized(**kw)[0]
 
+    def call_sized(self, **kw) -> Tuple[Any, int]:
+        """Call the method. Return its response and the size of its JSON body."""
         # Remove values which are None.
         kw = {key: value for key, value in kw.items() if value is not None}
 
-        # Compute unique method call hash.
-        md5 = hashlib.md5()
-        keyobj = (self.method_name, sorted(kw.items()))
-        md5.update(pickle.dumps(keyobj))
-        digest = md5.hexdigest()
-
         # Test the cache.
-        cache_path = path.join(self.cache_dir, "{}.json".format(digest))
-        if path.exists(cache_path):
+        digest = self.plan.cache_key(kw)
+        data = self.store.get(digest)
+        if self.metrics is not None:
+            self.metrics.record_cache(self.method_name, data is not None)
+        if data is not None:
             # Cache hit.
             logging.info("{%s} Cache hit for call to %s", digest, self.method_name)
-            with builtins.open(cache_path, "r") as infile:
-                return json.load(infile, **JSON_KWARGS)
+            return self.decode(data), len(data)
         else:
             # Cache miss.
             logging.info("{%s} Cache miss for call to %s", digest, self.method_name)
-            response = self.method(**kw)
+            response, size = self.method.call_sized(**kw)
+            if response is None or throttle.is_rate_limited(HTTP_OK, response):
+                # No response or a rate-limited one; don't cache the failure.
+                return response, size
+            negative = cache.is_negative(response)
+            if negative and self.store.negative_ttl is None:
+                return response, size
             logging.info("{%s} Updating cache for call to %s", digest, self.method_name)
-            if "error" not in response:
-                with builtins.open(cache_path, "w") as infile:
-                    json.dump(
-                        response, infile, sort_keys=True, indent=4, use_decimal=True
-                    )
+            data = decoding.dumps(response, separators=(",", ":")).encode("utf8")
+            self.store.put(digest, self.method_name, data, negative)
+            return response, size
+
+
+class CoalescedMethod:
+    """A proxy sharing the result of a method call with identical concurrent calls."""
+
+    def __init__(self, flight: coalesce.SingleFlight, method_name, method):
+        self.flight = flight
+        self.plan = compile_plans()[method_name]
+        self.method_name = method_name
+        self.method = method
+        self.__name__ = method_name
+        self.__doc__ = getattr(method, "__doc__", None)
+        self.__signature__ = getattr(method, "__signature__", None)
+
+    def stream(self, **kw) -> requests.Response:
+        """Call the method without reading its response; this is not coalesced."""
+        return self.method.stream(**kw)
+
+    def __call__(self, **kw):
+        return self.call_sized(**kw)[0]
+
+    def call_sized(self, **kw) -> Tuple[Any, int]:
+        """Call the method. Return its response and the size of its JSON body."""
+        return self.flight.call(self.plan.cache_key(kw),
+                                lambda: self.method.call_sized(**kw))
+
+
+class MemoryCachedMethod:
+    """A proxy keeping the responses of a method in memory.
+
+    The responses are shared between the callers and must not be modified.
+    """
+
+    def __init__(self, memory: cache.MemoryCache, method_name, method,
+                 ttl: cache.MemoryTtl, api: AmeritradeAPI):
+        self.memory = memory
+        self.plan = compile_plans()[method_name]
+        self.method_name = method_name
+        self.method = method
+        self.ttl = ttl
+        self.api = api
+        self.__name__ = method_name
+        self.__doc__ = getattr(method, "__doc__", None)
+        self.__signature__ = getattr(method, "__signature__", None)
+
+    def stream(self, **kw) -> requests.Response:
+        """Call the method without reading its response; this bypasses the cache."""
+        return self.method.stream(**kw)
+
+    def __call__(self, **kw):
+        key = self.plan.cache_key(kw)
+        response = self.memory.get(key, _MISSING)
+        self.api.metrics.record_cache(self.method_name, response is not _MISSING,
+                                      memory=True)
+        if response is not _MISSING:
+            return response
+        # Size the entries by their JSON body, which is cheaper than measuring
+        # the decoded response.
+        response, size = self.method.call_sized(**kw)
+        if response is None or throttle.is_rate_limited(HTTP_OK, response):
             return response
+        now = time.time()
+        expires = cache.memory_expiry(self.ttl, self.api.market_hours, now)
+        if cache.is_negative(response):
+            negative_ttl = self.api.config.cache_negative_ttl
+            if negative_ttl is None:
+                return response
+            expires = min(expires, now + negative_ttl)
+        if expires > now:
+            self.memory.put(key, response, size, expires)
+        return response
+
+
+# A marker for misses of the memory cache.
+_MISSING = object()
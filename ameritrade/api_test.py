@@ -4,10 +4,16 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 from unittest import mock
+import datetime
+import inspect
+import json
 import pytest
+import requests
+import threading
 
-from ameritrade import schema
 from ameritrade import api
+from ameritrade import auth
+from ameritrade import mockserver
 
 
 def open_for_test():
@@ -15,6 +21,16 @@ def open_for_test():
     return api.open(api.Config(client_id='TEST@AMER.OAUTHAP'))
 
 
+def make_response(status_code, body=None, headers=None):
+    """Create a response with an optional JSON body."""
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp._content = json.dumps(body).encode('utf8') if body is not None else b''
+    resp._content_consumed = True
+    resp.headers.update(headers or {})
+    return resp
+
+
 def test_make_config():
     c = api.Config()
     assert isinstance(c, api.Config)
@@ -26,10 +42,11 @@ def test_make_config():
 
 @mock.patch('ameritrade.auth.get_headers')
 @mock.patch('ameritrade.auth.read_or_create_secrets')
-@mock.patch('requests.get')
-def test_get(_, __, reqget):
+@mock.patch('requests.Session.request')
+def test_get(reqget, _, __):
+    reqget.return_value = make_response(200, {})
     a = open_for_test()
-    method = api.CallableMethod(schema.SCHEMA['GetMovers'], a, False)
+    method = api.CallableMethod(api.compile_plans()['GetMovers'], a)
 
     # Missing a required field.
     with pytest.raises(TypeError):
@@ -51,14 +68,316 @@ def test_get(_, __, reqget):
     # Just invalid fields.
     with pytest.raises(TypeError):
         result = method(impostor='up')
+    a.close()
 
 
 @mock.patch('ameritrade.auth.get_headers')
 @mock.patch('ameritrade.auth.read_or_create_secrets')
-@mock.patch('requests.get')
+@mock.patch('requests.Session.request')
 def test_readonly(_, __, ___):
     iapi = open_for_test()
     with pytest.raises(NameError):
         iapi.ReplaceSavedOrder(accountId='accountId',
                                savedOrderId='savedOrderId',
                                payload={})
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers')
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_session_pool(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                               pool_maxsize=32))
+    adapter = iapi.session.get_adapter('https://api.tdameritrade.com/v1')
+    assert adapter._pool_maxsize == 32
+    assert iapi.session.headers['Connection'] == 'keep-alive'
+
+    with mock.patch.object(iapi.session, 'request',
+                           return_value=make_response(200, {})) as sessget:
+        iapi.GetMovers(index='$SPY.X')
+        iapi.GetQuote(symbol='SPY')
+        assert sessget.call_count == 2
+    iapi.close()
+
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                               keep_alive=False))
+    assert iapi.session.headers['Connection'] == 'close'
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers')
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('ameritrade.auth.get_refresh_token')
+def test_refresh_uses_session(refresh, _, __):
+    iapi = open_for_test()
+    iapi.secrets = {'refresh_token': 'REFRESH'}
+    refresh.return_value = {'access_token': 'A', 'refresh_token': 'R'}
+    iapi.refresh_secrets()
+    refresh.assert_called_once_with('TEST@AMER.OAUTHAP', 'REFRESH', iapi.session,
+                                    api.API_URL)
+
+    # Secrets replaced by another thread in the meantime aren't refreshed again.
+    refresh.reset_mock()
+    assert iapi.refresh_secrets({'refresh_token': 'OLD'}) is iapi.secrets
+    refresh.assert_not_called()
+
+    # Refreshing ahead of the expiry never asks to authenticate again.
+    refresh.return_value = {'error': 'invalid_grant'}
+    with mock.patch('ameritrade.auth.authenticate') as authenticate:
+        with pytest.raises(IOError):
+            iapi.refresh_secrets(iapi.secrets, proactive=True)
+        authenticate.assert_not_called()
+    iapi.close()
+
+
+def test_refresh_ahead():
+    with mockserver.MockServer(token_lifetime=2) as server:
+        with mock.patch('ameritrade.auth.read_or_create_secrets',
+                        return_value={'token_type': 'Bearer', 'access_token': 'A',
+                                      'refresh_token': 'R', 'expires_in': 2,
+                                      'expires_at': api.time.time() + 2}):
+            iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                                       api_url=server.url, rate_per_minute=None,
+                                       refresh_ahead=1.5))
+        # The token given expires on the server along with its secrets.
+        server.tokens['A'] = iapi.secrets['expires_at']
+        deadline = api.time.time() + 3.5
+        while api.time.time() < deadline:
+            iapi.GetQuote(symbol='SPY')
+            api.time.sleep(0.1)
+        # Stop the refresher first, so that no refresh is left in flight.
+        iapi.close()
+        assert iapi.refresher is None
+        snapshot = iapi.metrics_snapshot()
+        assert snapshot.proactive_refreshes >= 2
+        assert snapshot.refreshes == 0
+        assert server.requests['PostAccessToken'] == snapshot.proactive_refreshes
+
+
+def test_refresher_starts_on_first_call(open_client, server):
+    iapi = open_client(server)
+    assert iapi.refresher is None
+    iapi.GetQuote(symbol='SPY')
+    refresher = iapi.refresher
+    assert refresher.thread.is_alive()
+    iapi.GetQuote(symbol='SPY')
+    assert iapi.refresher is refresher
+    iapi.close()
+    assert not refresher.thread.is_alive()
+
+    # Closed clients don't start it again, nor do clients with it disabled.
+    iapi.GetQuote(symbol='SPY')
+    assert iapi.refresher is None
+    iapi = open_client(server, refresh_ahead=None)
+    iapi.GetQuote(symbol='SPY')
+    assert iapi.refresher is None
+
+
+def test_refresher_never_spins():
+    # With a zero margin, refreshes which fail or return expired secrets are
+    # spaced by at least the minimum interval.
+    expired = {'access_token': 'A', 'expires_at': 0.}
+    for result in [IOError('unavailable'), expired]:
+        refresh = mock.Mock(side_effect=[result] * 10)
+        refresher = auth.TokenRefresher(lambda: expired, refresh, 0)
+        api.time.sleep(0.5)
+        refresher.stop()
+        assert refresh.call_count == 1
+
+
+@mock.patch('ameritrade.auth.get_headers')
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_map(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                               rate_per_minute=None, retry_policy=None))
+
+    def request(method, url, **kw):
+        symbol = url.split('/')[-2]
+        if symbol == 'BAD':
+            raise requests.ConnectionError(symbol)
+        return make_response(200, symbol)
+
+    symbols = ['SPY', 'QQQ', 'BAD', 'IWM'] * 10
+    with mock.patch.object(iapi.session, 'request', side_effect=request):
+        results = iapi.map('GetQuote', [dict(symbol=s) for s in symbols],
+                           max_workers=8)
+    assert [r.value for r in results] == [None if s == 'BAD' else s
+                                          for s in symbols]
+    assert all(isinstance(r.error, requests.ConnectionError)
+               for r, s in zip(results, symbols) if s == 'BAD')
+
+    # Readonly and unknown methods fail the whole batch.
+    with pytest.raises(NameError):
+        iapi.batch([('GetQuote', dict(symbol='SPY')),
+                    ('CancelOrder', dict(accountId='1', orderId='2'))])
+    with pytest.raises(KeyError):
+        iapi.map('GetNothing', [{}])
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers')
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('time.sleep')
+def test_rate_limited_retry(sleep, _, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                               max_rate_per_minute=150))
+    limited = make_response(429, headers={'Retry-After': '2'})
+    error = make_response(
+        200, {'error': 'transactions per seconds restriction reached'})
+    ok = make_response(200, {'SPY': {}})
+    with mock.patch.object(iapi.session, 'request', side_effect=[limited, error, ok]):
+        assert iapi.GetQuote(symbol='SPY') == {'SPY': {}}
+    assert [c[0][0] for c in sleep.call_args_list] == [2., 2.]
+    assert iapi.limiter.rate_per_minute == 60
+
+    # Give up after the configured number of retries.
+    with mock.patch.object(iapi.session, 'request', return_value=error):
+        assert iapi.GetQuote(symbol='SPY') == error.json()
+    iapi.close()
+
+
+def test_rate_limited_error(open_client):
+    with mockserver.MockServer(rate_limit_rate=1., retry_after=0) as server:
+        iapi = open_client(server, rate_limit_retries=1)
+        # Running out of retries raises rather than returning no response.
+        with pytest.raises(IOError, match='HTTP Error 429'):
+            iapi.GetQuote(symbol='SPY')
+        assert server.requests['GetQuote'] == 2
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('time.sleep')
+def test_retry_policy(sleep, _, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', readonly=False,
+                               rate_per_minute=None))
+    unavailable = make_response(503)
+    ok = make_response(200, {'SPY': {}})
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=[requests.ConnectionError(), unavailable, ok]):
+        assert iapi.GetQuote(symbol='SPY') == {'SPY': {}}
+    assert sleep.call_count == 2
+
+    # Give up after the max attempts.
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=requests.ConnectionError()) as request:
+        with pytest.raises(requests.ConnectionError):
+            iapi.GetQuote(symbol='SPY')
+    assert request.call_count == 3
+
+    # Never retry methods with side-effects.
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=requests.ConnectionError()) as request:
+        with pytest.raises(requests.ConnectionError):
+            iapi.PlaceOrder(accountId='1', payload={})
+    assert request.call_count == 1
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_hedging(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                               rate_per_minute=None, hedge_percentile=90))
+    for _ in range(20):
+        iapi.latencies.record('GetQuote', 0.01)
+
+    release = threading.Event()
+    slow = make_response(200, 'slow')
+    fast = make_response(200, 'fast')
+    responses = iter([slow, fast])
+    def request(*args, **kw):
+        resp = next(responses)
+        if resp is slow:
+            release.wait(5)
+        return resp
+    with mock.patch.object(iapi.session, 'request', side_effect=request):
+        assert iapi.GetQuote(symbol='SPY') == 'fast'
+    release.set()
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_call_plans(_, tmp_path):
+    iapi = open_for_test()
+
+    # Methods are bound once.
+    assert iapi.GetQuote is iapi.GetQuote
+    assert 'GetQuote' in vars(iapi)
+    assert 'CancelOrder' not in vars(iapi)
+
+    # Methods have real signatures.
+    sig = inspect.signature(iapi.GetPriceHistory)
+    assert list(sig.parameters)[0] == 'symbol'
+    assert sig.parameters['symbol'].default is inspect.Parameter.empty
+    assert sig.parameters['period'].default is None
+    assert iapi.GetPriceHistory.__doc__ == 'Get price history for a symbol'
+
+    # The caching proxies keep them.
+    cached = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', cache_dir=str(tmp_path),
+                                 memory_cache=True))
+    assert isinstance(cached.GetPriceHistory, api.MemoryCachedMethod)
+    assert isinstance(cached.GetPriceHistory.method, api.CachedMethod)
+    assert inspect.signature(cached.GetPriceHistory) == sig
+    assert cached.GetPriceHistory.__doc__ == 'Get price history for a symbol'
+    assert cached.GetPriceHistory.method.__name__ == 'GetPriceHistory'
+    cached.close()
+
+    plan = api.compile_plans()['GetAccount']
+    request = plan.prepare(dict(accountId='123', fields='positions', other=None))
+    assert request.url == 'https://api.tdameritrade.com/v1/accounts/123'
+    assert request.params == {'fields': 'positions'}
+    assert request.payload is None
+    with pytest.raises(ValueError):
+        plan.prepare(dict(accountId=123))
+
+    request = api.compile_plans()['PlaceOrder'].prepare(
+        dict(accountId='123', payload={'orderType': 'LIMIT'}))
+    assert request.url == 'https://api.tdameritrade.com/v1/accounts/123/orders'
+    assert request.params == {}
+    assert request.extra_headers == {'Content-Type': 'application/json'}
+
+
+def test_json_kwargs():
+    response = json.loads('{"bid": 1.25}', **api.JSON_KWARGS)
+    assert isinstance(response, api.JsonWrapper)
+    assert response.bid == api.Decimal('1.25')
+
+
+def test_cache_key():
+    quotes = api.compile_plans()['GetQuotes']
+    assert (quotes.cache_key(dict(symbol='SPY,QQQ')) ==
+            quotes.cache_key(dict(symbol='QQQ, SPY,SPY', other=None)))
+    assert quotes.cache_key(dict(symbol='SPY')) != quotes.cache_key(dict(symbol='QQQ'))
+
+    history = api.compile_plans()['GetPriceHistory']
+    assert (history.cache_key(dict(symbol='SPY', period=5.0)) ==
+            history.cache_key(dict(symbol='SPY', period='5')))
+    assert (api.compile_plans()['GetTransactions'].cache_key(
+        dict(accountId='1', startDate=datetime.date(2021, 1, 4))) ==
+            api.compile_plans()['GetTransactions'].cache_key(
+        dict(accountId='1', startDate='2021-01-04')))
+
+    # Commas are only sorted in lists.
+    search = api.compile_plans()['SearchInstruments']
+    assert (search.cache_key(dict(symbol='A{1,3}', projection='symbol-regex')) !=
+            search.cache_key(dict(symbol='A{3,1}', projection='symbol-regex')))
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_json_decoder(_, __):
+    body = {'SPY': {'lastPrice': 420.15, 'totalVolume': 1000}}
+    for name, expected in [('decimal', api.Decimal('420.15')),
+                           ('float', 420.15)]:
+        iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                                   rate_per_minute=None, json_decoder=name))
+        with mock.patch.object(iapi.session, 'request',
+                               return_value=make_response(200, body)):
+            quote = iapi.GetQuote(symbol='SPY')
+        assert quote.SPY.lastPrice == expected
+        assert type(quote.SPY.lastPrice) is type(expected)
+        iapi.close()
+
+    with pytest.raises(ValueError):
+        api.open(api.Config(client_id='TEST@AMER.OAUTHAP', json_decoder='xml'))
@@ -0,0 +1,276 @@
+"""Asyncio-native version of the Ameritrade API wrappers.
+
+The coroutine methods are generated from the same schema as the blocking API,
+and share its argument checking and request building, readonly enforcement,
+throttling and automatic token refresh. Usage:
+
+    async with ameritrade.open_async(config) as api:
+        quotes = await asyncio.gather(*[api.GetQuote(symbol=symbol)
+                                        for symbol in symbols])
+
+This requires the 'aiohttp' library, installed with the 'async' extra:
+
+    pip install ameritrade[async]
+
+The response cache is not supported in this mode.
+"""
+__author__ = "Martin Blais <blais@furius.ca>"
+__license__ = "GNU GPLv2"
+
+from typing import Optional
+import asyncio
+import http
+import itertools
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError as exc:
+    raise ImportError("ameritrade.async_api requires the 'aiohttp' library; install "
+                      "the 'async' extra: pip install ameritrade[async]") from exc
+
+# Exceptions of the HTTP client which are retried by the retry policy.
+RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+from ameritrade import api
+from ameritrade import auth
+from ameritrade import coalesce
+from ameritrade import credentials
+from ameritrade import decoding
+from ameritrade import metrics
+from ameritrade import retry
+from ameritrade import schema
+from ameritrade import throttle
+
+
+class AsyncAmeritradeAPI:
+    """An Ameritrade endpoint, with credentials, for use with asyncio.
+
+    All coroutine methods of an instance share a single pooled HTTP session and
+    a single rate limiter. The instance should be used and closed from within
+    the same event loop.
+    """
+
+    def __init__(self, config: api.Config):
+        self.config = config
+        self.decode = decoding.get_decoder(config.json_decoder)
+        self.secrets = None
+        self.secrets_store = credentials.open_store(config)
+        if not config.lazy:
+            self.get_secrets()
+        self.limiter = throttle.make_limiter(config)
+        self.rate_control = throttle.make_rate_control(config, self.limiter)
+        self.metrics = metrics.Metrics()
+        self.session = None
+        self.refresh_lock = asyncio.Lock()
+        self.flight = None
+        if config.coalesce:
+            self.flight = coalesce.AsyncSingleFlight(config.coalesce_copy)
+
+        # Bind all the allowed methods once.
+        for name, plan in api.compile_plans().items():
+            if config.readonly and plan.http_method != "GET":
+                continue
+            setattr(self, name, AsyncCallableMethod(plan, self))
+
+    def get_secrets(self):
+        if self.secrets is None:
+            self.secrets = auth.read_or_create_secrets(self.config, self.secrets_store)
+        elif self.secrets_store is not None:
+            # Pick up the secrets refreshed by other processes.
+            self.secrets = self.secrets_store.reload(self.secrets)
+        return self.secrets
+
+    async def refresh_secrets(self, expired_secrets: Optional[api.Secrets] = None):
+        """Refresh the secrets, once for all the coroutines which found them expired."""
+        async with self.refresh_lock:
+            # Another coroutine may have refreshed them while we were waiting.
+            if self.secrets is not None and self.secrets is not expired_secrets:
+                return self.secrets
+            loop = asyncio.get_running_loop()
+            if self.secrets is None:
+                await loop.run_in_executor(None, self.get_secrets)
+            else:
+                def refresh(expired):
+                    self.metrics.record_refresh()
+                    return auth.refresh_token(self.config, expired)
+
+                def refresh_or_load(expired):
+                    if self.secrets_store is None:
+                        return refresh(expired)
+                    # Only one process refreshes; the others load its secrets.
+                    return self.secrets_store.refresh(expired, refresh)
+                self.secrets = await loop.run_in_executor(None, refresh_or_load,
+                                                          self.secrets)
+        return self.secrets
+
+    def metrics_snapshot(self) -> metrics.MetricsSnapshot:
+        """Return a copy of the metrics of the calls made so far."""
+        return self.metrics.snapshot(self.limiter)
+
+    def get_session(self) -> 'aiohttp.ClientSession':
+        """Get the shared HTTP session, creating it on first use."""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.config.pool_maxsize,
+                force_close=not self.config.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def throttle(self, name: Optional[str] = None):
+        """Wait for a slot in the rate limit shared by all the coroutines.
+
+        Args:
+          name: The name of the method to record the wait for, if any.
+        """
+        if self.limiter is not None:
+            dt = self.limiter.reserve()
+            if dt > 0:
+                logging.info(f"Throttling for {dt:.1f} secs")
+                if name is not None:
+                    self.metrics.record_throttle(name, dt)
+                await asyncio.sleep(dt)
+
+    async def close(self):
+        """Close the pooled connections to the server."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __getattr__(self, key):
+        # Only called for methods which haven't been bound.
+        method = schema.SCHEMA[key]
+
+        # Disallow read-only methods.
+        raise NameError(
+            "Method {} is not allowed in read-only mode.".format(method.name)
+        )
+
+
+def open_async(config: api.Config) -> AsyncAmeritradeAPI:
+    """Create an asyncio API endpoint."""
+    return AsyncAmeritradeAPI(config)
+
+
+class AsyncCallableMethod:
+    """Coroutine callable method."""
+
+    def __init__(self, plan: api.CallPlan, aapi: AsyncAmeritradeAPI):
+        self.plan = plan
+        self.method = plan.method
+        self.api = aapi
+        self.__name__ = plan.name
+        self.__doc__ = plan.method.description
+        self.__signature__ = plan.signature
+        self.flight = aapi.flight if plan.http_method == "GET" else None
+
+    async def __call__(self, **kw):
+        if self.flight is not None:
+            return await self.flight.call(self.plan.cache_key(kw),
+                                          lambda: self.call(**kw))
+        return await self.call(**kw)
+
+    async def call(self, **kw):
+        """Make the call, without coalescing."""
+        request = self.plan.prepare(kw, self.api.config.api_url)
+        control = self.api.rate_control
+        start = time.perf_counter()
+        response_bytes = 0
+        decode_seconds = 0.
+        error = True
+        try:
+            for attempt in range(self.api.config.rate_limit_retries + 1):
+                await self.api.throttle(self.method.name)
+
+                # Call the method and decode the JSON response, if there is one.
+                status, headers, body = await self.send_with_refresh(request)
+                if status == 429:
+                    response = None
+                else:
+                    response_bytes += len(body)
+                    decode_start = time.perf_counter()
+                    response = self.api.decode(body) if body else None
+                    decode_seconds += time.perf_counter() - decode_start
+
+                # Back off and retry if we're over the rate limit.
+                if not throttle.is_rate_limited(status, response):
+                    if control is not None:
+                        control.on_success()
+                    break
+                self.api.metrics.record_rate_limited(self.method.name)
+                if control is not None:
+                    control.on_rate_limited()
+                if attempt < self.api.config.rate_limit_retries:
+                    delay = throttle.retry_delay(headers.get("Retry-After"), attempt)
+                    logging.warning("Rate limited calling %s; retrying in %.1f secs",
+                                    self.method.name, delay)
+                    await asyncio.sleep(delay)
+                elif status == 429:
+                    # Out of retries; don't return None as if the response was
+                    # empty.
+                    raise IOError("HTTP Error {}: {} ({})".format(
+                        status, http.HTTPStatus(status).phrase,
+                        body.decode("utf-8", "replace")))
+            error = status >= 400
+        finally:
+            self.api.metrics.record_call(self.method.name, time.perf_counter() - start,
+                                         response_bytes, decode_seconds, error)
+
+        return response
+
+    async def send_with_refresh(self, request: api.Request):
+        """Issue the HTTP request, refreshing the token if necessary."""
+        secrets = self.api.get_secrets()
+        status, headers, body = await self.send_with_retries(request, secrets)
+        if status == 401:
+            # If the token is expired, refresh the token automatically and retry
+            # once.
+            secrets = await self.api.refresh_secrets(secrets)
+            status, headers, body = await self.send_with_retries(request, secrets)
+            if status != 200:
+                raise IOError("HTTP Error {}: {}".format(
+                    status, body.decode("utf-8", "replace")))
+        return status, headers, body
+
+    async def send_with_retries(self, request: api.Request, secrets: api.Secrets):
+        """Issue the HTTP request, retrying transient errors per the policy."""
+        policy = self.api.config.retry_policy
+        retriable = policy is not None and request.http_method in policy.methods
+        exceptions = RETRY_EXCEPTIONS if retriable else ()
+        for attempt in itertools.count():
+            if attempt > 0:
+                await asyncio.sleep(retry.backoff_delay(policy, attempt - 1))
+                await self.api.throttle(self.method.name)
+            last_attempt = not retriable or attempt + 1 >= policy.max_attempts
+            try:
+                status, headers, body = await self.send(request, secrets)
+            except exceptions as exc:
+                if last_attempt:
+                    raise
+                logging.warning("Error calling %s: %s; retrying", self.method.name, exc)
+            else:
+                if last_attempt or status not in policy.retry_statuses:
+                    return status, headers, body
+                logging.warning("HTTP Error %s calling %s; retrying",
+                                status, self.method.name)
+
+    async def send(self, request: api.Request, secrets: api.Secrets):
+        """Issue the HTTP request. Return the status, headers and body bytes."""
+        headers = auth.get_headers(secrets)
+        headers.update(request.extra_headers)
+        data = (decoding.dumps(request.payload)
+                if request.payload is not None
+                else None)
+        session = self.api.get_session()
+        timeout = aiohttp.ClientTimeout(total=self.api.config.request_timeout)
+        async with session.request(request.http_method, request.url,
+                                   params=request.params, data=data,
+                                   headers=headers, timeout=timeout) as resp:
+            return resp.status, resp.headers, await resp.read()
@@ -0,0 +1,123 @@
+"""Unit tests for the asyncio API."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+import asyncio
+import importlib
+import sys
+
+import pytest
+
+from ameritrade import api
+from ameritrade import async_api
+from ameritrade import credentials
+from ameritrade import mockserver
+
+
+def open_for_test(**kwargs):
+    return async_api.open_async(api.Config(client_id='TEST@AMER.OAUTHAP', **kwargs))
+
+
+def test_requires_aiohttp():
+    with mock.patch.dict(sys.modules, {'aiohttp': None}):
+        del sys.modules['ameritrade.async_api']
+        with pytest.raises(ImportError, match=r'ameritrade\[async\]'):
+            importlib.import_module('ameritrade.async_api')
+
+
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_readonly(_):
+    aapi = open_for_test()
+    with pytest.raises(NameError):
+        aapi.ReplaceSavedOrder
+    assert isinstance(aapi.GetQuote, async_api.AsyncCallableMethod)
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch.object(async_api.AsyncCallableMethod, 'send')
+def test_call(send, _, __):
+    async def run():
+        aapi = open_for_test()
+        with pytest.raises(TypeError):
+            await aapi.GetMovers()
+        send.return_value = (200, {}, b'{"symbol": "SPY", "lastPrice": 420.5}')
+        quote = await aapi.GetQuote(symbol='SPY')
+        assert quote.lastPrice == api.Decimal('420.5')
+        request = send.call_args[0][0]
+        assert request.url.endswith('/marketdata/SPY/quotes')
+    asyncio.run(run())
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('ameritrade.auth.refresh_token')
+def test_refresh_once(refresh, _, __):
+    expired = {'access_token': 'EXPIRED'}
+    fresh = {'access_token': 'FRESH'}
+    refresh.return_value = fresh
+
+    async def send(self, request, secrets):
+        await asyncio.sleep(0)
+        return (200, {}, b'{}') if secrets is fresh else (401, {}, b'')
+
+    async def run():
+        aapi = open_for_test()
+        aapi.secrets = expired
+        with mock.patch.object(async_api.AsyncCallableMethod, 'send', send):
+            await asyncio.gather(*[aapi.GetQuote(symbol=str(i)) for i in range(10)])
+    asyncio.run(run())
+    refresh.assert_called_once()
+
+
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_rate_limited_error(secrets):
+    secrets.return_value = {'token_type': 'Bearer', 'access_token': 'A',
+                            'refresh_token': 'R'}
+    async def run(server):
+        async with open_for_test(api_url=server.url, rate_per_minute=None,
+                                 rate_limit_retries=1) as aapi:
+            # Running out of retries raises rather than returning no response.
+            with pytest.raises(IOError, match='HTTP Error 429'):
+                await aapi.GetQuote(symbol='SPY')
+    with mockserver.MockServer(rate_limit_rate=1., retry_after=0) as server:
+        asyncio.run(run(server))
+        assert server.requests['GetQuote'] == 2
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('ameritrade.auth.refresh_token')
+def test_refresh_from_store(refresh, _, __, tmp_path):
+    expired = {'token_type': 'Bearer', 'access_token': 'EXPIRED', 'refresh_token': 'R'}
+    filename = str(tmp_path / 'secrets.json')
+    credentials.SecretsStore(filename).save(expired)
+
+    async def run():
+        aapi = open_for_test(secrets_file=filename)
+        aapi.secrets = expired
+        # Another process refreshed the token: load it instead of refreshing.
+        credentials.SecretsStore(filename).save(dict(expired, access_token='FRESH'))
+        assert (await aapi.refresh_secrets(expired))['access_token'] == 'FRESH'
+        refresh.assert_not_called()
+        assert aapi.metrics_snapshot().refreshes == 0
+
+        refresh.return_value = dict(expired, access_token='NEWER')
+        assert (await aapi.refresh_secrets(aapi.secrets))['access_token'] == 'NEWER'
+        assert aapi.metrics_snapshot().refreshes == 1
+    asyncio.run(run())
+
+
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_shared_throttle(_):
+    aapi = open_for_test(rate_per_minute=10, rate_burst=5)
+    sleeps = []
+    async def sleep(dt):
+        sleeps.append(dt)
+    async def run():
+        with mock.patch('asyncio.sleep', sleep):
+            await asyncio.gather(*[aapi.throttle() for _ in range(8)])
+    asyncio.run(run())
+    # The first five calls go through, the next three wait their turn.
+    assert sleeps == pytest.approx([12, 24, 36], abs=0.1)
@@ -3,7 +3,7 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 from os import path
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Optional
 from urllib.parse import parse_qs
 from urllib.parse import urlencode
 from urllib.parse import urlparse
@@ -15,58 +15,103 @@ import socket
 import socketserver
 import ssl
 import threading
+import time
 import webbrowser
 
+from ameritrade import credentials
 
 DEFAULT_REDIRECT_URI = 'https://localhost:8444'
 
+DEFAULT_API_URL = 'https://api.tdameritrade.com/v1'
+
 
 Secrets = Dict[str, str]
 
 
-def read_or_create_secrets(config) -> Secrets:
-    """Initialize the secrets file."""
+def stamp_expiry(secrets: Secrets, issued: Optional[float] = None) -> Secrets:
+    """Add the absolute expiry time of the access token to fresh secrets.
 
-    # Try to load the secrets file from disk.
-    filename = config.secrets_file
-    if filename and path.exists(filename):
-        with open(filename) as infile:
-            secrets = json.load(infile)
-    else:
-        # We have to authenticate.
-        secrets = authenticate(config)
+    The 'expires_at' timestamp is computed from the relative 'expires_in' and
+    the time the token was issued, now by default.
+    """
+    if isinstance(secrets, dict) and secrets.get('expires_in') is not None:
+        issued = time.time() if issued is None else issued
+        secrets['expires_at'] = issued + float(secrets['expires_in'])
+    return secrets
 
-        # Store the updated secrets to disk for the next time.
-        if filename:
-            with open(filename, 'w') as outfile:
-                json.dump(secrets, outfile)
 
-    return secrets
+def token_expiry(secrets: Optional[Secrets]) -> Optional[float]:
+    """Return the time at which the access token expires, if known."""
+    if not isinstance(secrets, dict):
+        return None
+    expires_at = secrets.get('expires_at')
+    return float(expires_at) if isinstance(expires_at, (int, float)) else None
 
 
-def refresh_secrets(config, secrets: Secrets) -> Secrets:
-    """Attempt to refresh the token."""
+def read_or_create_secrets(config,
+                          store: Optional[credentials.SecretsStore] = None) -> Secrets:
+    """Initialize the secrets file.
+
+    Args:
+      config: The API configuration.
+      store: The store of the secrets file, by default that of the configuration.
+    """
+    if store is None:
+        store = credentials.open_store(config)
+    if store is None:
+        return stamp_expiry(authenticate(config))
+    # Authenticate if there are no valid secrets on disk, storing the new secrets
+    # for the next time.
+    return store.load_or_create(lambda: stamp_expiry(authenticate(config)))
+
+
+def refresh_token(config, secrets: Secrets,
+                  session: Optional[requests.Session] = None,
+                  interactive: bool = True) -> Secrets:
+    """Attempt to refresh the token, without storing the new secrets.
+
+    Args:
+      config: The API configuration.
+      secrets: The current (expired) secrets.
+      session: An optional HTTP session whose pooled connections to use.
+      interactive: Whether to authenticate again in a browser if the refresh
+        fails. If not, an IOError is raised instead.
+    """
 
     # Attempt to generate a refresh token.
     logging.warning("Secrets expired or invalid; refreshing.")
-    secrets = get_refresh_token(config.client_id, secrets["refresh_token"])
-    filename = config.secrets_file
+    secrets = get_refresh_token(config.client_id, secrets["refresh_token"], session,
+                                getattr(config, 'api_url', DEFAULT_API_URL))
     if (isinstance(secrets, dict) and
         'access_token' in secrets and 'refresh_token' in secrets):
         # Success; Override the secrets and return.
         logging.warning("Successfully refreshed authentication token.")
+        stamp_expiry(secrets)
+    elif not interactive:
+        raise IOError("Could not refresh access token: {}".format(secrets))
     else:
         # We have to authenticate.
         logging.warning("Could not refresh access token; re-authenticating.")
-        secrets = authenticate(config)
+        secrets = stamp_expiry(authenticate(config))
         logging.warning("Successfully re-authenticated token.")
+    return secrets
 
-    # Store the updated secrets to disk for the next time.
-    if filename:
-        with open(filename, 'w') as outfile:
-            json.dump(secrets, outfile)
 
-    return secrets
+def refresh_secrets(config, secrets: Secrets,
+                    session: Optional[requests.Session] = None,
+                    interactive: bool = True,
+                    store: Optional[credentials.SecretsStore] = None) -> Secrets:
+    """Attempt to refresh the token, and store the new secrets.
+
+    If another process has already refreshed the token in the secrets file, its
+    secrets are returned instead. See refresh_token() for the arguments.
+    """
+    if store is None:
+        store = credentials.open_store(config)
+    if store is None:
+        return refresh_token(config, secrets, session, interactive)
+    return store.refresh(secrets, lambda expired: refresh_token(
+        config, expired, session, interactive))
 
 
 def test_secrets(secrets) -> bool:
@@ -129,15 +174,19 @@ def gather_token(config):
             logging.info('Server: done')
             thread.join()
 
+    if not credentials.is_valid(server.secrets):
+        raise IOError("Did not receive a token; authentication failed or timed out.")
     return server.secrets
 
 
-def get_refresh_token(client_id, token):
+def get_refresh_token(client_id, token, session=None, api_url=DEFAULT_API_URL):
     """Attempt to refresh the token.
 
     Args:
       client_id: The client id.
       token: The refresh token.
+      session: An optional requests.Session to issue the request with.
+      api_url: The base URL of the API.
     """
     # Post access token request.
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
@@ -145,9 +194,10 @@ def get_refresh_token(client_id, token):
             'refresh_token': token,
             'access_type': 'offline',
             'client_id': client_id}
-    resp = requests.post('https://api.tdameritrade.com/v1/oauth2/token',
-                         data=data,
-                         headers=headers)
+    post = session.post if session is not None else requests.post
+    resp = post(api_url + '/oauth2/token',
+                data=data,
+                headers=headers)
     return resp.json()
 
 
@@ -199,7 +249,7 @@ class TokenHandler(http.server.BaseHTTPRequestHandler):
             self.end_headers()
 
             # Stash the response contents into the server.
-            server.secrets = resp.json()
+            server.secrets = stamp_expiry(resp.json())
             server.event.set()
 
             self.wfile.write(b'OK.')
@@ -210,6 +260,64 @@ class TokenHandler(http.server.BaseHTTPRequestHandler):
         logging.info("Handler: done")
 
 
+class TokenRefresher:
+    """A daemon thread refreshing the access token shortly before it expires.
+
+    This saves the calls made around the expiry from a 401 response, a refresh
+    and a second request. The thread sleeps until 'margin' seconds before the
+    expiry of the current secrets, then refreshes them. Failures are logged and
+    retried; calls still refresh the token themselves on 401 responses.
+    """
+
+    # The maximum time to sleep before checking the secrets again, in seconds,
+    # e.g., while their expiry is unknown.
+    POLL_INTERVAL = 60.
+
+    # The minimum time between two refreshes, in seconds, so that the thread
+    # never spins, e.g., with a zero margin or a failing refresh.
+    MIN_INTERVAL = 1.
+
+    def __init__(self, get_secrets: Callable[[], Optional[Secrets]],
+                 refresh: Callable[[Secrets], Any], margin: float):
+        """Start refreshing.
+
+        Args:
+          get_secrets: A function returning the current secrets, if loaded.
+          refresh: A function refreshing the secrets passed to it.
+          margin: The number of seconds before the expiry to refresh at.
+        """
+        self.get_secrets = get_secrets
+        self.refresh = refresh
+        self.margin = margin
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='token-refresh',
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            secrets = self.get_secrets()
+            expires_at = token_expiry(secrets)
+            delay = (self.POLL_INTERVAL if expires_at is None else
+                     min(self.POLL_INTERVAL, expires_at - self.margin - time.time()))
+            if delay > 0:
+                self.stopped.wait(delay)
+                continue
+            delay = self.MIN_INTERVAL
+            try:
+                self.refresh(secrets)
+            except Exception as exc:
+                logging.warning("Could not refresh the token ahead of expiry: %s", exc)
+                delay = max(delay, min(self.POLL_INTERVAL, self.margin / 2))
+            self.stopped.wait(delay)
+
+    def stop(self):
+        """Stop the thread."""
+        self.stopped.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+
 def get_headers(secrets) -> Dict[str, str]:
     """Get the token headers to include."""
     auth = '{} {}'.format(secrets['token_type'],
@@ -0,0 +1,344 @@
+"""Caches for the responses of the API.
+
+There are two tiers:
+
+- CacheStore, on disk: all the responses are stored in a single SQLite database
+  in the cache directory, compressed, and indexed by a digest of the method and
+  its arguments. Entries expire after a time-to-live which can be set per
+  method, and the least recently used entries are evicted when the total size
+  of the payloads goes over a maximum. The same store can be shared by threads
+  and processes.
+
+- MemoryCache, in the process: the decoded responses are kept in memory, in
+  front of the disk store and the server. The time-to-live of its entries
+  depends on the method and on whether the market is open (see MemoryTtl).
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, NamedTuple, Optional
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+# The name of the database file in the cache directory.
+CACHE_FILENAME = 'cache.sqlite'
+
+# The level of compression of the payloads. Responses are mostly repeated
+# field names and compress well even at the fastest levels.
+COMPRESSION_LEVEL = 1
+
+# When the store goes over its maximum size, evict down to this fraction of it,
+# so that we don't evict on every insertion.
+EVICTION_RATIO = 0.9
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        method TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+    CREATE TABLE IF NOT EXISTS total (size INTEGER NOT NULL);
+    INSERT INTO total SELECT 0 WHERE NOT EXISTS (SELECT * FROM total);
+    CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+        UPDATE total SET size = size + new.size;
+    END;
+    CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+        UPDATE total SET size = size - old.size;
+    END;
+"""
+
+
+# Statistics on the use of a cache store.
+CacheStats = NamedTuple('CacheStats', [
+    # Number of lookups which found a live entry.
+    ('hits', int),
+    # Number of lookups which didn't, including those of expired entries.
+    ('misses', int),
+    # Number of entries found expired.
+    ('expired', int),
+    # Number of entries evicted to stay within the maximum size.
+    ('evictions', int),
+    # Number of entries, and total size of their payloads in bytes: compressed
+    # on disk, and approximated by their encoded size in memory.
+    ('entries', int),
+    ('size', int),
+])
+
+
+class CacheStore:
+    """A size-bounded store of compressed responses, in an SQLite database."""
+
+    def __init__(self, filename: str,
+                 max_bytes: Optional[int] = None,
+                 default_ttl: Optional[float] = None,
+                 ttls: Optional[Dict[str, Optional[float]]] = None,
+                 negative_ttl: Optional[float] = None):
+        """Open or create a store.
+
+        Args:
+          filename: The database file.
+          max_bytes: The maximum total size of the compressed payloads, or None
+            for no limit.
+          default_ttl: The time-to-live of entries in seconds, or None for
+            entries which never expire.
+          ttls: Overrides of the time-to-live by method name.
+          negative_ttl: The time-to-live of empty and error responses, in
+            seconds, if they are stored.
+        """
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, timeout=30,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def ttl(self, method_name: str) -> Optional[float]:
+        """Return the time-to-live of the entries of a method."""
+        return self.ttls.get(method_name, self.default_ttl)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the payload of a live entry, or None."""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT payload, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            payload, expires = row
+            if expires is not None and expires <= now:
+                self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.misses += 1
+                self.expired += 1
+                return None
+            self.connection.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                                    (now, key))
+            self.hits += 1
+        return zlib.decompress(payload)
+
+    def put(self, key: str, method_name: str, data: bytes, negative: bool = False):
+        """Store the payload of an entry, evicting old entries if necessary.
+
+        Negative entries, i.e., empty and error responses, expire after the
+        shortest of 'negative_ttl' and the time-to-live of the method.
+        """
+        payload = zlib.compress(data, COMPRESSION_LEVEL)
+        now = time.time()
+        ttl = self.ttl(method_name)
+        if negative and self.negative_ttl is not None:
+            ttl = self.negative_ttl if ttl is None else min(ttl, self.negative_ttl)
+        expires = now + ttl if ttl is not None else None
+        with self.lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                connection.execute(
+                    'INSERT INTO entries (key, method, payload, size, expires, accessed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, method_name, payload, len(payload), expires, now))
+                if self.max_bytes is not None:
+                    self._evict(now)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def _evict(self, now: float):
+        """Evict the expired entries, then the least recently used ones."""
+        connection = self.connection
+        (size,), = connection.execute('SELECT size FROM total')
+        if size <= self.max_bytes:
+            return
+        count = connection.execute('DELETE FROM entries WHERE expires <= ?',
+                                   (now,)).rowcount
+        target = int(self.max_bytes * EVICTION_RATIO)
+        freed = 0
+        (size,), = connection.execute('SELECT size FROM total')
+        keys = []
+        if size > target:
+            for key, entry_size in connection.execute(
+                    'SELECT key, size FROM entries ORDER BY accessed'):
+                keys.append((key,))
+                freed += entry_size
+                if size - freed <= target:
+                    break
+            connection.executemany('DELETE FROM entries WHERE key = ?', keys)
+        self.evictions += count + len(keys)
+        logging.info("Evicted %d entries from the cache", count + len(keys))
+
+    def clear(self):
+        """Remove all the entries."""
+        with self.lock:
+            self.connection.execute('DELETE FROM entries')
+
+    def stats(self) -> CacheStats:
+        """Return statistics on the use of the store."""
+        with self.lock:
+            (entries,), = self.connection.execute('SELECT COUNT(*) FROM entries')
+            (size,), = self.connection.execute('SELECT size FROM total')
+            return CacheStats(self.hits, self.misses, self.expired, self.evictions,
+                              entries, size)
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.connection.close()
+
+
+def open_store(cache_dir: str, max_bytes: Optional[int] = None,
+               default_ttl: Optional[float] = None,
+               ttls: Optional[Dict[str, Optional[float]]] = None,
+               negative_ttl: Optional[float] = None) -> CacheStore:
+    """Open the store of a cache directory, creating it if necessary."""
+    os.makedirs(cache_dir, exist_ok=True)
+    return CacheStore(path.join(cache_dir, CACHE_FILENAME), max_bytes,
+                      default_ttl, ttls, negative_ttl)
+
+
+def is_negative(response: Any) -> bool:
+    """Return true for an empty or error response.
+
+    Those get cached for a short time only, so that calls which can't succeed,
+    e.g., quotes for invalid symbols, don't get repeated too often. Calls
+    without any response (None) are not cached at all.
+    """
+    if not response:
+        return True
+    return isinstance(response, dict) and (
+        'error' in response or response.get('empty') is True)
+
+
+# The time-to-lives of the responses of a method in the memory cache, in
+# seconds, while the market is open and while it is closed. A 'closed' value
+# of None holds the responses until the next open.
+MemoryTtl = NamedTuple('MemoryTtl', [
+    ('open', float),
+    ('closed', Optional[float]),
+])
+
+_DAY = 24 * 60 * 60.
+
+# The default time-to-lives in the memory cache. The responses of the other
+# methods, e.g., accounts and orders, are not kept in memory.
+DEFAULT_MEMORY_TTLS = {
+    'GetQuote': MemoryTtl(1., None),
+    'GetQuotes': MemoryTtl(1., None),
+    'GetOptionChain': MemoryTtl(1., None),
+    'GetPriceHistory': MemoryTtl(5., None),
+    'GetMovers': MemoryTtl(60., None),
+    'GetInstrument': MemoryTtl(_DAY, _DAY),
+    'SearchInstruments': MemoryTtl(_DAY, _DAY),
+    'GetHoursSingleMarket': MemoryTtl(_DAY, _DAY),
+    'GetHoursMultipleMarkets': MemoryTtl(_DAY, _DAY),
+}
+
+
+def memory_expiry(ttl: MemoryTtl, hours: Any, now: float) -> float:
+    """Return the time at which an entry stored now expires.
+
+    Args:
+      ttl: The time-to-lives of the entry.
+      hours: A hours.MarketHours, used if the time-to-lives differ.
+      now: The current time.
+    Returns:
+      A timestamp.
+    """
+    if ttl.open == ttl.closed:
+        return now + ttl.open
+    try:
+        if hours.is_open(now):
+            return now + ttl.open
+        if ttl.closed is not None:
+            return now + ttl.closed
+        next_open = hours.next_open(now)
+    except IOError:
+        # Without the hours, be conservative and assume the market is open.
+        return now + ttl.open
+    return next_open if next_open is not None else now + ttl.open
+
+
+class MemoryCache:
+    """An in-process LRU cache of decoded responses, bounded by count and bytes.
+
+    The values are returned as stored, without copying; they must not be
+    modified by the callers.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # The entries, as (value, size, expires), from least to most recently used.
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the value of a live entry, or the default."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[2] <= time.time():
+                del self.entries[key]
+                self.size -= entry[1]
+                self.misses += 1
+                self.expired += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any, size: int, expires: float):
+        """Store a value, evicting the least recently used entries if necessary."""
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            entries = self.entries
+            old = entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            entries[key] = (value, size, expires)
+            self.size += size
+            while len(entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, old_size, _) = entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all the entries."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> CacheStats:
+        """Return statistics on the use of the cache."""
+        with self.lock:
+            return CacheStats(self.hits, self.misses, self.expired, self.evictions,
+                              len(self.entries), self.size)
@@ -0,0 +1,244 @@
+"""Unit tests for the cache store."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from decimal import Decimal
+from os import path
+from unittest import mock
+import json
+import os
+
+import pytest
+import requests
+
+from ameritrade import api
+from ameritrade import cache
+from ameritrade import decoding
+from ameritrade import mockserver
+
+
+def test_get_put(tmp_path):
+    store = cache.open_store(str(tmp_path / 'cache'))
+    assert path.exists(str(tmp_path / 'cache' / cache.CACHE_FILENAME))
+    assert store.get('a') is None
+    store.put('a', 'GetQuote', b'{"SPY": {}}')
+    store.put('a', 'GetQuote', b'{"QQQ": {}}')
+    assert store.get('a') == b'{"QQQ": {}}'
+    stats = store.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (1, 1, 1)
+    assert stats.size > 0
+    store.close()
+
+    # The entries persist.
+    store = cache.open_store(str(tmp_path / 'cache'))
+    assert store.get('a') == b'{"QQQ": {}}'
+    store.clear()
+    assert store.stats().size == 0
+
+
+@mock.patch('time.time')
+def test_ttls(time, tmp_path):
+    time.return_value = 1000.
+    store = cache.open_store(str(tmp_path), default_ttl=60, ttls={'GetAccounts': None})
+    store.put('quote', 'GetQuote', b'1')
+    store.put('accounts', 'GetAccounts', b'2')
+    time.return_value = 1059.
+    assert store.get('quote') == b'1'
+    time.return_value = 1061.
+    assert store.get('quote') is None
+    assert store.get('accounts') == b'2'
+    assert store.stats().expired == 1
+    assert store.stats().entries == 1
+
+
+@mock.patch('time.time')
+def test_lru_eviction(time, tmp_path):
+    store = cache.open_store(str(tmp_path), max_bytes=1100)
+    data = os.urandom(300)  # Incompressible.
+    for index, key in enumerate('abc'):
+        time.return_value = 1000. + index
+        store.put(key, 'GetQuote', data)
+    time.return_value = 1010.
+    assert store.get('a') == data
+
+    # Inserting 'd' goes over the maximum; 'b' is the least recently used.
+    store.put('d', 'GetQuote', data)
+    assert store.get('b') is None
+    assert store.get('a') == store.get('c') == store.get('d') == data
+    stats = store.stats()
+    assert stats.evictions == 1
+    assert stats.size <= 1100
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_cached_method(_, __, tmp_path):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               cache_dir=str(tmp_path), cache_ttls={'GetQuote': 60}))
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = json.dumps({'SPY': {'lastPrice': 1.5}}).encode('utf8')
+    with mock.patch.object(iapi.session, 'request', return_value=resp) as request:
+        assert iapi.GetQuote(symbol='SPY') == {'SPY': {'lastPrice': 1.5}}
+        assert iapi.GetQuote(symbol='SPY') == {'SPY': {'lastPrice': 1.5}}
+    assert request.call_count == 1
+    assert iapi.cache.ttl('GetQuote') == 60
+    assert iapi.cache.stats().hits == 1
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_cached_method_exact(_, __, tmp_path):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               cache_dir=str(tmp_path), json_decoder='decimal'))
+    price = Decimal('420.123456789012345678901')
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = '{{"SPY": {{"lastPrice": {}}}}}'.format(price).encode('utf8')
+    with mock.patch.object(iapi.session, 'request', return_value=resp) as request, \
+         mock.patch.object(decoding, 'json', None):
+        assert iapi.GetQuote(symbol='SPY').SPY.lastPrice == price
+        # The cached response decodes to the same number.
+        cached = iapi.GetQuote(symbol='SPY').SPY.lastPrice
+    assert request.call_count == 1
+    assert isinstance(cached, Decimal) and cached == price
+    iapi.close()
+
+
+def test_memory_expiry():
+    market = mock.Mock()
+    market.is_open.return_value = True
+    market.next_open.return_value = 5000.
+    ttl = cache.MemoryTtl(1., None)
+    assert cache.memory_expiry(ttl, market, 1000.) == 1001.
+    market.is_open.return_value = False
+    assert cache.memory_expiry(ttl, market, 1000.) == 5000.
+    assert cache.memory_expiry(cache.MemoryTtl(1., 60.), market, 1000.) == 1060.
+    market.is_open.side_effect = IOError()
+    assert cache.memory_expiry(ttl, market, 1000.) == 1001.
+    assert cache.memory_expiry(cache.MemoryTtl(60., 60.), None, 1000.) == 1060.
+
+
+@mock.patch('time.time', return_value=1000.)
+def test_memory_cache(time):
+    memory = cache.MemoryCache(max_entries=2, max_bytes=100)
+    memory.put('a', 'A', 10, 1010.)
+    memory.put('b', 'B', 10, 1001.)
+    assert memory.get('a') == 'A'
+    memory.put('c', 'C', 10, 1010.)
+    assert memory.get('b') is None  # Evicted.
+    memory.put('d', 'D', 85, 1010.)
+    assert memory.get('a') is None  # Evicted for space.
+    assert memory.get('c') == 'C'
+    time.return_value = 1010.
+    assert memory.get('c') is None  # Expired.
+    assert memory.stats() == cache.CacheStats(hits=2, misses=3, expired=1,
+                                              evictions=2, entries=1, size=85)
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_memory_cached_method(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               memory_cache=True,
+                               memory_cache_ttls={'GetInstrument': None}))
+    assert isinstance(iapi.GetInstrument, api.CallableMethod)
+    assert isinstance(iapi.GetAccounts, api.CallableMethod)
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = json.dumps({'SPY': {'lastPrice': 1.5}}).encode('utf8')
+    with mock.patch.object(iapi.market_hours, 'is_open', return_value=True), \
+         mock.patch.object(iapi.session, 'request', return_value=resp) as request:
+        first = iapi.GetQuote(symbol='SPY')
+        assert iapi.GetQuote(symbol='SPY') is first
+        iapi.GetQuote(symbol='QQQ')
+    assert request.call_count == 2
+    assert iapi.memory_cache.stats().hits == 1
+    # The entries are sized by the bodies of the responses.
+    assert iapi.memory_cache.stats().size == 2 * len(resp.content)
+    iapi.close()
+
+
+def test_memory_cached_method_sizes(tmp_path, open_client, server):
+    iapi = open_client(server, memory_cache=True, cache_dir=str(tmp_path))
+    with mock.patch.object(iapi.market_hours, 'is_open', return_value=True):
+        iapi.GetQuote(symbol='SPY')
+        size = iapi.memory_cache.stats().size
+        assert size > 0
+        # Entries filled from the disk cache are sized by the cached body.
+        iapi.memory_cache.clear()
+        iapi.GetQuote(symbol='SPY')
+    key = iapi.GetQuote.plan.cache_key(dict(symbol='SPY'))
+    assert iapi.memory_cache.stats().size == len(iapi.cache.get(key))
+
+
+def test_is_negative():
+    assert cache.is_negative(None)
+    assert cache.is_negative({})
+    assert cache.is_negative([])
+    assert cache.is_negative({'error': 'Not Found'})
+    assert cache.is_negative({'candles': [], 'empty': True, 'symbol': 'XYZ'})
+    assert not cache.is_negative({'SPY': {}})
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('time.time')
+def test_negative_caching(time, _, __, tmp_path):
+    time.return_value = 1000.
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               readonly=False, cache_dir=str(tmp_path),
+                               cache_negative_ttl=30, rate_limit_retries=0))
+
+    # Methods which change state are not cached.
+    assert isinstance(iapi.PlaceOrder, api.CallableMethod)
+    assert isinstance(iapi.GetQuote, api.CachedMethod)
+
+    empty = requests.Response()
+    empty.status_code = 200
+    empty._content = json.dumps({}).encode('utf8')
+    with mock.patch.object(iapi.session, 'request', return_value=empty) as request:
+        assert iapi.GetQuote(symbol='XYZ') == {}
+        assert iapi.GetQuote(symbol='XYZ') == {}
+        assert request.call_count == 1
+        time.return_value = 1031.
+        assert iapi.GetQuote(symbol='XYZ') == {}
+        assert request.call_count == 2
+
+    # Rate-limited responses are never cached.
+    limited = requests.Response()
+    limited.status_code = 200
+    limited._content = json.dumps(
+        {'error': 'Individual App\'s transactions per seconds restriction reached.'}
+    ).encode('utf8')
+    with mock.patch.object(iapi.session, 'request', return_value=limited):
+        iapi.GetQuote(symbol='QQQ')
+    assert iapi.cache.get(iapi.GetQuote.plan.cache_key(dict(symbol='QQQ'))) is None
+
+    # Neither are missing responses.
+    nothing = requests.Response()
+    nothing.status_code = 200
+    nothing._content = b''
+    with mock.patch.object(iapi.session, 'request', return_value=nothing) as request:
+        assert iapi.GetQuote(symbol='IWM') is None
+        assert iapi.GetQuote(symbol='IWM') is None
+        assert request.call_count == 2
+    iapi.close()
+
+
+@pytest.mark.parametrize('memory_cache', [False, True])
+def test_rate_limited_not_cached(memory_cache, tmp_path, open_client):
+    with mockserver.MockServer(rate_limit_rate=1., retry_after=0) as server:
+        iapi = open_client(server, rate_limit_retries=0, cache_dir=str(tmp_path),
+                           memory_cache=memory_cache, cache_negative_ttl=30)
+        key = api.compile_plans()['GetQuote'].cache_key(dict(symbol='SPY'))
+        with pytest.raises(IOError):
+            iapi.GetQuote(symbol='SPY')
+        assert iapi.cache.get(key) is None
+
+        # Once the server recovers, the next call reaches it.
+        server.rate_limit_rate = 0.
+        assert 'SPY' in iapi.GetQuote(symbol='SPY')
+        assert server.requests['GetQuote'] == 2
+        assert iapi.cache.get(key) is not None
@@ -0,0 +1,81 @@
+"""Unit tests for the conversion of option chains to columns."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import datetime
+import json
+import math
+
+import pytest
+
+from ameritrade import chains
+from ameritrade import decoding
+from ameritrade import examples
+
+numpy = pytest.importorskip('numpy')
+
+
+def contracts(chain):
+    """Walk the contracts of a chain, as (expiration, side, contract)."""
+    for side, map_name in (('C', 'callExpDateMap'), ('P', 'putExpDateMap')):
+        for key, strikes in chain[map_name].items():
+            expiration = datetime.date.fromisoformat(key.split(':')[0])
+            for contract_list in strikes.values():
+                for contract in contract_list:
+                    yield expiration, side, contract
+
+
+@pytest.mark.parametrize('decode', [json.loads, decoding.decode_fast,
+                                    decoding.decode_decimal])
+def test_chain_columns(decode):
+    chain = decode(json.dumps(examples.synthesize_option_chain(3, 4)))
+    columns = chains.chain_columns(chain)
+    assert list(columns) == chains.COLUMNS
+    expected = list(contracts(chain))
+    assert all(len(array) == len(expected) == 24 for array in columns.values())
+
+    assert columns['expiration'].dtype == numpy.dtype('datetime64[D]')
+    assert columns['expiration'].tolist() == [exp for exp, _, _ in expected]
+    assert columns['side'].tolist() == [side for _, side, _ in expected]
+    for name, field, kind in chains.CONTRACT_COLUMNS:
+        array = columns[name]
+        assert array.flags.c_contiguous
+        if kind == 'str':
+            assert array.dtype.kind == 'U'
+        else:
+            assert array.dtype == numpy.dtype(chains._DTYPES[kind])
+        if kind == 'float':
+            assert array.tolist() == pytest.approx(
+                [float(contract[field]) for _, _, contract in expected])
+        else:
+            assert array.tolist() == [contract[field] for _, _, contract in expected]
+
+
+def test_chain_columns_selection():
+    chain = examples.synthesize_option_chain(2, 3)
+    columns = chains.chain_columns(chain, ['strike', 'side', 'bid'])
+    assert list(columns) == ['strike', 'side', 'bid']
+    assert columns['strike'].tolist() == [100., 105., 110.] * 4
+    assert columns['side'].tolist() == ['C'] * 6 + ['P'] * 6
+    with pytest.raises(ValueError):
+        chains.chain_columns(chain, ['strike', 'strikePrice'])
+
+
+def test_chain_columns_missing():
+    chain = examples.synthesize_option_chain(1, 2)
+    first, second = [contract for _, _, contract in contracts(chain)][:2]
+    del first['delta']
+    first['openInterest'] = None
+    second['volatility'] = 'NaN'
+    columns = chains.chain_columns(chain, ['delta', 'open_interest', 'volatility'])
+    assert math.isnan(columns['delta'][0])
+    assert columns['open_interest'][0] == 0
+    assert math.isnan(columns['volatility'][1])
+    assert columns['delta'][1] == second['delta']
+
+
+def test_chain_columns_empty():
+    columns = chains.chain_columns({'symbol': 'SPY', 'status': 'FAILED'})
+    assert list(columns) == chains.COLUMNS
+    assert all(len(array) == 0 for array in columns.values())
+    assert columns['strike'].dtype == numpy.float64
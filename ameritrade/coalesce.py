@@ -0,0 +1,123 @@
+"""Coalescing of identical concurrent calls ("single-flight").
+
+When several threads or coroutines make the same call at the same time, only
+the first one, the leader, actually makes it; the others wait for its result
+and share it. Calls are identified by a key, e.g., CallPlan.cache_key().
+
+The result is shared as is by default. With 'copy' set, the callers which
+shared a result each get their own deep copy of it, so that they may modify it
+independently.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Awaitable, Callable, Dict, NamedTuple
+import asyncio
+import concurrent.futures
+import copy as copylib
+import threading
+
+
+# Statistics on the coalescing of calls.
+CoalesceStats = NamedTuple('CoalesceStats', [
+    # Number of calls made by a leader.
+    ('calls', int),
+    # Number of calls which shared the result of a leader instead.
+    ('shared', int),
+])
+
+
+class _Flight:
+    """A call in flight, and the number of callers waiting for it."""
+
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls made from threads."""
+
+    def __init__(self, copy: bool = False):
+        self.copy = copy
+        self.lock = threading.Lock()
+        self.flights: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def call(self, key: str, function: Callable[[], Any]) -> Any:
+        """Call a function, or wait for the result of the same call in flight."""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight(concurrent.futures.Future())
+                self.calls += 1
+            else:
+                flight.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            result = flight.future.result()
+            return copylib.deepcopy(result) if self.copy else result
+
+        try:
+            result = function()
+        except BaseException as exc:
+            self._land(key)
+            flight.future.set_exception(exc)
+            raise
+        waiters = self._land(key)
+        # Copy the result for the leader before the waiters get it.
+        own = copylib.deepcopy(result) if self.copy and waiters else result
+        flight.future.set_result(result)
+        return own
+
+    def _land(self, key: str) -> int:
+        """Remove a call from the flights. Return the number of its waiters."""
+        with self.lock:
+            return self.flights.pop(key).waiters
+
+    def stats(self) -> CoalesceStats:
+        """Return statistics on the coalescing of calls."""
+        with self.lock:
+            return CoalesceStats(self.calls, self.shared)
+
+
+class AsyncSingleFlight:
+    """Coalesces identical concurrent calls made from coroutines of one event loop."""
+
+    def __init__(self, copy: bool = False):
+        self.copy = copy
+        self.flights: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def call(self, key: str, function: Callable[[], Awaitable[Any]]) -> Any:
+        """Await a coroutine, or the result of the same call in flight."""
+        flight = self.flights.get(key)
+        if flight is None:
+            # Run the call in its own task, so that cancelling the caller which
+            # started it doesn't cancel it for the others.
+            task = asyncio.ensure_future(function())
+            flight = self.flights[key] = _Flight(task)
+            task.add_done_callback(lambda _: self._land(key, flight))
+            self.calls += 1
+        else:
+            flight.waiters += 1
+            self.shared += 1
+        # Shield the call so that cancelling a caller doesn't cancel it.
+        result = await asyncio.shield(flight.future)
+        return copylib.deepcopy(result) if self.copy and flight.waiters else result
+
+    def _land(self, key: str, flight: _Flight):
+        """Remove a call from the flights, once done."""
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        # Retrieve the error, which may have been left to no caller.
+        if not flight.future.cancelled():
+            flight.future.exception()
+
+    def stats(self) -> CoalesceStats:
+        """Return statistics on the coalescing of calls."""
+        return CoalesceStats(self.calls, self.shared)
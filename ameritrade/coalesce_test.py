@@ -0,0 +1,144 @@
+"""Unit tests for the coalescing of calls."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+import pytest
+import requests
+
+from ameritrade import api
+from ameritrade import coalesce
+
+
+def run_concurrently(flight, key, function, count):
+    """Make the same call from 'count' threads, released when they all wait."""
+    with concurrent.futures.ThreadPoolExecutor(count) as executor:
+        futures = [executor.submit(flight.call, key, function) for _ in range(count)]
+        return [future.result() for future in futures]
+
+
+def make_function(release, result):
+    calls = []
+    def function():
+        calls.append(1)
+        release.wait(5)
+        return result
+    return function, calls
+
+
+def test_single_flight():
+    flight = coalesce.SingleFlight()
+    release = threading.Event()
+    result = {'SPY': {}}
+    function, calls = make_function(release, result)
+    threading.Timer(0.2, release.set).start()
+    results = run_concurrently(flight, 'key', function, 4)
+    assert len(calls) == 1
+    assert all(value is result for value in results)
+    assert flight.stats() == coalesce.CoalesceStats(calls=1, shared=3)
+
+    # Calls made after the first one completed are not shared.
+    assert flight.call('key', function) is result
+    assert len(calls) == 2
+
+
+def test_single_flight_copy():
+    flight = coalesce.SingleFlight(copy=True)
+    release = threading.Event()
+    result = {'SPY': {}}
+    function, _ = make_function(release, result)
+    threading.Timer(0.2, release.set).start()
+    results = run_concurrently(flight, 'key', function, 3)
+    assert all(value == result for value in results)
+    assert len(set(map(id, results))) == 3
+
+
+def test_single_flight_error():
+    flight = coalesce.SingleFlight()
+    release = threading.Event()
+    def function():
+        release.wait(5)
+        raise IOError("HTTP Error 500")
+    threading.Timer(0.2, release.set).start()
+    with pytest.raises(IOError):
+        run_concurrently(flight, 'key', function, 3)
+    assert not flight.flights
+
+
+def test_async_single_flight():
+    async def run():
+        flight = coalesce.AsyncSingleFlight(copy=True)
+        calls = []
+        async def function():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'SPY': {}}
+        results = await asyncio.gather(*[flight.call('key', function)
+                                         for _ in range(3)])
+        assert len(calls) == 1
+        assert results == [{'SPY': {}}] * 3
+        assert len(set(map(id, results))) == 3
+        assert flight.stats() == coalesce.CoalesceStats(calls=1, shared=2)
+    asyncio.run(run())
+
+
+def test_async_single_flight_cancel():
+    async def run():
+        flight = coalesce.AsyncSingleFlight()
+        calls = []
+        async def function():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'SPY': {}}
+        leader = asyncio.ensure_future(flight.call('key', function))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.call('key', function))
+        await asyncio.sleep(0)
+
+        # Cancelling the leader doesn't cancel the call shared by the waiter.
+        leader.cancel()
+        assert await waiter == {'SPY': {}}
+        assert leader.cancelled()
+        assert len(calls) == 1
+        assert not flight.flights
+    asyncio.run(run())
+
+
+def test_async_single_flight_error():
+    async def run():
+        flight = coalesce.AsyncSingleFlight()
+        async def function():
+            await asyncio.sleep(0.01)
+            raise IOError("HTTP Error 500")
+        results = await asyncio.gather(*[flight.call('key', function)
+                                         for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, IOError) for result in results)
+        assert not flight.flights
+    asyncio.run(run())
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_coalesced_method(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               coalesce=True))
+    assert isinstance(iapi.GetQuotes, api.CoalescedMethod)
+
+    release = threading.Event()
+    def request(*args, **kw):
+        release.wait(5)
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = json.dumps({'SPY': {}, 'QQQ': {}}).encode('utf8')
+        return resp
+    threading.Timer(0.2, release.set).start()
+    with mock.patch.object(iapi.session, 'request', side_effect=request) as mock_request:
+        results = iapi.map('GetQuotes', [dict(symbol='SPY,QQQ'), dict(symbol='QQQ,SPY')])
+    assert mock_request.call_count == 1
+    assert results[0].value is results[1].value
+    iapi.close()
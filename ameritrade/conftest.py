@@ -0,0 +1,56 @@
+"""Fixtures shared by the tests running clients against the mock server."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+import threading
+
+import pytest
+
+from ameritrade import api
+from ameritrade import mockserver
+
+
+SECRETS = {'token_type': 'Bearer', 'access_token': 'A', 'refresh_token': 'R'}
+
+
+@pytest.fixture(autouse=True)
+def no_leaked_refreshers():
+    """Check that the tests close the clients whose token refreshers started."""
+    before = set(threading.enumerate())
+    yield
+    leaked = [thread for thread in threading.enumerate()
+              if thread.name == 'token-refresh' and thread not in before]
+    assert not leaked, "Token refresher threads left running; close the clients."
+
+
+@pytest.fixture(scope='module')
+def server():
+    """A mock server shared by the tests of a module."""
+    with mockserver.MockServer(num_candles=30, num_expirations=2) as server:
+        yield server
+
+
+@pytest.fixture
+def open_client():
+    """A function opening an API client authenticated against a mock server.
+
+    The configuration options are passed through to api.Config, and override
+    the defaults of the tests: no throttling and the URL of the server.
+    """
+    clients = []
+
+    def open_client(server, **kwargs):
+        options = dict(client_id='TEST@AMER.OAUTHAP', api_url=server.url,
+                       rate_per_minute=None)
+        options.update(kwargs)
+        with mock.patch('ameritrade.auth.read_or_create_secrets',
+                        return_value=dict(SECRETS)):
+            iapi = api.open(api.Config(**options))
+            iapi.get_secrets()
+        clients.append(iapi)
+        return iapi
+
+    yield open_client
+    for iapi in clients:
+        iapi.close()
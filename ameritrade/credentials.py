@@ -0,0 +1,161 @@
+"""A store for the secrets file, safe to share between processes.
+
+Many processes may use the same configuration directory, and thus the same
+'secrets.json' file. The SecretsStore makes this safe:
+
+- The file is written atomically: the secrets go to a temporary file in the
+  same directory, which is then renamed over the old one. Readers never see a
+  partially written file, and invalid secrets (e.g., 'null') are never written.
+
+- Refreshing the token and authenticating are done under an exclusive lock on a
+  'secrets.json.lock' file next to it. The first process to take the lock
+  refreshes the token; the others wait for it, then find that the token on
+  disk is no longer the one they had and load it instead of refreshing again.
+
+- A process notices that the file was replaced by another one from its status
+  (modification time, size and inode), so that the secrets are only parsed
+  again when they change.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Callable, Dict, Optional, Tuple
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+# A dict of secrets. Contains the access token and Bearer type.
+Secrets = Dict[str, str]
+
+
+def is_valid(secrets: Optional[Secrets]) -> bool:
+    """Return true if the secrets hold an access token."""
+    return isinstance(secrets, dict) and bool(secrets.get('access_token'))
+
+
+class SecretsStore:
+    """The secrets file, written atomically and refreshed under a file lock."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock_filename = filename + '.lock'
+        # The status of the file as last read or written by this process.
+        self.status: Optional[Tuple[int, int, int]] = None
+        self.thread_lock = threading.Lock()
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def load(self) -> Optional[Secrets]:
+        """Read the secrets. Return None if the file is missing or invalid.
+
+        Secrets without an 'expires_at' time get one from the modification
+        time of the file, which was written when the token was issued.
+        """
+        status = self._stat()
+        if status is None:
+            return None
+        try:
+            with open(self.filename) as infile:
+                secrets = json.load(infile)
+        except (OSError, ValueError) as exc:
+            logging.warning("Could not read secrets from %s: %s", self.filename, exc)
+            return None
+        self.status = status
+        if not is_valid(secrets):
+            logging.warning("Invalid secrets in %s; ignoring them.", self.filename)
+            return None
+        if 'expires_at' not in secrets and secrets.get('expires_in') is not None:
+            secrets['expires_at'] = status[0] / 1e9 + float(secrets['expires_in'])
+        return secrets
+
+    def save(self, secrets: Secrets):
+        """Replace the secrets file atomically."""
+        if not is_valid(secrets):
+            raise ValueError("Refusing to save invalid secrets: {!r}".format(secrets))
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmpname = tempfile.mkstemp(prefix='.secrets.', dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as outfile:
+                json.dump(secrets, outfile)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(tmpname, self.filename)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmpname)
+            raise
+        self.status = self._stat()
+
+    def changed(self) -> bool:
+        """Return true if the file was replaced since this process last saw it."""
+        return self._stat() != self.status
+
+    def reload(self, secrets: Optional[Secrets]) -> Optional[Secrets]:
+        """Return the secrets on disk if they changed, else the given ones.
+
+        This only checks the status of the file, unless it changed.
+        """
+        if self._stat() == self.status:
+            return secrets
+        return self.load() or secrets
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold the exclusive lock of the secrets, across threads and processes."""
+        with self.thread_lock:
+            fd = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def load_or_create(self, create: Callable[[], Secrets]) -> Secrets:
+        """Read the secrets, or create and save them if there are none.
+
+        Only one process creates them; the others wait and read them.
+        """
+        secrets = self.load()
+        if secrets is None:
+            with self.lock():
+                secrets = self.load()
+                if secrets is None:
+                    secrets = create()
+                    self.save(secrets)
+        return secrets
+
+    def refresh(self, expired: Secrets,
+                refresh: Callable[[Secrets], Secrets]) -> Secrets:
+        """Refresh expired secrets, or load those another process refreshed.
+
+        Args:
+          expired: The secrets found expired.
+          refresh: A function returning fresh secrets from expired ones.
+        Returns:
+          The fresh secrets, which have been saved.
+        """
+        with self.lock():
+            current = self.load()
+            if (current is not None and
+                current.get('access_token') != expired.get('access_token')):
+                logging.info("Token already refreshed by another process.")
+                return current
+            secrets = refresh(expired)
+            self.save(secrets)
+        return secrets
+
+
+def open_store(config) -> Optional[SecretsStore]:
+    """Create the store of the secrets file of a configuration, if any."""
+    filename = getattr(config, 'secrets_file', None)
+    return SecretsStore(filename) if filename else None
@@ -0,0 +1,126 @@
+"""Unit tests for the store of the secrets file."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from unittest import mock
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from ameritrade import api
+from ameritrade import auth
+from ameritrade import credentials
+
+
+EXPIRED = {'token_type': 'Bearer', 'access_token': 'EXPIRED', 'refresh_token': 'R'}
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'secrets.json')
+    store = credentials.SecretsStore(filename)
+    assert store.load() is None
+    store.save(dict(EXPIRED, expires_in=1800))
+    assert os.listdir(str(tmp_path)) == ['secrets.json']
+    secrets = store.load()
+    assert secrets['access_token'] == 'EXPIRED'
+    # The expiry is computed from the time the file was written.
+    assert secrets['expires_at'] == pytest.approx(path.getmtime(filename) + 1800)
+
+    # Invalid secrets are never written, and ignored on disk.
+    for invalid in [None, {}, {'error': 'invalid_grant'}]:
+        with pytest.raises(ValueError):
+            store.save(invalid)
+    assert store.load()['access_token'] == 'EXPIRED'
+    with open(filename, 'w') as outfile:
+        outfile.write('null')
+    assert store.load() is None
+
+
+def test_reload(tmp_path):
+    store = credentials.SecretsStore(str(tmp_path / 'secrets.json'))
+    store.save(EXPIRED)
+    secrets = store.load()
+    with mock.patch.object(store, 'load') as load:
+        assert store.reload(secrets) is secrets
+        load.assert_not_called()
+
+    # Another process replaces the file.
+    credentials.SecretsStore(store.filename).save(dict(EXPIRED, access_token='FRESH'))
+    assert store.changed()
+    assert store.reload(secrets)['access_token'] == 'FRESH'
+    assert not store.changed()
+
+
+def refresh_in_process(filename, counter_filename, queue):
+    """Refresh the expired secrets, counting the actual refreshes."""
+    def refresh(expired):
+        with open(counter_filename, 'a') as outfile:
+            outfile.write('{}\n'.format(os.getpid()))
+        time.sleep(0.2)
+        return dict(expired, access_token='FRESH')
+    secrets = credentials.SecretsStore(filename).refresh(EXPIRED, refresh)
+    queue.put(secrets['access_token'])
+
+
+def test_refresh_once_across_processes(tmp_path):
+    filename = str(tmp_path / 'secrets.json')
+    counter_filename = str(tmp_path / 'refreshes')
+    credentials.SecretsStore(filename).save(EXPIRED)
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    processes = [context.Process(target=refresh_in_process,
+                                 args=(filename, counter_filename, queue))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=10)
+        assert process.exitcode == 0
+    assert sorted(queue.get() for _ in processes) == ['FRESH'] * 4
+    with open(counter_filename) as infile:
+        assert len(infile.readlines()) == 1
+    with open(filename) as infile:
+        assert json.load(infile)['access_token'] == 'FRESH'
+
+
+def test_read_or_create_secrets(tmp_path):
+    config = api.Config(client_id='TEST@AMER.OAUTHAP',
+                        secrets_file=str(tmp_path / 'secrets.json'))
+    with mock.patch('ameritrade.auth.authenticate', return_value=dict(EXPIRED)) as authn:
+        assert auth.read_or_create_secrets(config)['access_token'] == 'EXPIRED'
+        assert auth.read_or_create_secrets(config)['access_token'] == 'EXPIRED'
+        authn.assert_called_once()
+
+        # A failed authentication doesn't leave a broken file behind.
+        os.remove(config.secrets_file)
+        authn.return_value = None
+        with pytest.raises(ValueError):
+            auth.read_or_create_secrets(config)
+        assert not path.exists(config.secrets_file)
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.get_refresh_token')
+def test_api_adopts_refreshed_secrets(refresh, _, tmp_path):
+    filename = str(tmp_path / 'secrets.json')
+    credentials.SecretsStore(filename).save(EXPIRED)
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', secrets_file=filename,
+                               refresh_ahead=None))
+    assert iapi.get_secrets()['access_token'] == 'EXPIRED'
+
+    # Another process refreshed the token: the API loads it instead of refreshing.
+    credentials.SecretsStore(filename).save(dict(EXPIRED, access_token='FRESH'))
+    assert iapi.refresh_secrets(iapi.secrets)['access_token'] == 'FRESH'
+    refresh.assert_not_called()
+    assert iapi.metrics_snapshot().refreshes == 0
+
+    refresh.return_value = dict(EXPIRED, access_token='NEWER')
+    assert iapi.refresh_secrets(iapi.secrets)['access_token'] == 'NEWER'
+    assert credentials.SecretsStore(filename).load()['access_token'] == 'NEWER'
+    assert iapi.metrics_snapshot().refreshes == 1
+    iapi.close()
@@ -0,0 +1,412 @@
+"""Decoders for the JSON responses of the API.
+
+Decoding a large response, e.g., an option chain, dominates the cost of a call.
+The decoder is selected with the 'json_decoder' option of the configuration:
+
+- 'decimal': All numbers with a fraction are decoded as Decimal, and all
+  objects as JsonWrapper. This is exact, and the slowest. This is the default.
+  As the Decimal type is implemented in C, it costs little more than 'float';
+  converting only the money fields to Decimal from Python costs more.
+
+- 'float': Numbers are decoded as floats by the C parser of the standard
+  library. Objects are still JsonWrapper.
+
+- 'fast': Numbers are decoded as floats and objects as plain dicts, without
+  attribute access, using 'orjson' if it is installed. This is the fastest.
+
+- 'lazy': Like 'decimal', but large objects are views over the raw bytes of
+  the response, which only get decoded when they are accessed. See LazyObject.
+
+Run benchmarks/decoding_bench.py to compare them.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, NamedTuple, Union
+import json as stdjson
+import uuid
+
+# We need use_decimal.
+# TODO(blais): Remove this when the default JSON gets updated to 2.1 and above.
+try:
+    import simplejson as json
+except ImportError:
+    json = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class JsonWrapper(dict):
+    """A convenience wrapper for JSON dicts with attribute access."""
+
+    def __getattr__(self, key):
+        try:
+            return super().__getitem__(key)
+        except KeyError as exc:
+            raise AttributeError from exc
+
+
+# A decoded JSON value.
+JSON = Any
+
+# A function decoding the text or bytes of a response.
+Decoder = Callable[[Union[str, bytes]], JSON]
+
+
+def decode_decimal(data: Union[str, bytes]) -> JSON:
+    """Decode exactly, with Decimal numbers and JsonWrapper objects."""
+    if json is not None:
+        return json.loads(data, object_hook=JsonWrapper, use_decimal=True)
+    return stdjson.loads(data, object_hook=JsonWrapper, parse_float=Decimal)
+
+
+def decode_float(data: Union[str, bytes]) -> JSON:
+    """Decode with float numbers and JsonWrapper objects."""
+    return stdjson.loads(data, object_hook=JsonWrapper)
+
+
+def decode_fast(data: Union[str, bytes]) -> JSON:
+    """Decode with float numbers and plain dicts, as fast as possible."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return stdjson.loads(data)
+
+
+def decode_lazy(data: Union[str, bytes]) -> JSON:
+    """Decode like decode_decimal(), deferring the decoding of large objects.
+
+    This requires 'numpy'; without it, the response is decoded eagerly.
+    """
+    if numpy is None:
+        return decode_decimal(data)
+    if isinstance(data, str):
+        data = data.encode('utf8')
+    start = len(data) - len(data.lstrip())
+    if start == len(data) or data[start] not in b'{[':
+        return decode_decimal(data)
+    index = _StructuralIndex(data)
+    if data[start] == ord('{'):
+        return LazyObject(index, start, 0)
+    return index.decode_list(start, 0)
+
+
+DECODERS: Dict[str, Decoder] = {
+    'decimal': decode_decimal,
+    'float': decode_float,
+    'fast': decode_fast,
+    'lazy': decode_lazy,
+}
+
+
+def get_decoder(name: str) -> Decoder:
+    """Get a decoder by name."""
+    try:
+        return DECODERS[name]
+    except KeyError:
+        raise ValueError("Invalid JSON decoder '{}'; valid decoders are: {}".format(
+            name, ", ".join(sorted(DECODERS)))) from None
+
+
+def dumps(obj: JSON, **kwargs) -> str:
+    """Encode a decoded response, supporting Decimal numbers.
+
+    The Decimal numbers are written exactly, as their text, so that decoding
+    the output with decode_decimal() returns the same numbers.
+    """
+    if json is not None:
+        return json.dumps(obj, use_decimal=True, **kwargs)
+
+    # The standard library can only encode Decimal numbers as other types.
+    # Encode them as a marker string, replaced by their text afterwards; they
+    # are encoded in the order of the output.
+    numbers = []
+    def encode_decimal(obj):
+        if isinstance(obj, Decimal):
+            numbers.append(str(obj))
+            return _DECIMAL_MARK
+        raise TypeError("Object of type {} is not JSON serializable".format(
+            type(obj).__name__))
+    text = stdjson.dumps(obj, default=encode_decimal, **kwargs)
+    if not numbers:
+        return text
+    parts = text.split('"{}"'.format(_DECIMAL_MARK))
+    assert len(parts) == len(numbers) + 1
+    return "".join(part + number for part, number in zip(parts, numbers)) + parts[-1]
+
+
+# A string encoded in place of Decimal numbers. It is unique to the process,
+# so that it cannot be found in the strings of a response.
+_DECIMAL_MARK = "decimal:{}".format(uuid.uuid4().hex)
+
+
+# Containers smaller than this, in bytes, are decoded along with their parent
+# in 'lazy' mode. Smaller values would create more views, each being slower to
+# decode.
+MIN_LAZY_SIZE = 2048
+
+_OPEN, _CLOSE, _COMMA = 1, 2, 3
+
+if numpy is not None:
+    # The kinds of the structural characters, by byte value.
+    _CHAR_KINDS = numpy.zeros(256, numpy.int8)
+    _CHAR_KINDS[list(b'{[')] = _OPEN
+    _CHAR_KINDS[list(b'}]')] = _CLOSE
+    _CHAR_KINDS[ord(',')] = _COMMA
+
+
+class _StructuralIndex:
+    """The positions of the brackets and commas of a JSON document, by level.
+
+    The index is computed in a few vectorized passes over the bytes of the
+    document, skipping over strings. It is used to find the extent of a
+    container and of its children without decoding them: for each level of
+    nesting, it holds the sorted positions of the opening and closing brackets
+    of the containers at that level, and of the commas directly within them.
+    """
+
+    # The size of the chunks the document is scanned by, to bound the memory
+    # used by temporary arrays.
+    CHUNK_SIZE = 1 << 18
+
+    def __init__(self, data: bytes):
+        self.data = data
+        array = numpy.frombuffer(data, numpy.uint8)
+
+        # Find the quotes delimiting strings, ignoring escaped ones, and the
+        # candidate structural characters.
+        quotes, candidates = [], []
+        for offset in range(0, len(array), self.CHUNK_SIZE):
+            chunk = array[offset:offset + self.CHUNK_SIZE]
+            quotes.append(numpy.flatnonzero(chunk == ord('"')) + offset)
+            folded = chunk | 0x20  # Maps '[' and ']' to '{' and '}'.
+            mask = folded == ord('{')
+            mask |= folded == ord('}')
+            mask |= chunk == ord(',')
+            candidates.append(numpy.flatnonzero(mask) + offset)
+        quotes = numpy.concatenate(quotes) if quotes else numpy.zeros(0, numpy.int64)
+        escaped = quotes[array[quotes - 1] == ord('\\')] if len(quotes) else quotes
+        if len(escaped):
+            # Most are preceded by a single backslash. Count the others.
+            single = array[escaped - 2] != ord('\\')
+            escaped = numpy.concatenate([
+                escaped[single],
+                [pos for pos in escaped[~single].tolist() if _is_escaped(data, pos)]])
+            quotes = numpy.setdiff1d(quotes, escaped, assume_unique=True)
+
+        # Keep the structural characters outside of strings, i.e., preceded by
+        # an even number of quotes.
+        positions = numpy.concatenate(candidates) if candidates else quotes
+        positions = positions[numpy.searchsorted(quotes, positions) % 2 == 0]
+        kinds = _CHAR_KINDS[array[positions]]
+        positions = positions.astype(numpy.int32 if len(data) < 2**31 else numpy.int64)
+
+        # Compute the level of the container each bracket opens or closes, or
+        # that each comma is directly within.
+        depth = numpy.cumsum((kinds == _OPEN).astype(numpy.int32) -
+                             (kinds == _CLOSE).astype(numpy.int32))
+        levels = depth - (kinds != _CLOSE)
+        self.opens, self.closes, self.commas = [], [], []
+        for level in range(int(levels.max()) + 1 if len(levels) else 0):
+            at_level = levels == level
+            for kind, per_level in [(_OPEN, self.opens), (_CLOSE, self.closes),
+                                    (_COMMA, self.commas)]:
+                per_level.append(positions[at_level & (kinds == kind)])
+
+    def close_of(self, start: int, level: int) -> int:
+        """Return the position of the bracket closing a container."""
+        opens = self.opens[level]
+        return int(self.closes[level][numpy.searchsorted(opens, start)])
+
+    def decode(self, start: int, level: int) -> JSON:
+        """Decode a container, except for its large children.
+
+        Returns the decoded container, with None in place of its large
+        children, and a list of the large children, as (element number, start)
+        pairs.
+        """
+        end = self.close_of(start, level) + 1
+        data = self.data
+        children = []
+        if end - start >= MIN_LAZY_SIZE and level + 1 < len(self.opens):
+            opens = self.opens[level + 1]
+            lo, hi = numpy.searchsorted(opens, [start, end])
+            if lo < hi:
+                closes = self.closes[level + 1]
+                commas = self.commas[level]
+                first = numpy.searchsorted(commas, start)
+                for child_start, child_end in zip(opens[lo:hi].tolist(),
+                                                  closes[lo:hi].tolist()):
+                    if child_end - child_start >= MIN_LAZY_SIZE:
+                        children.append(
+                            (int(numpy.searchsorted(commas, child_start) - first),
+                             child_start))
+        if not children:
+            return decode_decimal(data[start:end]), children
+
+        # Replace the large children by nulls to decode the container.
+        pieces = []
+        prev = start
+        for _, child_start in children:
+            pieces.append(data[prev:child_start])
+            pieces.append(b'null')
+            prev = self.close_of(child_start, level + 1) + 1
+        pieces.append(data[prev:end])
+        return decode_decimal(b''.join(pieces)), children
+
+    def decode_list(self, start: int, level: int) -> List[JSON]:
+        """Decode a list, with views for its large objects."""
+        value, children = self.decode(start, level)
+        for element, child_start in children:
+            if self.data[child_start] == ord('{'):
+                value[element] = LazyObject(self, child_start, level + 1)
+            else:
+                value[element] = self.decode_list(child_start, level + 1)
+        return value
+
+
+def _is_escaped(data: bytes, pos: int) -> bool:
+    """Return true if the character at 'pos' is escaped by a backslash."""
+    count = 0
+    while pos > count and data[pos - count - 1] == ord('\\'):
+        count += 1
+    return count % 2 == 1
+
+
+# The placeholder key of views which haven't been decoded yet.
+_PENDING = object()
+
+
+class _DeferredList(NamedTuple('_DeferredList', [('index', _StructuralIndex),
+                                                 ('start', int),
+                                                 ('level', int)])):
+    """The placeholder value of a large list in a view."""
+
+
+class LazyObject(JsonWrapper):
+    """A view of a JSON object, decoded when first accessed.
+
+    The view keeps a reference to the raw bytes of the whole response and the
+    position of the object in it. On first access, the object is decoded in
+    place, except for its own large children: objects become views in turn,
+    and lists get decoded the first time their key is accessed. Once that's
+    done, it turns into a regular JsonWrapper, without any overhead.
+    """
+
+    def __init__(self, index: _StructuralIndex, start: int, level: int):
+        # Some C code tests whether dicts are empty without calling any of
+        # their methods, e.g., the encoder of the 'json' module. Hold a
+        # placeholder until the view is decoded so that it isn't empty.
+        super().__init__({_PENDING: None})
+        self._lazy = (index, start, level)
+        self._deferred = 0
+
+    def _decode(self):
+        """Decode the object, deferring its large children."""
+        lazy = self.__dict__.pop('_lazy', None)
+        if lazy is None:
+            return
+        index, start, level = lazy
+        value, children = index.decode(start, level)
+        if children:
+            keys = list(value)
+            for element, child_start in children:
+                if index.data[child_start] == ord('{'):
+                    child = LazyObject(index, child_start, level + 1)
+                else:
+                    child = _DeferredList(index, child_start, level + 1)
+                    self._deferred += 1
+                value[keys[element]] = child
+        dict.clear(self)
+        dict.update(self, value)
+        if not self._deferred:
+            self._done()
+
+    def _resolve(self, key, deferred: _DeferredList) -> List[JSON]:
+        """Decode a deferred list."""
+        value = deferred.index.decode_list(deferred.start, deferred.level)
+        dict.__setitem__(self, key, value)
+        self._deferred -= 1
+        if not self._deferred:
+            self._done()
+        return value
+
+    def _resolve_all(self):
+        """Decode the object and all its deferred lists."""
+        self._decode()
+        for key, value in list(dict.items(self)):
+            if value.__class__ is _DeferredList:
+                self._resolve(key, value)
+
+    def _done(self):
+        """Turn into a regular JsonWrapper."""
+        del self._deferred
+        self.__class__ = JsonWrapper
+
+    def __getitem__(self, key):
+        self._decode()
+        value = dict.__getitem__(self, key)
+        if value.__class__ is _DeferredList:
+            value = self._resolve(key, value)
+        return value
+
+    def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError as exc:
+            raise AttributeError from exc
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def _delegate(name: str, resolve: Callable[[LazyObject], None]):
+    """Create a method preparing a view before calling the dict method."""
+    method = getattr(dict, name)
+    def wrapper(self, *args, **kwargs):
+        resolve(self)
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+def _compare(name: str):
+    """Create a comparison method decoding the views on both sides."""
+    method = getattr(dict, name)
+    def wrapper(self, other):
+        LazyObject._resolve_all(self)
+        if isinstance(other, LazyObject):
+            LazyObject._resolve_all(other)
+        return method(self, other)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+# The methods which only need the keys.
+for _name in ['__setitem__', '__delitem__', '__contains__', '__iter__',
+              '__reversed__', '__len__', 'keys', 'update', 'clear']:
+    setattr(LazyObject, _name, _delegate(_name, LazyObject._decode))
+
+# The methods which need the values.
+for _name in ['__repr__', '__or__', '__ior__', 'values',
+              'items', 'copy', 'pop', 'popitem', 'setdefault']:
+    setattr(LazyObject, _name, _delegate(_name, LazyObject._resolve_all))
+for _name in ['__eq__', '__ne__']:
+    setattr(LazyObject, _name, _compare(_name))
+LazyObject.__reduce_ex__ = lambda self, protocol: (
+    LazyObject._resolve_all(self) or JsonWrapper.__reduce_ex__(self, protocol))
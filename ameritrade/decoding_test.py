@@ -0,0 +1,127 @@
+"""Unit tests for the JSON decoders."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from decimal import Decimal
+from unittest import mock
+import copy
+import json
+import pickle
+
+import pytest
+
+from ameritrade import decoding
+
+
+DATA = b'{"SPY": {"lastPrice": 420.15, "delta": 0.5, "totalVolume": 1000, "legs": [{"quantity": 1.5}]}}'
+
+
+def test_decode_decimal():
+    quote = decoding.decode_decimal(DATA)
+    assert isinstance(quote, decoding.JsonWrapper)
+    assert quote.SPY.lastPrice == Decimal('420.15')
+    assert quote.SPY.delta == Decimal('0.5')
+    assert quote.SPY.totalVolume == 1000
+
+
+def test_decode_float():
+    quote = decoding.decode_float(DATA)
+    assert quote.SPY.lastPrice == 420.15
+    assert isinstance(quote.SPY.legs[0], decoding.JsonWrapper)
+
+
+def test_decode_fast():
+    quote = decoding.decode_fast(DATA)
+    assert quote == {'SPY': {'lastPrice': 420.15, 'delta': 0.5, 'totalVolume': 1000,
+                             'legs': [{'quantity': 1.5}]}}
+
+
+def test_get_decoder():
+    assert decoding.get_decoder('fast') is decoding.decode_fast
+    with pytest.raises(ValueError):
+        decoding.get_decoder('xml')
+
+
+def test_dumps():
+    quote = decoding.decode_decimal(DATA)
+    assert decoding.decode_decimal(decoding.dumps(quote)) == quote
+
+
+def test_dumps_exact():
+    numbers = [Decimal('0.1234567890123456789012345'), Decimal('1.10'),
+               Decimal('-1E+3'), 1.5, 7]
+    # Without simplejson as well.
+    with mock.patch.object(decoding, 'json', None):
+        text = decoding.dumps({'numbers': numbers, 'name': 'decimal'})
+    assert '0.1234567890123456789012345, 1.10, -1E+3' in text
+    assert decoding.decode_decimal(text) == {'numbers': numbers, 'name': 'decimal'}
+
+
+LAZY_DATA = json.dumps({
+    'symbol': 'SPY',
+    'escaped': 'a "quoted" {brace} \\ back\\"slash ]',
+    'callExpDateMap': {
+        '2021-01-15:3': {'300.0': [{'bidPrice': 1.25, 'askPrice': 1.5}],
+                         '305.0': [{'bidPrice': 0.5, 'askPrice': 0.75}]},
+    },
+    'nested': [[1, 2, {'a': [3, 4]}], {'b': {}}],
+    'empty': {},
+})
+
+
+@pytest.fixture
+def lazy_everything(monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(decoding, 'MIN_LAZY_SIZE', 0)
+
+
+def test_decode_lazy(lazy_everything):
+    expected = decoding.decode_decimal(LAZY_DATA)
+    chain = decoding.decode_lazy(LAZY_DATA)
+    assert isinstance(chain, decoding.LazyObject)
+    assert chain.callExpDateMap['2021-01-15:3']['305.0'][0].askPrice == Decimal('0.75')
+    assert chain.escaped == expected['escaped']
+    assert chain.nested[0][2].a == [3, 4]
+    assert chain == expected
+
+    # Once decoded, views turn into regular objects.
+    assert type(chain) is decoding.JsonWrapper
+    assert type(chain.callExpDateMap) is decoding.JsonWrapper
+
+    # Lists at the root.
+    assert decoding.decode_lazy(decoding.dumps([expected, 1])) == [expected, 1]
+
+
+def test_decode_lazy_dict_semantics(lazy_everything):
+    expected = decoding.decode_decimal(LAZY_DATA)
+    decode = lambda: decoding.decode_lazy(LAZY_DATA.encode('utf8'))
+    assert len(decode()) == len(expected)
+    assert list(decode()) == list(expected)
+    assert 'symbol' in decode()
+    assert decode().get('nothing', 42) == 42
+    assert dict(decode()) == expected
+    assert decode().items() == expected.items()
+    assert json.loads(json.dumps(decode(), default=str)) == json.loads(
+        json.dumps(expected, default=str))
+    assert decoding.dumps(decode()) == decoding.dumps(expected)
+    assert pickle.loads(pickle.dumps(decode())) == expected
+    assert copy.deepcopy(decode()) == expected
+    assert repr(decode()) == repr(expected)
+    with pytest.raises(AttributeError):
+        decode().nothing
+    with pytest.raises(KeyError):
+        decode()['nothing']
+
+
+def test_decode_lazy_equality(lazy_everything):
+    expected = decoding.decode_decimal(LAZY_DATA)
+    decode = lambda: decoding.decode_lazy(LAZY_DATA.encode('utf8'))
+    # Between two views, at the root and nested, and against regular objects.
+    assert decode() == decode()
+    assert not decode() != decode()
+    assert decode()['callExpDateMap'] == decode()['callExpDateMap']
+    assert not decode()['callExpDateMap'] != decode()['callExpDateMap']
+    assert dict(expected) == decode()
+    assert decode() == dict(expected)
+    assert expected['callExpDateMap'] == decode()['callExpDateMap']
+    assert decode()['callExpDateMap'] != {'2021-01-15:3': {}}
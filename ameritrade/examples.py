@@ -0,0 +1,157 @@
+"""Loader for the example responses scraped with the schemas.
+
+The 'example.json' files under the schemas directory are not valid JSON: they
+are copied from the documentation and contain a sequence of objects, sometimes
+within a list without separating commas, preceded by comments naming their
+type, such as
+
+    //OptionChain:
+    {
+      "symbol": "string",
+      ...
+    }
+
+The numbers and strings of the examples are placeholders. synthesize() replaces
+them with plausible values and replicates the lists, in order to build larger,
+more realistic documents, e.g., for benchmarks and tests.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Iterator, List, NamedTuple, Optional
+import json
+import os
+import random
+import re
+
+
+SCHEMAS_DIR = path.join(path.dirname(__file__), 'schemas')
+
+
+# An example object from an example file.
+Example = NamedTuple('Example', [
+    # The name of the type of the object, from the comment preceding it, if any.
+    ('label', Optional[str]),
+    # The decoded object.
+    ('value', Any),
+])
+
+
+_LABEL = re.compile(r'//\s*(\w+)\s*:\s*$')
+
+
+def find_example_files(schemas_dir: str = SCHEMAS_DIR) -> Iterator[str]:
+    """Find all the example files, in sorted order."""
+    for group in sorted(os.listdir(schemas_dir)):
+        group_dir = path.join(schemas_dir, group)
+        if not path.isdir(group_dir):
+            continue
+        for method in sorted(os.listdir(group_dir)):
+            filename = path.join(group_dir, method, 'example.json')
+            if path.exists(filename):
+                yield filename
+
+
+def parse_examples(text: str) -> List[Example]:
+    """Parse the objects out of the text of an example file."""
+    decoder = json.JSONDecoder()
+    examples = []
+    label = None
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char.isspace() or char in '[],':
+            pos += 1
+        elif text.startswith('//', pos):
+            end = _end_of_line(text, pos)
+            match = _LABEL.match(text, pos, end)
+            if match:
+                label = match.group(1)
+            pos = end
+        elif char == '{':
+            try:
+                value, pos = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                # Not an object; skip the rest of the line.
+                pos = _end_of_line(text, pos)
+                continue
+            examples.append(Example(label, value))
+            label = None
+        else:
+            # Some prose; skip the rest of the line.
+            pos = _end_of_line(text, pos)
+    return examples
+
+
+def _end_of_line(text: str, pos: int) -> int:
+    end = text.find('\n', pos)
+    return len(text) if end == -1 else end
+
+
+def load_examples(filename: str) -> List[Example]:
+    """Load the objects of an example file."""
+    with open(filename) as infile:
+        return parse_examples(infile.read())
+
+
+def synthesize(value: Any, repeat: int = 1,
+               rnd: Optional[random.Random] = None) -> Any:
+    """Fill in the placeholders of an example with plausible values.
+
+    Numbers are replaced by random prices with two decimals (integers for the
+    fields whose name suggests so), and the items of the outermost lists are
+    replicated 'repeat' times.
+    """
+    rnd = rnd or random.Random(0)
+    return _synthesize(value, None, repeat, rnd)
+
+
+_INTEGER_FIELD = re.compile(r'(Id|Time|Size|Volume|InLong|Count|Interest|Date|Key)$',
+                            re.IGNORECASE)
+
+
+def _synthesize(value, key, repeat, rnd):
+    if isinstance(value, dict):
+        return {k: _synthesize(v, k, repeat, rnd) for k, v in value.items()}
+    elif isinstance(value, list):
+        # Only replicate the outermost lists, the nested ones stay small.
+        return [_synthesize(item, key, 1, rnd)
+                for item in value
+                for _ in range(repeat)]
+    elif isinstance(value, bool):
+        return rnd.random() < 0.5
+    elif isinstance(value, (int, float)):
+        if key and _INTEGER_FIELD.search(key):
+            return rnd.randrange(1, 1000000)
+        return round(rnd.uniform(0.01, 1000.), 2)
+    return value
+
+
+def synthesize_option_chain(num_expirations: int, num_strikes: int,
+                            rnd: Optional[random.Random] = None) -> Any:
+    """Build a GetOptionChain response from the examples.
+
+    The example does not include the contents of the expiration maps, so they
+    are filled in with 'num_expirations' times 'num_strikes' calls and puts.
+    """
+    rnd = rnd or random.Random(0)
+    filename = path.join(SCHEMAS_DIR, 'OptionChains', 'GetOptionChain', 'example.json')
+    objects = {example.label: example.value for example in load_examples(filename)}
+    chain = synthesize(objects['OptionChain'], rnd=rnd)
+    chain['symbol'] = 'SPY'
+    chain['underlying'] = synthesize(objects['Underlying'], rnd=rnd)
+    for field, put_call in [('callExpDateMap', 'CALL'), ('putExpDateMap', 'PUT')]:
+        expmap = chain[field] = {}
+        for days in range(num_expirations):
+            day = days % 28 + 1
+            strikes = expmap['2021-01-{:02d}:{}'.format(day, days)] = {}
+            for index in range(num_strikes):
+                strike = 100. + 5. * index
+                option = synthesize(objects['Option'], rnd=rnd)
+                option.update(putCall=put_call, strikePrice=strike,
+                              daysToExpiration=days,
+                              symbol='SPY_01{:02d}21{}{:g}'.format(day, put_call[0],
+                                                                  strike))
+                strikes['{:.1f}'.format(strike)] = [option]
+    return chain
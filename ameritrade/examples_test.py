@@ -0,0 +1,59 @@
+"""Unit tests for the examples loader."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import json
+import textwrap
+
+from ameritrade import examples
+
+
+def test_parse_examples():
+    text = textwrap.dedent("""
+      [
+      //Mover:
+      {
+        "change": 0,
+        "symbol": "string"
+      }
+      ]
+
+      //The class <Mover> has the
+      //following subclasses:
+      //-Other
+       //Other:
+      {"last": 0}{
+        "$ref" : "#/definitions/WebServiceError"
+      }
+    """)
+    parsed = examples.parse_examples(text)
+    assert parsed == [
+        examples.Example('Mover', {'change': 0, 'symbol': 'string'}),
+        examples.Example('Other', {'last': 0}),
+        examples.Example(None, {'$ref': '#/definitions/WebServiceError'}),
+    ]
+
+
+def test_load_all_examples():
+    filenames = list(examples.find_example_files())
+    assert len(filenames) > 30
+    for filename in filenames:
+        assert examples.load_examples(filename), filename
+
+
+def test_synthesize():
+    value = examples.synthesize({'candles': [{'close': 0, 'volume': 0}],
+                                 'empty': False, 'symbol': 'string'}, repeat=3)
+    assert len(value['candles']) == 3
+    assert isinstance(value['candles'][0]['close'], float)
+    assert isinstance(value['candles'][0]['volume'], int)
+    assert value['symbol'] == 'string'
+
+
+def test_synthesize_option_chain():
+    chain = examples.synthesize_option_chain(2, 3)
+    assert len(chain['callExpDateMap']) == 2
+    strikes = next(iter(chain['putExpDateMap'].values()))
+    assert list(strikes) == ['100.0', '105.0', '110.0']
+    assert strikes['105.0'][0]['putCall'] == 'PUT'
+    json.dumps(chain)
@@ -0,0 +1,196 @@
+"""Hooks called around the calls of the API, with timing spans for tracing.
+
+Each AmeritradeAPI has a Hooks registry, api.hooks, to which functions can be
+registered for the following events of a call:
+
+- before_request(context): the arguments have been validated and the request
+  built; nothing has been sent yet.
+- on_throttle(context, seconds): the call waited for the rate limiter.
+- on_retry(context, reason): a request failed and is about to be retried. The
+  reason is the HTTP status code or the exception.
+- on_refresh(context): the token expired and is about to be refreshed.
+- after_response(context): the call has completed, successfully or not.
+
+The CallContext passed to the hooks describes the call, and accumulates spans
+timing its phases: 'queue' (the wait of a call made with batch() or map() for
+a worker thread), 'validation', 'throttle', 'network' and 'decode'. Hooks may
+keep their own state for a call in its 'data' dict. Exceptions raised by hooks
+are logged and ignored.
+
+When no hooks are registered, calls don't build contexts at all, so that they
+cost nothing more than a check of a flag.
+
+TracingHooks is an adapter reporting the calls and their phases as spans in
+the style of OpenTelemetry, with the 'opentelemetry-api' package if installed,
+or with any tracer providing the same start_span() and end() methods.
+
+    api.hooks.register_all(hooks.TracingHooks())
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import logging
+import threading
+import time
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_context = otel_trace = None
+
+
+# The events hooks can be registered for.
+EVENTS = ('before_request', 'after_response', 'on_retry', 'on_throttle', 'on_refresh')
+
+
+# A timed phase of a call. The start time is a timestamp, in seconds.
+Span = NamedTuple('Span', [
+    ('name', str),
+    ('start', float),
+    ('duration', float),
+])
+
+
+class CallContext:
+    """The state of a call, passed to the hooks."""
+
+    def __init__(self, method_name: str):
+        self.method_name = method_name
+        # The request, once built.
+        self.request = None
+        # The timed phases of the call, in order.
+        self.spans: List[Span] = []
+        # The HTTP status code of the last response, and the decoded response.
+        self.status: Optional[int] = None
+        self.response: Any = None
+        # The exception raised by the call, if it failed.
+        self.error: Optional[BaseException] = None
+        # State kept by the hooks.
+        self.data: Dict[str, Any] = {}
+        # The start of the call, as a timestamp and on the performance counter,
+        # to convert the latter to the former.
+        self.start = time.time()
+        self._counter = time.perf_counter()
+
+    def add_span(self, name: str, start: float, end: float):
+        """Add a span, from start and end times of the performance counter."""
+        self.spans.append(Span(name, self.start + (start - self._counter), end - start))
+
+    @property
+    def duration(self) -> float:
+        """The time elapsed since the start of the call, in seconds."""
+        return time.perf_counter() - self._counter
+
+
+# The time at which the call about to be made by a thread was queued, if it
+# was made with batch().
+_queued = threading.local()
+
+
+def set_queued(counter: Optional[float]):
+    """Set the time at which the next call of the thread was queued."""
+    _queued.counter = counter
+
+
+class Hooks:
+    """A registry of hooks by event."""
+
+    def __init__(self):
+        self.hooks: Dict[str, List[Callable[..., Any]]] = {event: [] for event in EVENTS}
+        # True if any hook is registered.
+        self.active = False
+
+    def register(self, event: str, hook: Callable[..., Any]) -> Callable[..., Any]:
+        """Register a hook for an event. Return the hook."""
+        if event not in self.hooks:
+            raise ValueError("Invalid event: {}".format(event))
+        self.hooks[event].append(hook)
+        self.active = True
+        return hook
+
+    def unregister(self, event: str, hook: Callable[..., Any]):
+        """Remove a hook."""
+        self.hooks[event].remove(hook)
+        self.active = any(self.hooks.values())
+
+    def register_all(self, obj: Any):
+        """Register the methods of an object named after events as hooks."""
+        for event in EVENTS:
+            hook = getattr(obj, event, None)
+            if hook is not None:
+                self.register(event, hook)
+
+    def start(self, method_name: str) -> CallContext:
+        """Create the context of a call, with the time it was queued, if any."""
+        context = CallContext(method_name)
+        queued = getattr(_queued, 'counter', None)
+        if queued is not None:
+            context.add_span('queue', queued, context._counter)
+            _queued.counter = None
+        return context
+
+    def emit(self, event: str, context: CallContext, *args):
+        """Call the hooks of an event."""
+        for hook in self.hooks[event]:
+            try:
+                hook(context, *args)
+            except Exception:
+                logging.exception("Error in %s hook for %s", event, context.method_name)
+
+
+def _nanoseconds(timestamp: float) -> int:
+    return int(timestamp * 1e9)
+
+
+class TracingHooks:
+    """Report the calls and their phases as spans, in the style of OpenTelemetry.
+
+    Each call becomes a span named after its method, a child of the span
+    current when it was made, with a child span per phase. The spans are
+    created when the call completes, with their actual start and end times.
+    """
+
+    def __init__(self, tracer: Any = None):
+        """Create the adapter.
+
+        Args:
+          tracer: A tracer, by default that of the 'opentelemetry-api' package.
+        """
+        if tracer is None:
+            if otel_trace is None:
+                raise ImportError("TracingHooks requires a tracer or 'opentelemetry-api'.")
+            tracer = otel_trace.get_tracer('ameritrade')
+        self.tracer = tracer
+
+    def before_request(self, context: CallContext):
+        # Capture the context of the caller, as the call may complete elsewhere.
+        if otel_context is not None:
+            context.data['trace_context'] = otel_context.get_current()
+
+    def after_response(self, context: CallContext):
+        request = context.request
+        attributes = {'ameritrade.method': context.method_name}
+        if request is not None:
+            attributes['http.method'] = request.http_method
+            attributes['http.url'] = request.url
+        if context.status is not None:
+            attributes['http.status_code'] = context.status
+        span = self.tracer.start_span(context.method_name,
+                                      context=context.data.get('trace_context'),
+                                      start_time=_nanoseconds(context.start),
+                                      attributes=attributes)
+        # Without OpenTelemetry, hand the span itself to the tracer as the context
+        # of its children.
+        parent = otel_trace.set_span_in_context(span) if otel_trace is not None else span
+        for phase in context.spans:
+            child = self.tracer.start_span(phase.name, context=parent,
+                                           start_time=_nanoseconds(phase.start))
+            child.end(end_time=_nanoseconds(phase.start + phase.duration))
+        if context.error is not None:
+            span.record_exception(context.error)
+            if otel_trace is not None:
+                span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR,
+                                                  str(context.error)))
+        span.end(end_time=_nanoseconds(context.start + context.duration))
@@ -0,0 +1,151 @@
+"""Unit tests for the hooks around calls."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+
+import pytest
+import requests
+
+from ameritrade import api
+from ameritrade import hooks
+
+
+class Recorder:
+    """Hooks recording the events they get."""
+
+    def __init__(self):
+        self.events = []
+
+    def before_request(self, context):
+        self.events.append(('before_request', context.method_name))
+
+    def after_response(self, context):
+        self.events.append(('after_response', context.status,
+                            [span.name for span in context.spans]))
+
+    def on_retry(self, context, reason):
+        self.events.append(('on_retry', reason))
+
+    def on_throttle(self, context, seconds):
+        self.events.append(('on_throttle',))
+
+    def on_refresh(self, context):
+        self.events.append(('on_refresh',))
+
+
+def test_registry():
+    registry = hooks.Hooks()
+    assert not registry.active
+    hook = registry.register('before_request', lambda context: None)
+    assert registry.active
+    registry.unregister('before_request', hook)
+    assert not registry.active
+    with pytest.raises(ValueError):
+        registry.register('on_nothing', hook)
+
+
+def test_events_and_spans(server, open_client):
+    iapi = open_client(server)
+    recorder = Recorder()
+    iapi.hooks.register_all(recorder)
+    iapi.GetQuote(symbol='SPY')
+    assert recorder.events == [
+        ('before_request', 'GetQuote'),
+        ('after_response', 200, ['validation', 'network', 'decode'])]
+
+    # Refresh an expired token.
+    recorder.events.clear()
+    server.tokens['A'] = 0
+    try:
+        iapi.GetQuote(symbol='SPY')
+    finally:
+        del server.tokens['A']
+    assert recorder.events[1] == ('on_refresh',)
+    assert recorder.events[2] == ('after_response', 200,
+                                  ['validation', 'network', 'network', 'decode'])
+    iapi.close()
+
+
+def test_queue_span(server, open_client):
+    iapi = open_client(server)
+    contexts = []
+    iapi.hooks.register('after_response', contexts.append)
+    iapi.map('GetQuote', [dict(symbol='SPY'), dict(symbol='QQQ')])
+    assert [context.spans[0].name for context in contexts] == ['queue', 'queue']
+    assert all(span.duration >= 0 for context in contexts for span in context.spans)
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+@mock.patch('time.sleep')
+def test_retries_and_errors(_, __, ___):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None))
+    recorder = Recorder()
+    iapi.hooks.register_all(recorder)
+    # A failing hook doesn't fail the call.
+    iapi.hooks.register('before_request', lambda context: 1 / 0)
+
+    unavailable = requests.Response()
+    unavailable.status_code = 503
+    unavailable._content = b''
+    unavailable._content_consumed = True
+    error = requests.ConnectionError()
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=[unavailable, error, error]):
+        with pytest.raises(requests.ConnectionError):
+            iapi.GetQuote(symbol='SPY')
+    assert recorder.events == [
+        ('before_request', 'GetQuote'),
+        ('on_retry', 503),
+        ('on_retry', error),
+        ('after_response', None, ['validation', 'network'])]
+    iapi.close()
+
+
+class FakeSpan:
+
+    def __init__(self, spans, name, parent, start_time, attributes):
+        self.name = name
+        self.parent = parent
+        self.start_time = start_time
+        self.attributes = attributes
+        self.end_time = None
+        self.exceptions = []
+        spans.append(self)
+
+    def end(self, end_time=None):
+        self.end_time = end_time
+
+    def record_exception(self, exc):
+        self.exceptions.append(exc)
+
+    def set_status(self, status):
+        pass
+
+
+class FakeTracer:
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, context=None, start_time=None, attributes=None):
+        return FakeSpan(self.spans, name, context, start_time, attributes)
+
+
+def test_tracing_hooks(server, open_client):
+    iapi = open_client(server)
+    tracer = FakeTracer()
+    iapi.hooks.register_all(hooks.TracingHooks(tracer))
+    iapi.GetQuote(symbol='SPY')
+    names = [span.name for span in tracer.spans]
+    assert names == ['GetQuote', 'validation', 'network', 'decode']
+    call = tracer.spans[0]
+    assert call.attributes['http.status_code'] == 200
+    assert call.attributes['http.url'].endswith('/marketdata/SPY/quotes')
+    for span in tracer.spans[1:]:
+        if hooks.otel_trace is None:
+            assert span.parent is call
+        assert call.start_time <= span.start_time <= span.end_time <= call.end_time
+    iapi.close()
@@ -0,0 +1,111 @@
+"""The regular trading hours of a market, as reported by the API.
+
+The hours of each day are fetched once with GetHoursMultipleMarkets() and kept
+for the life of the process. They are used to tell whether the market is open
+and when it opens next, e.g., to expire cached quotes at the next open.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Callable, Dict, Optional, Tuple
+import datetime
+import logging
+import threading
+import time
+
+try:
+    import zoneinfo
+    MARKET_TIMEZONE = zoneinfo.ZoneInfo('America/New_York')
+except Exception:  # Python < 3.9, or no timezone database.
+    MARKET_TIMEZONE = datetime.timezone(datetime.timedelta(hours=-5))
+
+
+# The number of days to look ahead for the next open, e.g., over a long weekend.
+MAX_CLOSED_DAYS = 7
+
+# Seconds to wait before fetching the hours again after a failure.
+RETRY_DELAY = 60.
+
+# The regular session of a day, as (start, end) timestamps, or None if the
+# market is closed that day.
+Session = Optional[Tuple[float, float]]
+
+
+class MarketHours:
+    """The regular sessions of a market, fetched once per day."""
+
+    def __init__(self, fetch: Callable[..., Any], market: str = 'EQUITY'):
+        """Create the hours of a market.
+
+        Args:
+          fetch: The GetHoursMultipleMarkets() method of an API.
+          market: The market, e.g., 'EQUITY' or 'OPTION'.
+        """
+        self.fetch = fetch
+        self.market = market
+        self.lock = threading.Lock()
+        self.sessions: Dict[datetime.date, Session] = {}
+        self.failed_until = 0.
+
+    def session(self, date: datetime.date) -> Session:
+        """Return the regular session of a day.
+
+        Raises:
+          IOError: If the hours could not be fetched.
+        """
+        with self.lock:
+            if date in self.sessions:
+                return self.sessions[date]
+            if time.time() < self.failed_until:
+                raise IOError("Market hours are unavailable")
+            try:
+                response = self.fetch(markets=self.market, date=date.isoformat())
+                session = parse_session(response, self.market)
+            except Exception as exc:
+                self.failed_until = time.time() + RETRY_DELAY
+                logging.warning("Could not fetch the market hours for %s: %s",
+                                date, exc)
+                raise IOError("Market hours are unavailable") from exc
+            self.sessions[date] = session
+            return session
+
+    def is_open(self, now: float) -> bool:
+        """Return true if the market is in its regular session."""
+        session = self.session(_market_date(now))
+        return session is not None and session[0] <= now < session[1]
+
+    def next_open(self, now: float) -> Optional[float]:
+        """Return the time of the next open, or None if none is coming soon."""
+        date = _market_date(now)
+        for _ in range(MAX_CLOSED_DAYS + 1):
+            session = self.session(date)
+            if session is not None and session[0] > now:
+                return session[0]
+            date += datetime.timedelta(days=1)
+        return None
+
+
+def _market_date(now: float) -> datetime.date:
+    """Return the date of the market at a time."""
+    return datetime.datetime.fromtimestamp(now, MARKET_TIMEZONE).date()
+
+
+def parse_session(response: Any, market: str) -> Session:
+    """Get the regular session of a market from a GetHoursMultipleMarkets response."""
+    for products in response.values():
+        for hours in products.values():
+            if hours.get('marketType') != market:
+                continue
+            if not hours.get('isOpen'):
+                return None
+            periods = (hours.get('sessionHours') or {}).get('regularMarket')
+            if not periods:
+                return None
+            return (min(_timestamp(period['start']) for period in periods),
+                    max(_timestamp(period['end']) for period in periods))
+    raise ValueError("No hours for market {}".format(market))
+
+
+def _timestamp(text: str) -> float:
+    """Convert an ISO-8601 time with an offset, e.g., '2021-01-04T09:30:00-05:00'."""
+    return datetime.datetime.fromisoformat(text).timestamp()
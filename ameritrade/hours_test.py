@@ -0,0 +1,65 @@
+"""Unit tests for market hours."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+import datetime
+
+import pytest
+
+from ameritrade import hours
+
+
+def make_hours(date, is_open=True):
+    """Create a GetHoursMultipleMarkets response for a day."""
+    session = {
+        'preMarket': [{'start': '{}T07:00:00-05:00'.format(date),
+                       'end': '{}T09:30:00-05:00'.format(date)}],
+        'regularMarket': [{'start': '{}T09:30:00-05:00'.format(date),
+                           'end': '{}T16:00:00-05:00'.format(date)}],
+    }
+    return {'equity': {'EQ': {'date': date, 'marketType': 'EQUITY', 'product': 'EQ',
+                              'isOpen': is_open,
+                              'sessionHours': session if is_open else None}}}
+
+
+def timestamp(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def fetch(markets, date):
+    # 2021-01-08 is a Friday.
+    return make_hours(date, date not in {'2021-01-09', '2021-01-10'})
+
+
+def test_parse_session():
+    assert hours.parse_session(make_hours('2021-01-04'), 'EQUITY') == (
+        timestamp('2021-01-04T09:30:00-05:00'), timestamp('2021-01-04T16:00:00-05:00'))
+    assert hours.parse_session(make_hours('2021-01-09', False), 'EQUITY') is None
+    with pytest.raises(ValueError):
+        hours.parse_session(make_hours('2021-01-04'), 'OPTION')
+
+
+def test_market_hours():
+    fetcher = mock.Mock(side_effect=fetch)
+    market = hours.MarketHours(fetcher)
+    assert market.is_open(timestamp('2021-01-08T10:00:00-05:00'))
+    assert not market.is_open(timestamp('2021-01-08T17:00:00-05:00'))
+    assert not market.is_open(timestamp('2021-01-08T09:00:00-05:00'))
+    assert fetcher.call_count == 1
+
+    assert (market.next_open(timestamp('2021-01-08T09:00:00-05:00')) ==
+            timestamp('2021-01-08T09:30:00-05:00'))
+    assert (market.next_open(timestamp('2021-01-08T17:00:00-05:00')) ==
+            timestamp('2021-01-11T09:30:00-05:00'))
+    assert fetcher.call_args_list[-1] == mock.call(markets='EQUITY', date='2021-01-11')
+
+
+def test_market_hours_failure():
+    fetcher = mock.Mock(side_effect=IOError('Connection refused'))
+    market = hours.MarketHours(fetcher)
+    with pytest.raises(IOError):
+        market.is_open(timestamp('2021-01-08T10:00:00-05:00'))
+    with pytest.raises(IOError):
+        market.is_open(timestamp('2021-01-08T10:00:00-05:00'))
+    assert fetcher.call_count == 1
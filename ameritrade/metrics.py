@@ -0,0 +1,292 @@
+"""Metrics on the calls made to the API.
+
+A Metrics registry counts, for each method: the calls and failed calls, their
+latencies in a histogram, the bytes of the responses, the time spent decoding
+them and waiting for the rate limiter, the calls rejected for going over the
+rate limit, and the hits and misses of the caches. It also counts the
+refreshes of the token, after 401 responses and ahead of its expiry.
+
+Each AmeritradeAPI records into its own registry; call its metrics_snapshot()
+method for a consistent copy of them. prometheus_text() renders a snapshot in
+the Prometheus text format, and serve() exposes it over HTTP for scraping (see
+the 'metrics_port' option).
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import bisect
+import http.server
+import logging
+import threading
+
+from ameritrade import throttle
+
+
+# The upper bounds of the buckets of the latency histograms, in seconds. The
+# last bucket, for the larger latencies, is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+# The metrics of a method.
+MethodStats = NamedTuple('MethodStats', [
+    # Number of calls, and of those which raised or got an HTTP error status.
+    ('calls', int),
+    ('errors', int),
+    # The number of calls per latency bucket, the last one being for the
+    # latencies over the largest bound, and the total latency in seconds.
+    ('latency_counts', Tuple[int, ...]),
+    ('latency_sum', float),
+    # Total size of the response bodies, in bytes.
+    ('response_bytes', int),
+    # Total time spent decoding the responses, in seconds.
+    ('decode_seconds', float),
+    # Number of waits for the rate limiter, and their total time in seconds.
+    ('throttled', int),
+    ('throttle_seconds', float),
+    # Number of responses rejecting a call for going over the rate limit.
+    ('rate_limited', int),
+    # Number of lookups of the caches, on disk and in memory, by result.
+    ('cache_hits', int),
+    ('cache_misses', int),
+    ('memory_hits', int),
+    ('memory_misses', int),
+])
+
+
+# A snapshot of all the metrics of an API.
+MetricsSnapshot = NamedTuple('MetricsSnapshot', [
+    # The upper bounds of the latency buckets.
+    ('buckets', Tuple[float, ...]),
+    # The metrics of each method called, by name.
+    ('methods', Dict[str, MethodStats]),
+    # Number of refreshes of the token after 401 responses, and of those made
+    # in the background ahead of its expiry.
+    ('refreshes', int),
+    ('proactive_refreshes', int),
+    # The statistics of the rate limiter, and its current rate, if any.
+    ('throttle', Optional[throttle.ThrottleStats]),
+    ('rate_per_minute', Optional[int]),
+])
+
+
+class _MethodMetrics:
+    """The mutable metrics of a method."""
+
+    __slots__ = MethodStats._fields
+
+    def __init__(self, num_buckets: int):
+        for field in MethodStats._fields:
+            setattr(self, field, 0)
+        self.latency_counts = [0] * (num_buckets + 1)
+
+    def stats(self) -> MethodStats:
+        values = [getattr(self, field) for field in MethodStats._fields]
+        values[2] = tuple(self.latency_counts)
+        return MethodStats(*values)
+
+
+class Metrics:
+    """A thread-safe registry of the metrics of the calls of an API."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.methods: Dict[str, _MethodMetrics] = {}
+        self.refreshes = 0
+        self.proactive_refreshes = 0
+
+    def _method(self, name: str) -> _MethodMetrics:
+        """Get the metrics of a method, creating them. Call with the lock held."""
+        method = self.methods.get(name)
+        if method is None:
+            method = self.methods[name] = _MethodMetrics(len(self.buckets))
+        return method
+
+    def record_call(self, name: str, seconds: float, response_bytes: int,
+                    decode_seconds: float, error: bool):
+        """Record a call to a method."""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            method = self._method(name)
+            method.calls += 1
+            method.errors += error
+            method.latency_counts[index] += 1
+            method.latency_sum += seconds
+            method.response_bytes += response_bytes
+            method.decode_seconds += decode_seconds
+
+    def record_throttle(self, name: str, seconds: float):
+        """Record a wait for the rate limiter before a call."""
+        with self.lock:
+            method = self._method(name)
+            method.throttled += 1
+            method.throttle_seconds += seconds
+
+    def record_rate_limited(self, name: str):
+        """Record a call rejected for going over the rate limit."""
+        with self.lock:
+            self._method(name).rate_limited += 1
+
+    def record_cache(self, name: str, hit: bool, memory: bool = False):
+        """Record a lookup of a cache, on disk or in memory."""
+        with self.lock:
+            method = self._method(name)
+            if memory:
+                if hit:
+                    method.memory_hits += 1
+                else:
+                    method.memory_misses += 1
+            elif hit:
+                method.cache_hits += 1
+            else:
+                method.cache_misses += 1
+
+    def record_refresh(self, proactive: bool = False):
+        """Record a refresh of the token, ahead of its expiry or not."""
+        with self.lock:
+            if proactive:
+                self.proactive_refreshes += 1
+            else:
+                self.refreshes += 1
+
+    def snapshot(self, limiter: Optional[throttle.RateLimiter] = None) -> MetricsSnapshot:
+        """Return a copy of the metrics, with those of a rate limiter."""
+        with self.lock:
+            methods = {name: method.stats() for name, method in self.methods.items()}
+            refreshes = self.refreshes
+            proactive_refreshes = self.proactive_refreshes
+        if limiter is None:
+            return MetricsSnapshot(self.buckets, methods, refreshes,
+                                   proactive_refreshes, None, None)
+        return MetricsSnapshot(self.buckets, methods, refreshes, proactive_refreshes,
+                               limiter.stats(), limiter.rate_per_minute)
+
+    def reset(self):
+        """Clear all the metrics."""
+        with self.lock:
+            self.methods.clear()
+            self.refreshes = 0
+            self.proactive_refreshes = 0
+
+
+def quantile(buckets: Tuple[float, ...], stats: MethodStats,
+             fraction: float) -> Optional[float]:
+    """Estimate a quantile of the latencies of a method from its histogram.
+
+    Returns:
+      The upper bound of the bucket holding the quantile, in seconds, infinity
+      if it's in the last bucket, or None if there were no calls.
+    """
+    total = sum(stats.latency_counts)
+    if not total:
+        return None
+    target = fraction * total
+    count = 0
+    for bound, bucket_count in zip(buckets, stats.latency_counts):
+        count += bucket_count
+        if count >= target:
+            return bound
+    return float('inf')
+
+
+# The metrics of the methods, as (name, field, type, help).
+_METHOD_METRICS = [
+    ('ameritrade_calls_total', 'calls', 'counter', "Calls made."),
+    ('ameritrade_errors_total', 'errors', 'counter', "Calls failed."),
+    ('ameritrade_response_bytes_total', 'response_bytes', 'counter',
+     "Bytes of the responses."),
+    ('ameritrade_decode_seconds_total', 'decode_seconds', 'counter',
+     "Time spent decoding the responses."),
+    ('ameritrade_throttled_total', 'throttled', 'counter',
+     "Calls delayed by the rate limiter."),
+    ('ameritrade_throttle_seconds_total', 'throttle_seconds', 'counter',
+     "Time spent waiting for the rate limiter."),
+    ('ameritrade_rate_limited_total', 'rate_limited', 'counter',
+     "Calls rejected by the server for going over the rate limit."),
+    ('ameritrade_cache_hits_total', 'cache_hits', 'counter', "Hits of the disk cache."),
+    ('ameritrade_cache_misses_total', 'cache_misses', 'counter',
+     "Misses of the disk cache."),
+    ('ameritrade_memory_cache_hits_total', 'memory_hits', 'counter',
+     "Hits of the memory cache."),
+    ('ameritrade_memory_cache_misses_total', 'memory_misses', 'counter',
+     "Misses of the memory cache."),
+]
+
+
+def _header(lines: List[str], name: str, kind: str, text: str):
+    lines.append('# HELP {} {}'.format(name, text))
+    lines.append('# TYPE {} {}'.format(name, kind))
+
+
+def prometheus_text(snapshot: MetricsSnapshot) -> str:
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    methods = sorted(snapshot.methods.items())
+    for name, field, kind, text in _METHOD_METRICS:
+        _header(lines, name, kind, text)
+        for method, stats in methods:
+            lines.append('{}{{method="{}"}} {}'.format(name, method,
+                                                       getattr(stats, field)))
+
+    name = 'ameritrade_call_duration_seconds'
+    _header(lines, name, 'histogram', "Latency of the calls, including retries.")
+    for method, stats in methods:
+        count = 0
+        for bound, bucket_count in zip(snapshot.buckets + ('+Inf',),
+                                       stats.latency_counts):
+            count += bucket_count
+            lines.append('{}_bucket{{method="{}",le="{}"}} {}'.format(
+                name, method, bound, count))
+        lines.append('{}_sum{{method="{}"}} {}'.format(name, method, stats.latency_sum))
+        lines.append('{}_count{{method="{}"}} {}'.format(name, method, count))
+
+    _header(lines, 'ameritrade_token_refreshes_total', 'counter',
+            "Refreshes of the access token.")
+    lines.append('ameritrade_token_refreshes_total{{reason="expired"}} {}'.format(
+        snapshot.refreshes))
+    lines.append('ameritrade_token_refreshes_total{{reason="proactive"}} {}'.format(
+        snapshot.proactive_refreshes))
+    if snapshot.throttle is not None:
+        _header(lines, 'ameritrade_rate_per_minute', 'gauge',
+                "Current rate of the rate limiter.")
+        lines.append('ameritrade_rate_per_minute {}'.format(snapshot.rate_per_minute))
+        _header(lines, 'ameritrade_limiter_max_wait_seconds', 'gauge',
+                "Longest wait for the rate limiter.")
+        lines.append('ameritrade_limiter_max_wait_seconds {}'.format(
+            snapshot.throttle.max_wait))
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the metrics in the Prometheus text format."""
+
+    def do_GET(self):
+        content = prometheus_text(self.server.get_snapshot()).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def serve(get_snapshot: Callable[[], MetricsSnapshot], host: str = '127.0.0.1',
+          port: int = 0) -> http.server.HTTPServer:
+    """Serve the metrics over HTTP from a background thread.
+
+    Args:
+      get_snapshot: A function returning the current metrics.
+      host: The address to listen on.
+      port: The port to listen on, or 0 for any free port.
+    Returns:
+      The server. Call its shutdown() and server_close() methods to stop it.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.get_snapshot = get_snapshot
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
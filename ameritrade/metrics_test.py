@@ -0,0 +1,110 @@
+"""Unit tests for the metrics of the calls."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+
+import pytest
+import requests
+
+from ameritrade import api
+from ameritrade import metrics
+from ameritrade import mockserver
+
+
+def test_record_and_snapshot():
+    registry = metrics.Metrics(buckets=(0.1, 1.))
+    registry.record_call('GetQuote', 0.05, 100, 0.01, False)
+    registry.record_call('GetQuote', 0.5, 200, 0.02, False)
+    registry.record_call('GetQuote', 5., 0, 0., True)
+    registry.record_throttle('GetQuote', 2.)
+    registry.record_rate_limited('GetQuote')
+    registry.record_cache('GetQuote', True)
+    registry.record_cache('GetQuote', False, memory=True)
+    registry.record_refresh()
+    registry.record_refresh(proactive=True)
+
+    snapshot = registry.snapshot()
+    stats = snapshot.methods['GetQuote']
+    assert (stats.calls, stats.errors) == (3, 1)
+    assert stats.latency_counts == (1, 1, 1)
+    assert stats.latency_sum == 5.55
+    assert stats.response_bytes == 300
+    assert (stats.throttled, stats.throttle_seconds, stats.rate_limited) == (1, 2., 1)
+    assert (stats.cache_hits, stats.cache_misses) == (1, 0)
+    assert (stats.memory_hits, stats.memory_misses) == (0, 1)
+    assert (snapshot.refreshes, snapshot.proactive_refreshes) == (1, 1)
+    assert snapshot.throttle is None
+
+    assert metrics.quantile(snapshot.buckets, stats, 0.3) == 0.1
+    assert metrics.quantile(snapshot.buckets, stats, 0.5) == 1.
+    assert metrics.quantile(snapshot.buckets, stats, 0.99) == float('inf')
+
+    registry.reset()
+    assert registry.snapshot().methods == {}
+
+
+def test_prometheus_text():
+    registry = metrics.Metrics(buckets=(0.1, 1.))
+    registry.record_call('GetQuote', 0.05, 100, 0.01, False)
+    registry.record_call('GetQuote', 0.5, 200, 0.02, False)
+    text = metrics.prometheus_text(registry.snapshot())
+    lines = text.splitlines()
+    assert 'ameritrade_calls_total{method="GetQuote"} 2' in lines
+    assert 'ameritrade_response_bytes_total{method="GetQuote"} 300' in lines
+    assert 'ameritrade_call_duration_seconds_bucket{method="GetQuote",le="0.1"} 1' in lines
+    assert 'ameritrade_call_duration_seconds_bucket{method="GetQuote",le="+Inf"} 2' in lines
+    assert 'ameritrade_call_duration_seconds_count{method="GetQuote"} 2' in lines
+    assert 'ameritrade_token_refreshes_total{reason="expired"} 0' in lines
+    assert 'ameritrade_token_refreshes_total{reason="proactive"} 0' in lines
+
+
+def test_api_metrics(open_client):
+    with mockserver.MockServer() as server:
+        iapi = open_client(server, rate_per_minute=1000, memory_cache=True,
+                           metrics_port=0)
+        iapi.GetQuotes(symbol='SPY,QQQ')
+        iapi.GetQuotes(symbol='SPY,QQQ')
+        server.tokens['A'] = 0
+        iapi.GetQuote(symbol='IWM')
+
+        snapshot = iapi.metrics_snapshot()
+        quotes = snapshot.methods['GetQuotes']
+        assert quotes.calls == 1
+        assert quotes.errors == 0
+        assert quotes.response_bytes > 0
+        assert quotes.decode_seconds > 0
+        assert (quotes.memory_hits, quotes.memory_misses) == (1, 1)
+        assert sum(quotes.latency_counts) == 1
+        assert snapshot.methods['GetQuote'].calls == 1
+        assert snapshot.refreshes == 1
+        assert snapshot.throttle.num_calls >= 3
+        assert snapshot.rate_per_minute == 1000
+
+        host, port = iapi.metrics_server.server_address[:2]
+        resp = requests.get('http://{}:{}/metrics'.format(host, port))
+        assert resp.ok
+        assert 'ameritrade_calls_total{method="GetQuotes"} 1' in resp.text
+        assert 'ameritrade_rate_per_minute 1000' in resp.text
+        iapi.close()
+        assert iapi.metrics_server is None
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_failed_calls(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               retry_policy=None, rate_limit_retries=0))
+    limited = requests.Response()
+    limited.status_code = 429
+    limited._content = b''
+    with mock.patch.object(iapi.session, 'request', return_value=limited):
+        with pytest.raises(IOError):
+            iapi.GetQuote(symbol='SPY')
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=requests.ConnectionError()):
+        with pytest.raises(requests.ConnectionError):
+            iapi.GetQuote(symbol='SPY')
+    stats = iapi.metrics_snapshot().methods['GetQuote']
+    assert (stats.calls, stats.errors, stats.rate_limited) == (2, 2, 1)
+    iapi.close()
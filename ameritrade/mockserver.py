@@ -0,0 +1,485 @@
+"""A local stand-in for the API server, built from the bundled schemas.
+
+MockServer routes every method of schema.SCHEMA and serves responses
+synthesized from the 'example.json' files under the schemas directory, with
+the symbols of the requests filled in and configurable sizes, e.g., the number
+of candles of a price history or of strikes of an option chain. It also issues
+tokens from the OAuth token endpoint, and can inject latency, errors (from the
+'errcodes.json' of each method) and rate limiting responses, in order to test,
+load-test and benchmark clients without any network access.
+
+Usage:
+
+    python -m ameritrade.mockserver --port 8080
+
+and point the client at it with the 'api_url' option of the configuration:
+
+    config = api.Config(..., api_url='http://127.0.0.1:8080/v1')
+
+Or run it in a thread of the process:
+
+    with mockserver.MockServer(latency=0.05) as server:
+        iapi = api.open(api.Config(..., api_url=server.url))
+
+Any bearer token is accepted, but the access tokens issued by the server
+expire after 'token_lifetime' seconds.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+import argparse
+import collections
+import datetime
+import glob
+import http.server
+import json
+import logging
+import random
+import re
+import ssl
+import threading
+import time
+import urllib.parse
+import uuid
+
+from ameritrade import auth
+from ameritrade import examples
+from ameritrade import hours
+from ameritrade import schema
+
+
+# The path prefix of all the methods.
+BASE_PATH = urllib.parse.urlsplit(auth.DEFAULT_API_URL).path
+
+# The status of the errors injected when a method declares none.
+DEFAULT_ERROR_STATUS = 500
+
+# The methods whose responses are lists of their example object.
+LIST_METHODS = frozenset({
+    'GetAccounts',
+    'GetInstrument',
+    'GetMovers',
+    'GetOrdersByPath',
+    'GetOrdersByQuery',
+    'GetSavedOrdersByPath',
+    'GetTransactions',
+    'GetWatchlistsForMultipleAccounts',
+    'GetWatchlistsForSingleAccount',
+})
+
+# The labels of the example objects to respond with, when not the first one.
+EXAMPLE_LABELS = {
+    'GetQuote': 'Equity',
+    'GetQuotes': 'Equity',
+    'GetAccount': 'MarginAccount',
+    'GetAccounts': 'MarginAccount',
+    'GetInstrument': 'Instrument',
+    'SearchInstruments': 'Instrument',
+}
+
+# The lifetime of the refresh tokens issued, in seconds (90 days, as the API).
+REFRESH_TOKEN_LIFETIME = 90 * 24 * 60 * 60
+
+# The number of items of the responses which are lists.
+LIST_SIZE = 10
+
+# A placeholder for an enumeration, e.g., "'PUT' or 'CALL'".
+_ENUM = re.compile(r"^'(\w+)'(?: or '\w+')+$")
+
+
+def find_method_dirs(schemas_dir: str = examples.SCHEMAS_DIR) -> Dict[str, str]:
+    """Find the directory of each method of the schema under the schemas directory.
+
+    The names of the directories don't always match those of the methods, so
+    they are matched on the HTTP method and path of their 'request.json'.
+    """
+    dirs = {}
+    for filename in glob.glob(path.join(schemas_dir, '*', '*', 'request.json')):
+        with open(filename) as infile:
+            request = json.load(infile)
+        link = urllib.parse.urlsplit(request['link']).path
+        dirs[(request['method'], link[len(BASE_PATH):])] = path.dirname(filename)
+    return {name: dirs[(method.http_method, method.path)]
+            for name, method in schema.SCHEMA.items()
+            if (method.http_method, method.path) in dirs}
+
+
+def _fill(value: Any) -> Any:
+    """Replace the placeholders of enumerations by their first value."""
+    if isinstance(value, dict):
+        return {key: _fill(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_fill(item) for item in value]
+    elif isinstance(value, str):
+        match = _ENUM.match(value)
+        if match:
+            return match.group(1)
+    return value
+
+
+class MockServer:
+    """A threaded HTTP(S) server emulating the API."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.,
+                 error_rate: float = 0.,
+                 rate_limit_rate: float = 0.,
+                 retry_after: int = 1,
+                 token_lifetime: float = 1800.,
+                 num_candles: int = 390,
+                 num_expirations: int = 8,
+                 num_strikes: int = 20,
+                 certificate_file: Optional[str] = None,
+                 key_file: Optional[str] = None,
+                 seed: int = 0):
+        """Create a server. Call start() or serve_forever() to run it.
+
+        Args:
+          host: The address to listen on.
+          port: The port to listen on, or 0 for any free port.
+          latency: The time to wait before responding to each request, in seconds.
+          error_rate: The fraction of the calls which fail with one of the errors
+            of their method.
+          rate_limit_rate: The fraction of the calls which fail with a 429 status.
+          retry_after: The value of the Retry-After header of the 429 responses.
+          token_lifetime: The lifetime of the access tokens issued, in seconds.
+          num_candles: The number of candles of a price history.
+          num_expirations: The number of expirations of an option chain.
+          num_strikes: The number of strikes of an option chain, unless the
+            'strikeCount' argument of the call is set.
+          certificate_file: A certificate PEM file, to serve HTTPS.
+          key_file: The key PEM file of the certificate.
+          seed: The seed of the random values and of the injection of errors.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.num_candles = num_candles
+        self.num_expirations = num_expirations
+        self.num_strikes = num_strikes
+        self.seed = seed
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        # The expiration times of the access tokens issued.
+        self.tokens: Dict[str, float] = {}
+        # The number of requests served, by method name.
+        self.requests = collections.Counter()
+        # Responses built for sizes and symbols, which are costly to synthesize.
+        self.memo: Dict[Tuple, bytes] = {}
+
+        self.routes = self._compile_routes()
+        self.templates, self.errors = self._load_examples()
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.scheme = 'http'
+        if certificate_file:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile=certificate_file, keyfile=key_file)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket,
+                                                    server_side=True)
+            self.scheme = 'https'
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the API served, for the 'api_url' option."""
+        host, port = self.httpd.server_address[:2]
+        return '{}://{}:{}{}'.format(self.scheme, host, port, BASE_PATH)
+
+    def _compile_routes(self) -> List[Tuple[Pattern, str, str]]:
+        """Compile the paths of the methods into (regexp, HTTP method, name)."""
+        routes = []
+        # Match the literal paths first, e.g., /accounts/watchlists before
+        # /accounts/{accountId}.
+        for name, method in sorted(schema.SCHEMA.items(),
+                                   key=lambda item: len(item[1].url_fields)):
+            regexp = re.sub(r'\\{(\w+)\\}', r'(?P<\1>[^/]+)', re.escape(method.path))
+            routes.append((re.compile(regexp + '$'), method.http_method, name))
+        return routes
+
+    def _load_examples(self) -> Tuple[Dict[str, Any], Dict[str, List[Tuple]]]:
+        """Load the example response and the errors of each method."""
+        templates, errors = {}, {}
+        for name, dirname in find_method_dirs().items():
+            filename = path.join(dirname, 'example.json')
+            objects = {}
+            if path.exists(filename):
+                for example in examples.load_examples(filename):
+                    if example.label is not None:
+                        objects.setdefault(example.label, example.value)
+            if objects:
+                label = EXAMPLE_LABELS.get(name, next(iter(objects)))
+                templates[name] = _fill(examples.synthesize(objects[label],
+                                                            rnd=self.rnd))
+            with open(path.join(dirname, 'errcodes.json')) as infile:
+                errors[name] = [(int(status), message)
+                                for status, message in json.load(infile).items()
+                                if int(status) != 401]
+        return templates, errors
+
+    def start(self) -> 'MockServer':
+        """Serve in a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name='mockserver', daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in the current thread."""
+        self.httpd.serve_forever()
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'MockServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def route(self, http_method: str, path: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """Find the method of a request. Return its name and URL fields."""
+        if not path.startswith(BASE_PATH):
+            return None, {}
+        path = path[len(BASE_PATH):]
+        for regexp, route_method, name in self.routes:
+            if route_method == http_method:
+                match = regexp.match(path)
+                if match:
+                    return name, match.groupdict()
+        return None, {}
+
+    def handle(self, http_method: str, url: str, headers: Any,
+               body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """Respond to a request. Return the status, headers and body."""
+        parts = urllib.parse.urlsplit(url)
+        name, fields = self.route(http_method, parts.path)
+        if name is None:
+            return _error(404, "Not Found")
+        with self.lock:
+            self.requests[name] += 1
+            draw = self.rnd.random()
+        if self.latency:
+            time.sleep(self.latency)
+
+        if name == 'PostAccessToken':
+            return self.issue_token()
+        if not self.is_authorized(headers.get('Authorization')):
+            return _error(401, "The access token being passed has expired or is invalid.")
+        if draw < self.rate_limit_rate:
+            status, response_headers, content = _error(429, "Too Many Requests")
+            response_headers['Retry-After'] = str(self.retry_after)
+            return status, response_headers, content
+        if draw < self.rate_limit_rate + self.error_rate:
+            with self.lock:
+                status, message = (self.rnd.choice(self.errors[name])
+                                   if self.errors.get(name)
+                                   else (DEFAULT_ERROR_STATUS, "Internal Server Error"))
+            return _error(status, message)
+
+        if schema.SCHEMA[name].http_method != 'GET':
+            status = 201 if http_method == 'POST' else 200
+            return status, {'Content-Length': '0'}, b''
+        args = {key: values[-1]
+                for key, values in urllib.parse.parse_qs(parts.query).items()}
+        args.update(fields)
+        builder = _BUILDERS.get(name, MockServer.build_example)
+        response = builder(self, name, args)
+        content = response if isinstance(response, bytes) else json.dumps(
+            response).encode('utf8')
+        return 200, {'Content-Type': 'application/json'}, content
+
+    def is_authorized(self, authorization: Optional[str]) -> bool:
+        """Check the Authorization header of a request."""
+        if not authorization:
+            return False
+        _, _, token = authorization.partition(' ')
+        with self.lock:
+            expires = self.tokens.get(token)
+        return expires is None or time.time() < expires
+
+    def issue_token(self) -> Tuple[int, Dict[str, str], bytes]:
+        """Respond to the token endpoint with fresh tokens."""
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time() + self.token_lifetime
+        response = dict(self.templates.get('PostAccessToken', {}),
+                        access_token=token,
+                        refresh_token=uuid.uuid4().hex,
+                        token_type='Bearer',
+                        expires_in=int(self.token_lifetime),
+                        refresh_token_expires_in=REFRESH_TOKEN_LIFETIME)
+        return 200, {'Content-Type': 'application/json'}, json.dumps(
+            response).encode('utf8')
+
+    def memoize(self, key: Tuple, build: Callable[[], Any]) -> bytes:
+        """Build and encode a response once per key."""
+        content = self.memo.get(key)
+        if content is None:
+            content = self.memo[key] = json.dumps(build()).encode('utf8')
+        return content
+
+    def build_example(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with the example of the method."""
+        template = self.templates.get(name, {})
+        return [template] * LIST_SIZE if name in LIST_METHODS else template
+
+    def build_quotes(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with a quote for each symbol requested."""
+        # The example of an equity quote lacks its asset type.
+        template = dict(self.templates[name], assetType='EQUITY')
+        return {symbol: dict(template, symbol=symbol)
+                for symbol in args.get('symbol', '').split(',')
+                if symbol}
+
+    def build_price_history(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with 'num_candles' one-minute candles."""
+        symbol = args['symbol']
+        def build():
+            template = self.templates[name]
+            candle = template['candles'][0]
+            start = int(time.time() // 60 * 60) - 60 * self.num_candles
+            candles = [dict(candle, datetime=(start + 60 * index) * 1000)
+                       for index in range(self.num_candles)]
+            return dict(template, symbol=symbol, candles=candles, empty=False)
+        return self.memoize((name, symbol), build)
+
+    def build_option_chain(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with a chain of 'num_expirations' times 'strikeCount' strikes."""
+        symbol = args['symbol']
+        num_strikes = int(args.get('strikeCount') or self.num_strikes)
+        def build():
+            chain = examples.synthesize_option_chain(
+                self.num_expirations, num_strikes, random.Random(self.seed))
+            chain['symbol'] = symbol
+            chain['underlying']['symbol'] = symbol
+            return _fill(chain)
+        return self.memoize((name, symbol, num_strikes), build)
+
+    def build_hours(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with the regular session of the equity market on weekdays."""
+        date = args.get('date')
+        date = (datetime.date.fromisoformat(date[:10]) if date else
+                datetime.datetime.now(hours.MARKET_TIMEZONE).date())
+        def at(hour, minute):
+            return datetime.datetime(date.year, date.month, date.day, hour, minute,
+                                     tzinfo=hours.MARKET_TIMEZONE).isoformat()
+        is_open = date.weekday() < 5
+        market_hours = dict(self.templates[name],
+                            date=date.isoformat(),
+                            marketType='EQUITY',
+                            product='EQ',
+                            isOpen=is_open,
+                            sessionHours=({'regularMarket': [
+                                {'start': at(9, 30), 'end': at(16, 0)}]}
+                                          if is_open else None))
+        return {'equity': {'EQ': market_hours}}
+
+    def build_instruments(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with an instrument for each symbol searched."""
+        template = self.templates[name]
+        return {symbol: dict(template, symbol=symbol)
+                for symbol in args.get('symbol', '').split(',')
+                if symbol}
+
+    def build_account(self, name: str, args: Dict[str, str]) -> Any:
+        """Respond with the accounts."""
+        account = {'securitiesAccount': dict(self.templates[name],
+                                             accountId=args.get('accountId', '123456789'))}
+        return [account] if name in LIST_METHODS else account
+
+
+_BUILDERS = {
+    'GetQuote': MockServer.build_quotes,
+    'GetQuotes': MockServer.build_quotes,
+    'GetPriceHistory': MockServer.build_price_history,
+    'GetOptionChain': MockServer.build_option_chain,
+    'GetHoursSingleMarket': MockServer.build_hours,
+    'GetHoursMultipleMarkets': MockServer.build_hours,
+    'SearchInstruments': MockServer.build_instruments,
+    'GetAccount': MockServer.build_account,
+    'GetAccounts': MockServer.build_account,
+}
+
+
+def _error(status: int, message: str) -> Tuple[int, Dict[str, str], bytes]:
+    """Build an error response, in the format of the API."""
+    return (status, {'Content-Type': 'application/json'},
+            json.dumps({'error': message}).encode('utf8'))
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Dispatches the requests to the MockServer."""
+
+    # Keep the connections alive, like the real server.
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, content = self.server.mock.handle(
+            self.command, self.path, self.headers, body)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if 'Content-Length' not in headers:
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _respond
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def main():
+    """Run a mock server until interrupted."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help="Seconds to wait before each response.")
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help="Fraction of the calls failing with an error.")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.,
+                        help="Fraction of the calls failing with a 429 status.")
+    parser.add_argument('--num-candles', type=int, default=390)
+    parser.add_argument('--num-expirations', type=int, default=8)
+    parser.add_argument('--num-strikes', type=int, default=20)
+    parser.add_argument('--certificate-file', help="Serve HTTPS with this certificate.")
+    parser.add_argument('--key-file', help="The key of the certificate.")
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port,
+                        latency=args.latency,
+                        error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate,
+                        num_candles=args.num_candles,
+                        num_expirations=args.num_expirations,
+                        num_strikes=args.num_strikes,
+                        certificate_file=args.certificate_file,
+                        key_file=args.key_file)
+    logging.info("Serving the API at %s", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Unit tests for the mock server."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+
+import requests
+
+from ameritrade import mockserver
+from ameritrade import schema
+
+
+def test_every_method_has_a_route(server):
+    assert set(mockserver.find_method_dirs()) == set(schema.SCHEMA)
+    for name, method in schema.SCHEMA.items():
+        path = method.path.replace('{', '').replace('}', '')
+        assert server.route(method.http_method, mockserver.BASE_PATH + path)[0] == name
+    assert server.route('GET', '/v1/accounts/watchlists') == (
+        'GetWatchlistsForMultipleAccounts', {})
+    assert server.route('GET', '/v1/accounts/123') == ('GetAccount', {'accountId': '123'})
+
+
+def test_market_data(server, open_client):
+    iapi = open_client(server)
+    quotes = iapi.GetQuotes(symbol='SPY,QQQ')
+    assert set(quotes) == {'SPY', 'QQQ'}
+    assert quotes['QQQ']['symbol'] == 'QQQ'
+    assert quotes['QQQ']['assetType'] == 'EQUITY'
+    assert set(iapi.GetQuote(symbol='IWM')) == {'IWM'}
+
+    history = iapi.GetPriceHistory(symbol='AAPL')
+    assert history['symbol'] == 'AAPL'
+    assert len(history['candles']) == 30
+
+    chain = iapi.GetOptionChain(symbol='SPY', strikeCount=3)
+    assert chain['symbol'] == 'SPY'
+    assert len(chain['callExpDateMap']) == 2
+    assert all(len(strikes) == 3 for strikes in chain['callExpDateMap'].values())
+
+    hours = iapi.GetHoursMultipleMarkets(markets='EQUITY', date='2021-01-04')
+    assert hours['equity']['EQ']['isOpen']
+    assert not iapi.GetHoursMultipleMarkets(
+        markets='EQUITY', date='2021-01-02')['equity']['EQ']['isOpen']
+    iapi.close()
+
+
+def test_accounts_and_orders(server, open_client):
+    iapi = open_client(server, readonly=False)
+    accounts = iapi.GetAccounts()
+    assert isinstance(accounts, list)
+    assert 'securitiesAccount' in accounts[0]
+    assert isinstance(iapi.GetOrdersByPath(accountId='123'), list)
+    assert iapi.CancelOrder(accountId='123', orderId='456') is None
+    iapi.close()
+
+
+def test_authorization(server):
+    url = server.url + '/marketdata/quotes?symbol=SPY'
+    assert requests.get(url).status_code == 401
+    token = requests.post(server.url + '/oauth2/token',
+                          data={'grant_type': 'refresh_token'}).json()
+    assert token['expires_in'] == 1800
+    headers = {'Authorization': 'Bearer ' + token['access_token']}
+    assert requests.get(url, headers=headers).ok
+    server.tokens[token['access_token']] = 0
+    assert requests.get(url, headers=headers).status_code == 401
+
+
+def test_refresh_on_expired_token(server, open_client):
+    iapi = open_client(server)
+    server.tokens['A'] = 0
+    try:
+        with mock.patch('ameritrade.auth.authenticate') as authenticate:
+            assert 'SPY' in iapi.GetQuotes(symbol='SPY')
+        authenticate.assert_not_called()
+        assert iapi.secrets['access_token'] != 'A'
+    finally:
+        del server.tokens['A']
+    iapi.close()
+
+
+def test_injected_failures():
+    with mockserver.MockServer(rate_limit_rate=1., retry_after=7) as server:
+        resp = requests.get(server.url + '/marketdata/SPY/quotes',
+                            headers={'Authorization': 'Bearer A'})
+        assert resp.status_code == 429
+        assert resp.headers['Retry-After'] == '7'
+
+    with mockserver.MockServer(error_rate=1.) as server:
+        resp = requests.get(server.url + '/marketdata/SPY/quotes',
+                            headers={'Authorization': 'Bearer A'})
+        assert resp.status_code in {400, 403, 404, 406}
+        assert 'error' in resp.json()
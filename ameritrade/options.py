@@ -6,6 +6,11 @@ The API involves at least three symbologies:
 - CUSIP (not sure using standard, see https://en.wikipedia.org/wiki/CUSIP)
 There's also (but unspported):
 - OCC terminology (https://help.yahoo.com/kb/SLN13884.html)
+
+The parsing functions memoize their results, as the same symbols come up over
+and over again, e.g., in transactions. To parse many symbols at once, use
+ParseOptionSymbols() and ParseOptionCusips(), which return columns of NumPy
+arrays and require 'numpy'.
 """
 __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
@@ -13,8 +18,18 @@ __license__ = "GNU GPLv2"
 from decimal import Decimal
 import collections
 import datetime
+import functools
 import re
-from typing import NamedTuple, Tuple
+from typing import Any, Iterable, List, NamedTuple, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The maximum number of parsed symbols and CUSIPs to memoize.
+CACHE_SIZE = 65536
 
 
 # A representation of an option.
@@ -28,9 +43,23 @@ Option = NamedTuple('Option', [
     ])
 
 
+# Columns of options, as NumPy arrays of equal lengths: the underlyings as
+# strings, the expirations as 'datetime64[D]', the strikes as floats and the
+# sides as the letters 'C' or 'P'.
+OptionArrays = NamedTuple('OptionArrays', [
+    ('symbol', Any),
+    ('expiration', Any),
+    ('strike', Any),
+    ('side', Any),
+    ])
+
+
+_OPTION_SYMBOL_RE = re.compile(r"[A-Z]+_\d{6}[CP]\d+(\.\d+)?$")
+
+
 def IsOptionSymbol(currency: str) -> bool:
     """Return true if the symbol is a TD sym."""
-    return bool(re.match(r"[A-Z]+_\d{6}[CP]\d+(\.\d+)?$", currency))
+    return bool(_OPTION_SYMBOL_RE.match(currency))
 
 
 # Equivalent underlying symbol names for weeklies and other.
@@ -40,16 +69,22 @@ _EQUIVALENT_UNDERLYINGS = {
     'NDXP': 'NDX'
 }
 
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def GetUnderlying(currency: str) -> Tuple[str, bool]:
     """Get the currency itself or the underlying, if an option."""
     if IsOptionSymbol(currency):
-        opt = ParseOptionSymbol(currency)
-        symbol = _EQUIVALENT_UNDERLYINGS.get(opt.symbol, opt.symbol)
-        return symbol, True
+        # The symbol is valid; only its name is needed.
+        symbol = currency.partition('_')[0]
+        return _EQUIVALENT_UNDERLYINGS.get(symbol, symbol), True
     else:
         return currency, False
 
 
+_DIGITS_RE = re.compile(r'\d+$')
+_STRIKE_RE = re.compile(r'[0-9\.]+$')
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def ParseOptionSymbol(string: str) -> Option:
     """Given an Ameritrade symbol for an option, parse it into its components.
 
@@ -70,13 +105,13 @@ def ParseOptionSymbol(string: str) -> Option:
     if '_' not in string:
         raise ValueError("Invalid Ameritrade symbol: '{}'".format(string))
     symbol, _, rest = string.partition('_')
-    if not re.match(r'\d+$', rest[0:6]):
+    if not _DIGITS_RE.match(rest[0:6]):
         raise ValueError("Invalid Ameritrade symbol: '{}'".format(string))
     expiration = datetime.datetime.strptime(rest[0:6], '%m%d%y').date()
     side = rest[6]
     if side not in {'C', 'P'}:
         raise ValueError("Invalid Ameritrade symbol: '{}'".format(string))
-    if not re.match(r'[0-9\.]+$', rest[7:]):
+    if not _STRIKE_RE.match(rest[7:]):
         raise ValueError("Invalid Ameritrade symbol: '{}'".format(string))
     strike = Decimal(rest[7:])
     return Option(symbol, expiration, strike, side)
@@ -119,6 +154,15 @@ def ParseOptionCusip(cusip, yeartxn=None):
       cusip: The options CUSIP to parse.
       yeartxn: An optional integer of the year of transaction.
     """
+    if yeartxn is None:
+        yeartxn = datetime.date.today().year
+    else:
+        assert isinstance(yeartxn, int)
+    return _ParseOptionCusip(cusip, yeartxn)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _ParseOptionCusip(cusip, yeartxn):
     if len(cusip) != 16 or cusip[0] != '0':
         raise ValueError("Invalid CUSIP: '{}'".format(cusip))
     symbol = cusip[1:6].strip('.')
@@ -130,11 +174,6 @@ def ParseOptionCusip(cusip, yeartxn=None):
     day = _DAYMAP.index(cusip[7])
 
     # Compute year.
-    if yeartxn is None:
-        yeartxn = datetime.date.today().year
-    else:
-        assert isinstance(yeartxn, int)
-
     yearnow = yeartxn % 10
     yearbase = yeartxn // 10 * 10
     yearchar = int(cusip[8])
@@ -152,7 +191,7 @@ def ParseOptionCusip(cusip, yeartxn=None):
         tail = cusip[9:16]
 
     # Parse strike price.
-    if not re.match(r'\d+$', tail):
+    if not _DIGITS_RE.match(tail):
         raise ValueError("Invalid CUSIP: '{}'".format(cusip))
     strike = tenk_multiplier * Decimal(10000) + Decimal(tail)/1000
 
@@ -176,3 +215,423 @@ def MakeOptionCusip(opt: Option) -> str:
         strike_str = '{:07d}'.format(strike)
     return '0{:.<5}{}{}{}{}'.format(
         opt.symbol, monthside_letter, day_letter, year_char, strike_str)
+
+
+def _RequireNumpy():
+    if numpy is None:
+        raise ImportError("Parsing options in bulk requires 'numpy'.")
+
+
+def _CharMatrix(strings: Iterable[str], kind: str) -> Tuple[Any, Any]:
+    """Get a matrix of the character codes of strings, padded with zeros.
+
+    The matrix is a view of the array of the strings, without copying them.
+
+    Returns:
+      The array of strings and the matrix, of one row per string.
+    """
+    array = numpy.asarray(strings if isinstance(strings, numpy.ndarray)
+                          else list(strings), dtype=str)
+    if array.ndim != 1:
+        raise ValueError("Expected a flat sequence of {}s.".format(kind))
+    array = numpy.ascontiguousarray(array)
+    width = max(array.itemsize // 4, 1)
+    matrix = array.view(numpy.uint32).reshape(len(array), width)
+    _Check(array, (matrix < 128).all(axis=1), kind)
+    return array, matrix
+
+
+def _Check(array, valid, kind: str):
+    """Raise an error naming the first invalid string, if any."""
+    if not valid.all():
+        raise ValueError("Invalid {}: '{}'".format(kind, array[numpy.argmin(valid)]))
+
+
+def _Strings(matrix) -> Any:
+    """Convert a matrix of character codes, padded with zeros, to an array of strings."""
+    return numpy.ascontiguousarray(matrix, dtype=numpy.uint32).view(
+        'U{}'.format(matrix.shape[1])).reshape(len(matrix))
+
+
+def _Expirations(year, month, day, valid) -> Any:
+    """Build 'datetime64[D]' expirations, and invalidate impossible dates."""
+    months = numpy.where(valid, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    expiration = months.astype('datetime64[D]') + numpy.where(valid, day - 1, 0)
+    valid &= (day >= 1) & (expiration.astype('datetime64[M]') == months)
+    return expiration
+
+
+def ParseOptionSymbols(symbols: Iterable[str]) -> OptionArrays:
+    """Parse many Ameritrade option symbols at once, into columns.
+
+    This is the bulk version of ParseOptionSymbol(), doing all the work in a
+    few vectorized operations over the whole list rather than per symbol.
+
+    Args:
+      symbols: A sequence or array of symbols like 'SPY_081718C290'.
+    Returns:
+      An OptionArrays of their components.
+    Raises:
+      ValueError: If any of the symbols is invalid.
+    """
+    _RequireNumpy()
+    kind = 'Ameritrade symbol'
+    array, matrix = _CharMatrix(symbols, kind)
+    num, width = matrix.shape
+    rows = numpy.arange(num)[:, None]
+    columns = numpy.arange(width)
+
+    # Locate the separator; the expiration and side follow it.
+    underscore = matrix == ord('_')
+    valid = underscore.any(axis=1)
+    sep = numpy.argmax(underscore, axis=1)
+    fields = numpy.minimum(sep[:, None] + 1 + numpy.arange(7), width - 1)
+    chars = matrix[rows, fields]
+    digits = chars[:, :6].astype(numpy.int64) - ord('0')
+    valid &= (sep + 8 <= width) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 10 + digits[:, 5]
+    # Two-digit years map to 1969-2068, like strptime().
+    year += numpy.where(year < 69, 2000, 1900)
+    valid &= (month >= 1) & (month <= 12)
+    side = chars[:, 6]
+    valid &= (side == ord('C')) | (side == ord('P'))
+
+    # The strike is the rest of the symbol, of digits and at most one period.
+    # Accumulate its digits column by column, as an integer and a number of
+    # decimals.
+    start = sep + 8
+    value = numpy.zeros(num, numpy.int64)
+    decimals = numpy.zeros(num, numpy.int64)
+    num_digits = numpy.zeros(num, numpy.int64)
+    period = numpy.zeros(num, bool)
+    for column in range(8, width):
+        char = matrix[:, column]
+        active = (column >= start) & (char != 0)
+        digit = char.astype(numpy.int64) - ord('0')
+        is_digit = active & (digit >= 0) & (digit <= 9)
+        is_period = active & (char == ord('.'))
+        valid &= ~active | is_digit | (is_period & ~period)
+        period |= is_period
+        value = numpy.where(is_digit, value * 10 + digit, value)
+        decimals += is_digit & period
+        num_digits += is_digit
+    # A lone period is not a number.
+    valid &= num_digits > 0
+    expiration = _Expirations(year, month, day, valid)
+    _Check(array, valid, kind)
+
+    return OptionArrays(_Strings(numpy.where(columns < sep[:, None], matrix, 0)),
+                        expiration,
+                        value / 10. ** decimals,
+                        _Strings(side[:, None]))
+
+
+# Lookup tables of the CUSIP letters: month and side, and day, with zero for
+# invalid letters.
+if numpy is not None:
+    _MONTHS = numpy.zeros(256, numpy.int64)
+    _SIDES = numpy.zeros(256, numpy.uint8)
+    for _letter, (_side, _month) in _MONTHSIDEMAP.items():
+        _MONTHS[ord(_letter)] = _month
+        _SIDES[ord(_letter)] = ord(_side)
+    _DAYS = numpy.zeros(256, numpy.int64)
+    for _day, _letter in enumerate(_DAYMAP):
+        _DAYS[ord(_letter)] = _day
+    _POWERS = 10 ** numpy.arange(6, -1, -1, dtype=numpy.int64)
+
+
+def ParseOptionCusips(cusips: Iterable[str], yeartxn=None) -> OptionArrays:
+    """Parse many Ameritrade option CUSIPs at once, into columns.
+
+    This is the bulk version of ParseOptionCusip(), doing all the work in a
+    few vectorized operations over the whole list rather than per CUSIP.
+
+    Args:
+      cusips: A sequence or array of CUSIPs like '0SPY..HH80290000'.
+      yeartxn: An optional integer of the year of transaction.
+    Returns:
+      An OptionArrays of their components.
+    Raises:
+      ValueError: If any of the CUSIPs is invalid.
+    """
+    _RequireNumpy()
+    if yeartxn is None:
+        yeartxn = datetime.date.today().year
+    else:
+        assert isinstance(yeartxn, int)
+    kind = 'CUSIP'
+    array, matrix = _CharMatrix(cusips, kind)
+    valid = (matrix != 0).sum(axis=1) == 16
+    if matrix.shape[1] != 16:
+        matrix = numpy.pad(matrix, ((0, 0), (0, max(16 - matrix.shape[1], 0))))[:, :16]
+    valid &= matrix[:, 0] == ord('0')
+
+    # The symbol is padded with periods on the right.
+    symbol = matrix[:, 1:6]
+    padding = numpy.logical_and.accumulate(symbol[:, ::-1] == ord('.'), axis=1)[:, ::-1]
+    symbol = numpy.where(padding, 0, symbol)
+
+    month = _MONTHS[matrix[:, 6]]
+    side = _SIDES[matrix[:, 6]]
+    day = _DAYS[matrix[:, 7]]
+    yearchar = matrix[:, 8].astype(numpy.int64) - ord('0')
+    valid &= (month != 0) & (yearchar >= 0) & (yearchar <= 9)
+    yearnow = yeartxn % 10
+    year = yeartxn // 10 * 10 + numpy.where(yearchar - yearnow < -5, 10, 0) + yearchar
+
+    # The strike is in thousandths, with the last digit replaced by a letter
+    # counting ten thousands for the larger ones.
+    last = matrix[:, 15]
+    tenk = numpy.where(last > ord('9'), last.astype(numpy.int64) - ord('A') + 1, 0)
+    digits = matrix[:, 9:16].astype(numpy.int64) - ord('0')
+    digits[:, 6] = numpy.where(tenk > 0, 0, digits[:, 6])
+    valid &= ((digits >= 0) & (digits <= 9)).all(axis=1) & (tenk >= 0)
+    strike = tenk * 10000 + (digits @ _POWERS) / 1000
+    expiration = _Expirations(year, month, day, valid)
+    _Check(array, valid, kind)
+
+    return OptionArrays(_Strings(symbol), expiration, strike,
+                        _Strings(side[:, None]))
+
+
+# The sides of the options in an OptionTable, as bits of a mask.
+CALL = 1
+PUT = 2
+
+# The strikes in an OptionTable are integers, in thousandths, like in CUSIPs.
+STRIKE_SCALE = 1000
+
+
+def _StrikeDecimal(value: int) -> Decimal:
+    """Convert a scaled integer strike to a Decimal, without trailing zeros."""
+    whole, fraction = divmod(int(value), STRIKE_SCALE)
+    if not fraction:
+        return Decimal(whole)
+    return Decimal('{}.{:03d}'.format(whole, fraction).rstrip('0'))
+
+
+class OptionTable:
+    """A compact table of options, with a NumPy array per component.
+
+    This holds millions of contracts in a fraction of the memory of Option
+    tuples, at 13 bytes per contract:
+
+    - codes: The indexes of the underlyings in 'underlyings', an array of the
+      distinct underlyings, as int32.
+    - days: The expirations as the number of days since 1970-01-01, as int32.
+    - strikes: The strikes in thousandths (see STRIKE_SCALE), as int32.
+    - sides: The sides as CALL or PUT bits, as uint8.
+
+    Indexing with an integer returns an Option. Slicing returns a table whose
+    arrays are views of those of the original, without copying them; indexing
+    with an array of indexes or a boolean mask returns a table of copies, e.g.,
+
+        puts = table[(table.sides & options.PUT) != 0]
+    """
+
+    __slots__ = ('underlyings', 'codes', 'days', 'strikes', 'sides')
+
+    def __init__(self, underlyings, codes, days, strikes, sides):
+        _RequireNumpy()
+        self.underlyings = numpy.asarray(underlyings, dtype=str)
+        self.codes = numpy.asarray(codes, dtype=numpy.int32)
+        self.days = numpy.asarray(days, dtype=numpy.int32)
+        self.strikes = numpy.asarray(strikes, dtype=numpy.int32)
+        self.sides = numpy.asarray(sides, dtype=numpy.uint8)
+        if not (len(self.codes) == len(self.days) == len(self.strikes) == len(self.sides)):
+            raise ValueError("The columns of an OptionTable must have equal lengths.")
+
+    @classmethod
+    def from_options(cls, opts: Iterable[Option]) -> 'OptionTable':
+        """Build a table from Option tuples."""
+        _RequireNumpy()
+        interned = {}
+        codes, days, strikes, sides = [], [], [], []
+        epoch = datetime.date(1970, 1, 1).toordinal()
+        for opt in opts:
+            codes.append(interned.setdefault(opt.symbol, len(interned)))
+            days.append(opt.expiration.toordinal() - epoch)
+            strikes.append(int(opt.strike * STRIKE_SCALE))
+            sides.append(CALL if opt.side[0].upper() == 'C' else PUT)
+        underlyings = numpy.array(list(interned), dtype=str)
+        return cls(underlyings, codes, days, strikes, sides)
+
+    @classmethod
+    def from_arrays(cls, arrays: OptionArrays) -> 'OptionTable':
+        """Build a table from columns, e.g., from ParseOptionSymbols()."""
+        _RequireNumpy()
+        underlyings, codes = numpy.unique(numpy.asarray(arrays.symbol, dtype=str),
+                                          return_inverse=True)
+        days = numpy.asarray(arrays.expiration, dtype='datetime64[D]').astype(numpy.int64)
+        strikes = numpy.rint(numpy.asarray(arrays.strike, dtype=numpy.float64) *
+                             STRIKE_SCALE)
+        sides = numpy.where(numpy.asarray(arrays.side) == 'C', CALL, PUT)
+        return cls(underlyings, codes.reshape(-1), days, strikes, sides)
+
+    @classmethod
+    def from_symbols(cls, symbols: Iterable[str]) -> 'OptionTable':
+        """Build a table by parsing Ameritrade option symbols."""
+        return cls.from_arrays(ParseOptionSymbols(symbols))
+
+    @classmethod
+    def from_cusips(cls, cusips: Iterable[str], yeartxn=None) -> 'OptionTable':
+        """Build a table by parsing Ameritrade option CUSIPs."""
+        return cls.from_arrays(ParseOptionCusips(cusips, yeartxn))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, numpy.integer)):
+            return Option(str(self.underlyings[self.codes[index]]),
+                          datetime.date.fromordinal(
+                              int(self.days[index]) + datetime.date(1970, 1, 1).toordinal()),
+                          _StrikeDecimal(self.strikes[index]),
+                          'C' if self.sides[index] & CALL else 'P')
+        return OptionTable(self.underlyings, self.codes[index], self.days[index],
+                           self.strikes[index], self.sides[index])
+
+    def __iter__(self):
+        return iter(self.to_options())
+
+    def __repr__(self):
+        return '<OptionTable of {} options on {} underlyings>'.format(
+            len(self), len(self.underlyings))
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the columns, in bytes."""
+        return (self.codes.nbytes + self.days.nbytes + self.strikes.nbytes +
+                self.sides.nbytes + self.underlyings.nbytes)
+
+    @property
+    def symbol(self):
+        """The underlyings, as an array of strings."""
+        return self.underlyings[self.codes]
+
+    @property
+    def expiration(self):
+        """The expirations, as 'datetime64[D]'."""
+        return self.days.astype('datetime64[D]')
+
+    @property
+    def strike(self):
+        """The strikes, as floats."""
+        return self.strikes / STRIKE_SCALE
+
+    @property
+    def side(self):
+        """The sides, as the letters 'C' or 'P'."""
+        return numpy.where(self.sides & CALL, 'C', 'P')
+
+    def to_arrays(self) -> OptionArrays:
+        """Convert to columns of plain values."""
+        return OptionArrays(self.symbol, self.expiration, self.strike, self.side)
+
+    def to_options(self) -> List[Option]:
+        """Convert to Option tuples."""
+        epoch = datetime.date(1970, 1, 1).toordinal()
+        # Convert each distinct value once.
+        dates = {}
+        strikes = {}
+        underlyings = self.underlyings.tolist()
+        opts = []
+        for code, day, strike, side in zip(self.codes.tolist(), self.days.tolist(),
+                                           self.strikes.tolist(), self.sides.tolist()):
+            expiration = dates.get(day)
+            if expiration is None:
+                expiration = dates[day] = datetime.date.fromordinal(day + epoch)
+            value = strikes.get(strike)
+            if value is None:
+                value = strikes[strike] = _StrikeDecimal(strike)
+            opts.append(Option(underlyings[code], expiration, value,
+                               'C' if side & CALL else 'P'))
+        return opts
+
+
+def _Pieces(strings: List[str], inverse) -> Tuple[Any, Any]:
+    """Get the character matrix and lengths of strings, for a column of indexes."""
+    _, matrix = _CharMatrix(strings or [''], 'string')
+    return matrix[inverse], (matrix != 0).sum(axis=1)[inverse]
+
+
+def _Concatenate(pieces: List[Tuple[Any, Any]]) -> Any:
+    """Concatenate columns of strings given as (matrix, lengths) pairs."""
+    num = len(pieces[0][0])
+    output = numpy.zeros((num, max(sum(matrix.shape[1] for matrix, _ in pieces), 1)),
+                         numpy.uint32)
+    offsets = numpy.zeros(num, numpy.int64)
+    for matrix, lengths in pieces:
+        rows, columns = numpy.nonzero(numpy.arange(matrix.shape[1]) < lengths[:, None])
+        output[rows, offsets[rows] + columns] = matrix[rows, columns]
+        offsets += lengths
+    return _Strings(output)
+
+
+def MakeOptionSymbols(table: OptionTable) -> Any:
+    """Build the option symbols of a whole table, as an array of strings.
+
+    This is the bulk version of MakeOptionSymbol(). The strikes are written
+    without trailing zeros after their decimal point.
+    """
+    underlyings = _Pieces(table.underlyings.tolist(), table.codes)
+    unique_days, day_index = numpy.unique(table.days, return_inverse=True)
+    dates = _Pieces(['_{:%m%d%y}'.format(date) for date in
+                     unique_days.astype('datetime64[D]').tolist()], day_index.reshape(-1))
+    sides = _Pieces(['', 'C', 'P', 'C'], table.sides & (CALL | PUT))
+    unique_strikes, strike_index = numpy.unique(table.strikes, return_inverse=True)
+    strikes = _Pieces([str(_StrikeDecimal(strike)) for strike in unique_strikes.tolist()],
+                      strike_index.reshape(-1))
+    return _Concatenate([underlyings, dates, sides, strikes])
+
+
+if numpy is not None:
+    # The letters of the month and side of CUSIPs, indexed by side bit and month.
+    _MONTHSIDE_LETTERS = numpy.zeros((PUT + 1, 13), numpy.uint32)
+    for (_side, _month), _letter in _MONTHSIDEMAPINV.items():
+        _MONTHSIDE_LETTERS[CALL if _side == 'C' else PUT, _month] = ord(_letter)
+    _DAY_LETTERS = numpy.array([ord(letter) for letter in _DAYMAP], numpy.uint32)
+
+
+def MakeOptionCusips(table: OptionTable) -> Any:
+    """Build the CUSIPs of a whole table, as an array of strings.
+
+    This is the bulk version of MakeOptionCusip().
+    """
+    num = len(table)
+    _, symbols = _CharMatrix(table.underlyings, 'underlying')
+    if symbols.shape[1] > 5 and symbols[:, 5:].any():
+        raise ValueError("Underlyings are limited to 5 characters in CUSIPs.")
+    strikes = table.strikes.astype(numpy.int64)
+    if (strikes >= 100000 * STRIKE_SCALE).any():
+        raise ValueError("Strikes are limited to 100000 in CUSIPs.")
+
+    output = numpy.zeros((num, 16), numpy.uint32)
+    output[:, 0] = ord('0')
+    padded = numpy.full((len(symbols), 5), ord('.'), numpy.uint32)
+    padded[:, :min(symbols.shape[1], 5)] = symbols[:, :5]
+    padded[padded == 0] = ord('.')
+    output[:, 1:6] = padded[table.codes]
+
+    expiration = table.days.astype('datetime64[D]')
+    months = expiration.astype('datetime64[M]')
+    month = months.astype(numpy.int64) % 12 + 1
+    year = months.astype('datetime64[Y]').astype(numpy.int64) + 1970
+    day = (expiration - months.astype('datetime64[D]')).astype(numpy.int64) + 1
+    output[:, 6] = _MONTHSIDE_LETTERS[numpy.where(table.sides & CALL, CALL, PUT), month]
+    output[:, 7] = _DAY_LETTERS[day]
+    output[:, 8] = year % 10 + ord('0')
+
+    # Strikes of ten thousand and more have their last digit replaced by a letter
+    # counting the ten thousands.
+    tenk = strikes // (10000 * STRIKE_SCALE)
+    large = tenk > 0
+    digits = numpy.where(large, strikes % (10000 * STRIKE_SCALE) // 10, strikes)
+    for column in range(7):
+        output[:, 15 - column] = digits % 10 + ord('0')
+        digits //= 10
+    output[:, 9:15] = numpy.where(large[:, None], output[:, 10:16], output[:, 9:15])
+    output[:, 15] = numpy.where(large, tenk - 1 + ord('A'), output[:, 15])
+    return _Strings(output)
@@ -2,7 +2,9 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 import datetime
+import re
 from decimal import Decimal as D
+import pytest
 from ameritrade import options
 
 
@@ -54,3 +56,92 @@ def test_parse_option_cusip():
 def test_make_option_cusip():
     for _, cusip, opt in _TESTDATA:
         assert options.MakeOptionCusip(opt) == cusip
+
+def test_parse_memoized():
+    options.ParseOptionSymbol.cache_clear()
+    opt = options.ParseOptionSymbol('SPY_081718C290')
+    assert options.ParseOptionSymbol('SPY_081718C290') is opt
+    assert options.ParseOptionSymbol.cache_info().hits == 1
+    assert options.ParseOptionCusip('0SPY..HH80290000', 2019) is (
+        options.ParseOptionCusip('0SPY..HH80290000', 2019))
+    assert options.GetUnderlying('SPXW_012021P3520') == ('SPX', True)
+    assert options.GetUnderlying('SPY') == ('SPY', False)
+
+def test_parse_option_symbols():
+    numpy = pytest.importorskip('numpy')
+    columns = options.ParseOptionSymbols([symbol for symbol, _, _ in _TESTDATA])
+    assert columns.expiration.dtype == numpy.dtype('datetime64[D]')
+    for index, (_, _, opt) in enumerate(_TESTDATA):
+        assert columns.symbol[index] == opt.symbol
+        assert columns.expiration[index].item() == opt.expiration
+        assert columns.strike[index] == float(opt.strike)
+        assert columns.side[index] == opt.side
+    assert options.ParseOptionSymbols(['SPY_081718C2.5']).strike[0] == 2.5
+    columns = options.ParseOptionSymbols(['SPY_081718C5.', 'SPY_081718C.5'])
+    assert columns.strike.tolist() == [5., 0.5]
+    assert len(options.ParseOptionSymbols([]).symbol) == 0
+
+    # The symbols which the scalar parser rejects are rejected in bulk too.
+    for invalid in ['SPY081718C290', 'SPY_131718C290', 'SPY_023018C290',
+                    'SPY_081718X290', 'SPY_081718C', 'SPY_081718C2.9.0', 'SPY_0817',
+                    'SPY_081718C.']:
+        with pytest.raises((ValueError, ArithmeticError)):
+            options.ParseOptionSymbol.__wrapped__(invalid)
+        with pytest.raises(ValueError, match=re.escape(invalid)):
+            options.ParseOptionSymbols(['SPY_081718C290', invalid])
+
+def test_parse_option_cusips():
+    pytest.importorskip('numpy')
+    columns = options.ParseOptionCusips([cusip for _, cusip, _ in _TESTDATA], 2019)
+    for index, (_, _, opt) in enumerate(_TESTDATA):
+        assert columns.symbol[index] == opt.symbol
+        assert columns.expiration[index].item() == opt.expiration
+        assert columns.strike[index] == float(opt.strike)
+        assert columns.side[index] == opt.side
+
+    for invalid in ['0SPY..HH8029000', '0SPY..HH802900000', '1SPY..HH80290000',
+                    '0SPY..ZH80290000', '0SPY..BU80290000', '0SPY..HH8029X000']:
+        with pytest.raises(ValueError, match=invalid.replace('.', r'\.')):
+            options.ParseOptionCusips(['0SPY..HH80290000', invalid], 2019)
+
+def test_option_table():
+    numpy = pytest.importorskip('numpy')
+    opts = [opt for _, _, opt in _TESTDATA]
+    table = options.OptionTable.from_options(opts)
+    assert len(table) == len(opts)
+    assert table.nbytes < 14 * len(opts) + table.underlyings.nbytes
+    assert table.to_options() == opts
+    assert list(table) == opts
+    assert table[-1] == opts[-1]
+    assert list(table.symbol) == [opt.symbol for opt in opts]
+    assert table.expiration[0] == numpy.datetime64('2018-02-16')
+    assert table.strike[-2] == 13280.
+
+    # Slices are views of the same arrays.
+    view = table[2:10]
+    assert numpy.shares_memory(view.strikes, table.strikes)
+    assert view.to_options() == opts[2:10]
+    puts = table[(table.sides & options.PUT) != 0]
+    assert puts.to_options() == [opt for opt in opts if opt.side == 'P']
+
+    # Parsed columns convert to the same table.
+    assert options.OptionTable.from_symbols(
+        [symbol for symbol, _, _ in _TESTDATA]).to_options() == opts
+    assert options.OptionTable.from_cusips(
+        [cusip for _, cusip, _ in _TESTDATA], 2019).to_options() == opts
+    assert options.OptionTable.from_options([]).to_options() == []
+
+def test_make_options_in_bulk():
+    pytest.importorskip('numpy')
+    table = options.OptionTable.from_options([opt for _, _, opt in _TESTDATA])
+    assert list(options.MakeOptionSymbols(table)) == [symbol for symbol, _, _ in _TESTDATA]
+    assert list(options.MakeOptionCusips(table)) == [cusip for _, cusip, _ in _TESTDATA]
+    assert list(options.MakeOptionSymbols(table[::-1])) == [
+        symbol for symbol, _, _ in _TESTDATA[::-1]]
+
+    table = options.OptionTable.from_options([_O('SPY', (2018, 8, 17), D('2.125'), 'P')])
+    assert list(options.MakeOptionSymbols(table)) == ['SPY_081718P2.125']
+    assert options.MakeOptionCusips(table)[0] == options.MakeOptionCusip(table[0])
+    with pytest.raises(ValueError):
+        options.MakeOptionCusips(options.OptionTable.from_options(
+            [_O('GOOGLE', (2018, 8, 17), D('100'), 'C')]))
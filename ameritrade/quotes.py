@@ -0,0 +1,163 @@
+"""A facade to fetch quotes for any number of symbols in few calls.
+
+GetQuotes() accepts a comma-separated list of symbols, but the length of its
+URL is limited, while calling GetQuote() for each symbol uses a call of the
+rate limit per symbol. A QuoteFetcher does both ways better:
+
+- get_quotes() splits large sets of symbols into chunks which fit in a URL,
+  fetches them concurrently and merges the results.
+
+- get_quote() gathers the symbols requested from all threads within a short
+  window and fetches them together with a single call.
+
+Usage:
+
+    fetcher = quotes.QuoteFetcher(api)
+    quotes = fetcher.get_quotes(symbols)
+    quote = fetcher.get_quote('SPY')
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Dict, Iterable, List, Optional
+import concurrent.futures
+import threading
+import urllib.parse
+
+
+# The maximum length of the list of symbols in the URL of a call, once encoded.
+MAX_QUERY_LENGTH = 4000
+
+# The maximum number of symbols in a call.
+MAX_SYMBOLS = 500
+
+# The time to wait for other symbols to batch with, in seconds.
+BATCH_WINDOW = 0.01
+
+
+def chunk_symbols(symbols: Iterable[str],
+                  max_length: int = MAX_QUERY_LENGTH,
+                  max_symbols: int = MAX_SYMBOLS) -> List[List[str]]:
+    """Split symbols into chunks whose comma-separated lists fit in a URL.
+
+    Duplicates are removed, and the order of the symbols is preserved.
+    """
+    chunks = []
+    chunk, length = [], 0
+    for symbol in dict.fromkeys(symbols):
+        # Add the length of the encoded comma separator.
+        size = len(urllib.parse.quote(symbol, safe='')) + (3 if chunk else 0)
+        if chunk and (length + size > max_length or len(chunk) >= max_symbols):
+            chunks.append(chunk)
+            chunk, length = [], 0
+            size -= 3
+        chunk.append(symbol)
+        length += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class _Batch:
+    """The symbols requested by get_quote() within a window."""
+
+    def __init__(self):
+        self.futures: Dict[str, concurrent.futures.Future] = {}
+        self.full = threading.Event()
+
+
+class QuoteFetcher:
+    """Fetches quotes in as few calls as possible."""
+
+    def __init__(self, api: Any,
+                 max_length: int = MAX_QUERY_LENGTH,
+                 max_symbols: int = MAX_SYMBOLS,
+                 window: float = BATCH_WINDOW,
+                 max_workers: Optional[int] = None):
+        """Create a fetcher.
+
+        Args:
+          api: An AmeritradeAPI instance.
+          max_length: The maximum length of the list of symbols of a call.
+          max_symbols: The maximum number of symbols of a call.
+          window: The time get_quote() waits for other symbols, in seconds.
+          max_workers: The number of calls to make concurrently, by default the
+            size of the connection pool of the API.
+        """
+        self.api = api
+        self.max_length = max_length
+        self.max_symbols = max_symbols
+        self.window = window
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.batch: Optional[_Batch] = None
+
+    def get_quotes(self, symbols: Iterable[str]) -> Dict[str, Any]:
+        """Fetch the quotes of any number of symbols.
+
+        Returns:
+          A dict of quotes by symbol. Unknown symbols are missing from it.
+        Raises:
+          IOError: If any of the calls failed.
+        """
+        chunks = chunk_symbols(symbols, self.max_length, self.max_symbols)
+        if not chunks:
+            return {}
+        if len(chunks) == 1:
+            return _check(self.api.GetQuotes(symbol=','.join(chunks[0])))
+        results = self.api.map('GetQuotes', [dict(symbol=','.join(chunk))
+                                             for chunk in chunks],
+                               self.max_workers)
+        quotes = {}
+        for result in results:
+            if result.error is not None:
+                raise result.error
+            quotes.update(_check(result.value))
+        return quotes
+
+    def get_quote(self, symbol: str) -> Optional[Any]:
+        """Fetch the quote of a symbol, batched with those requested concurrently.
+
+        Returns:
+          The quote, or None if the symbol is unknown.
+        """
+        with self.lock:
+            batch = self.batch
+            leader = batch is None
+            if leader:
+                batch = self.batch = _Batch()
+            future = batch.futures.get(symbol)
+            if future is None:
+                future = batch.futures[symbol] = concurrent.futures.Future()
+                if len(batch.futures) >= self.max_symbols:
+                    # Don't accept any more symbols in this batch.
+                    self.batch = None
+                    batch.full.set()
+        if leader:
+            self._fetch_batch(batch)
+        return future.result()
+
+    def _fetch_batch(self, batch: _Batch):
+        """Wait for the window to close, then fetch the quotes of a batch."""
+        batch.full.wait(self.window)
+        with self.lock:
+            if self.batch is batch:
+                self.batch = None
+        futures = batch.futures
+        try:
+            quotes = self.get_quotes(list(futures))
+        except Exception as exc:
+            for future in futures.values():
+                future.set_exception(exc)
+        else:
+            for symbol, future in futures.items():
+                future.set_result(quotes.get(symbol))
+
+
+def _check(response: Any) -> Dict[str, Any]:
+    """Check the response of GetQuotes()."""
+    if response is None:
+        return {}
+    if 'error' in response:
+        raise IOError("Error fetching quotes: {}".format(response['error']))
+    return response
@@ -0,0 +1,88 @@
+"""Unit tests for the quote fetcher."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+import concurrent.futures
+import json
+
+import pytest
+import requests
+
+from ameritrade import api
+from ameritrade import quotes
+
+
+def test_chunk_symbols():
+    assert quotes.chunk_symbols([]) == []
+    assert quotes.chunk_symbols(['SPY', 'QQQ', 'SPY']) == [['SPY', 'QQQ']]
+    assert quotes.chunk_symbols(['AAA', 'BBB', 'CCC'], max_length=8) == [
+        ['AAA'], ['BBB'], ['CCC']]
+    assert quotes.chunk_symbols(['AAA', 'BBB', 'CCC'], max_length=9) == [
+        ['AAA', 'BBB'], ['CCC']]
+    assert quotes.chunk_symbols(['/ES', 'AAA'], max_length=11) == [['/ES', 'AAA']]
+    assert quotes.chunk_symbols(['/ES', 'AAA'], max_length=10) == [['/ES'], ['AAA']]
+
+    symbols = ['S{:04d}'.format(index) for index in range(2000)]
+    chunks = quotes.chunk_symbols(symbols)
+    assert len(chunks) == 4
+    assert [symbol for chunk in chunks for symbol in chunk] == symbols
+
+
+def quotes_response(method, url, params=None, **kw):
+    """Respond to GetQuotes() with a quote for each symbol, except unknown ones."""
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = json.dumps({symbol: {'symbol': symbol}
+                                for symbol in params['symbol'].split(',')
+                                if symbol != 'UNKNOWN'}).encode('utf8')
+    return resp
+
+
+@pytest.fixture
+def iapi():
+    with mock.patch('ameritrade.auth.get_headers', return_value={}), \
+         mock.patch('ameritrade.auth.read_or_create_secrets'):
+        iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None))
+        yield iapi
+        iapi.close()
+
+
+def test_get_quotes(iapi):
+    fetcher = quotes.QuoteFetcher(iapi, max_symbols=100)
+    symbols = ['S{:04d}'.format(index) for index in range(250)]
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=quotes_response) as request:
+        result = fetcher.get_quotes(symbols + ['UNKNOWN'])
+    assert request.call_count == 3
+    assert sorted(result) == symbols
+
+    error = requests.Response()
+    error.status_code = 200
+    error._content = b'{"error": "Not authorized"}'
+    with mock.patch.object(iapi.session, 'request', return_value=error):
+        with pytest.raises(IOError):
+            fetcher.get_quotes(['SPY'])
+
+
+def test_get_quote(iapi):
+    fetcher = quotes.QuoteFetcher(iapi, window=0.2)
+    symbols = ['SPY', 'QQQ', 'IWM', 'SPY', 'UNKNOWN']
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=quotes_response) as request:
+        with concurrent.futures.ThreadPoolExecutor(len(symbols)) as executor:
+            results = list(executor.map(fetcher.get_quote, symbols))
+    assert request.call_count == 1
+    assert [quote and quote.symbol for quote in results] == [
+        'SPY', 'QQQ', 'IWM', 'SPY', None]
+
+
+def test_get_quote_full_batch(iapi):
+    fetcher = quotes.QuoteFetcher(iapi, max_symbols=2, window=10)
+    with mock.patch.object(iapi.session, 'request',
+                           side_effect=quotes_response) as request:
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            results = list(executor.map(fetcher.get_quote, ['SPY', 'QQQ']))
+    # The batch is fetched as soon as it is full, without waiting for the window.
+    assert request.call_count == 1
+    assert [quote.symbol for quote in results] == ['SPY', 'QQQ']
@@ -0,0 +1,120 @@
+"""Retry policy and request hedging for calls to the API.
+
+A RetryPolicy describes which failures of a call are transient and how long to
+wait before trying again: exponential backoff with jitter, on a set of HTTP
+status codes and exceptions. Only the HTTP methods listed in the policy are
+retried; by default that's only GET methods, so that orders never get sent
+twice.
+
+Independently, GET calls can be hedged: if a call hasn't returned after a
+delay derived from a percentile of the recent latencies of its method, a
+duplicate request is sent and the first response to arrive wins. This trades a
+few extra requests for a shorter tail of latencies.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional, Tuple, TypeVar
+import collections
+import concurrent.futures
+import random
+import threading
+
+import requests
+
+
+RetryPolicy = NamedTuple('RetryPolicy', [
+    # Maximum number of attempts, including the first one.
+    ('max_attempts', int),
+    # Delay before the first retry, doubling on every attempt, in seconds.
+    ('backoff_base', float),
+    # Maximum delay between attempts, in seconds.
+    ('backoff_max', float),
+    # Fraction of the delay to randomize, between 0 and 1.
+    ('jitter', float),
+    # HTTP status codes which are retried.
+    ('retry_statuses', FrozenSet[int]),
+    # Exception types which are retried.
+    ('retry_exceptions', Tuple[type, ...]),
+    # HTTP methods which may be retried.
+    ('methods', FrozenSet[str]),
+])
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    max_attempts=3,
+    backoff_base=0.5,
+    backoff_max=10.,
+    jitter=0.5,
+    retry_statuses=frozenset({500, 502, 503, 504}),
+    retry_exceptions=(requests.ConnectionError, requests.Timeout),
+    methods=frozenset({'GET'}))
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int) -> float:
+    """Compute the delay before retrying after a failed attempt.
+
+    Args:
+      policy: The retry policy.
+      attempt: The number of the attempt which failed, from zero.
+    """
+    delay = min(policy.backoff_max, policy.backoff_base * 2 ** attempt)
+    return delay * (1 - policy.jitter * random.random())
+
+
+class LatencyTracker:
+    """Keep the latest latencies of each method, to compute percentiles."""
+
+    def __init__(self, size: int = 100, min_samples: int = 10):
+        self.size = size
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, collections.deque] = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.size))
+
+    def record(self, name: str, latency: float):
+        """Record the latency of a call to a method, in seconds."""
+        with self.lock:
+            self.latencies[name].append(latency)
+
+    def percentile(self, name: str, percentile: float) -> Optional[float]:
+        """Return a percentile of the latencies of a method, if enough are known."""
+        with self.lock:
+            latencies = sorted(self.latencies[name])
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100.))
+        return latencies[index]
+
+
+T = TypeVar('T')
+
+
+def hedged_call(executor: concurrent.futures.Executor,
+                call: Callable[[], T],
+                delay: float,
+                hedge: Optional[Callable[[], T]] = None) -> T:
+    """Run a call, and a duplicate if the first hasn't returned after 'delay'.
+
+    The result of the first call to complete successfully is returned. If both
+    fail, the error of the first one is raised.
+
+    Args:
+      executor: The executor to run the calls on.
+      call: The call to make.
+      delay: The number of seconds to wait before sending the duplicate.
+      hedge: An optional different callable to make as the duplicate.
+    """
+    first = executor.submit(call)
+    done, _ = concurrent.futures.wait([first], timeout=delay)
+    if done:
+        return first.result()
+    second = executor.submit(hedge or call)
+    pending = {first, second}
+    while pending:
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+    return first.result()
@@ -0,0 +1,69 @@
+"""Unit tests for retry policy and hedging."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import concurrent.futures
+import threading
+
+import pytest
+
+from ameritrade import retry
+
+
+def test_backoff_delay():
+    policy = retry.DEFAULT_RETRY_POLICY._replace(backoff_base=1., backoff_max=5.,
+                                                 jitter=0.)
+    assert [retry.backoff_delay(policy, attempt)
+            for attempt in range(5)] == [1., 2., 4., 5., 5.]
+    policy = policy._replace(jitter=0.5)
+    for _ in range(100):
+        assert 1. <= retry.backoff_delay(policy, 1) <= 2.
+
+
+def test_latency_tracker():
+    tracker = retry.LatencyTracker(size=100, min_samples=10)
+    for i in range(9):
+        tracker.record('GetQuote', i / 100)
+    assert tracker.percentile('GetQuote', 95) is None
+    for i in range(9, 200):
+        tracker.record('GetQuote', i / 100)
+    # Only the latest 100 are kept.
+    assert tracker.percentile('GetQuote', 0) == 1.
+    assert tracker.percentile('GetQuote', 95) == 1.95
+    assert tracker.percentile('GetQuotes', 95) is None
+
+
+def test_hedged_call():
+    executor = concurrent.futures.ThreadPoolExecutor(4)
+
+    # A fast call does not get hedged.
+    calls = []
+    def fast():
+        calls.append(1)
+        return 'fast'
+    assert retry.hedged_call(executor, fast, 1.) == 'fast'
+    assert len(calls) == 1
+
+    # A slow call does, and the hedge wins.
+    release = threading.Event()
+    def slow():
+        release.wait(5)
+        return 'slow'
+    assert retry.hedged_call(executor, slow, 0.01, lambda: 'hedge') == 'hedge'
+    release.set()
+
+    # A failing hedge does not win.
+    release.clear()
+    def fail():
+        raise ValueError
+    def slow_then_release():
+        release.wait(0.1)
+        return 'slow'
+    assert retry.hedged_call(executor, slow_then_release, 0.01, fail) == 'slow'
+
+    # Both failing raises the error of the first.
+    def fail_slowly():
+        release.wait(0.05)
+        raise KeyError
+    with pytest.raises(KeyError):
+        retry.hedged_call(executor, fail_slowly, 0.01, fail)
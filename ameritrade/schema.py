@@ -26,6 +26,7 @@ PreparedMethod = NamedTuple('PreparedMethod', [
     ('all_fields', Set[str]),
     ('url_fields', Set[str]),
     ('required_fields', Set[str]),
+    ('description', str),
 ])
 
 Arg = NamedTuple('Arg', [
@@ -51,7 +52,8 @@ def prepare(method):
                           method.fields,
                           all_fields,
                           url_fields,
-                          required_fields)
+                          required_fields,
+                          method.description)
 
 def _get_validator(name, validator):
     return (validator
@@ -199,6 +201,18 @@ _VALIDATORS_BY_NAME = {
     'accountId': TypeValidator(str)
 }
 
+# The fields whose values are comma-separated lists in which the order of the
+# elements doesn't matter, by method. This is used to build canonical keys for
+# caching responses.
+COMMA_LIST_FIELDS = {
+    'GetAccount': {'fields'},
+    'GetAccounts': {'fields'},
+    'GetHoursMultipleMarkets': {'markets'},
+    'GetQuotes': {'symbol'},
+    'GetStreamerSubscriptionKeys': {'accountIds'},
+    'GetUserPrincipals': {'fields'},
+}
+
 _SCHEMA_DIR = path.join(path.dirname(__file__), 'schemas_old')
 
 
@@ -33,7 +33,8 @@ def add_args(parser):
     parser.add_argument('--ameritrade-cache', action='store',
                         default=None,
                         help=("If set, a cache directory to update and read responses from "
-                              "instead of hitting the servers. This sets the API to "
+                              "instead of hitting the servers. The responses are stored "
+                              "in a single database file in it. This sets the API to "
                               "connect to the servers lazily by default."))
 
 
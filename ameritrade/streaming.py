@@ -0,0 +1,334 @@
+"""Incremental decoding of large responses, such as candles and option chains.
+
+Instead of decoding a whole response into memory, the body of the response is
+read in chunks and scanned for the items of a few lists, e.g., the 'candles'
+of GetPriceHistory() or the contracts in the expiration maps of
+GetOptionChain(). Each item is decoded and yielded as soon as it is complete,
+and the bytes it was read from are dropped. The memory used is bounded by the
+size of the chunks and of the largest item, regardless of the size of the
+response. Usage:
+
+    stream = streaming.iter_option_chain(api, symbol='SPY')
+    for item in stream:
+        print(item.putCall, item.expiration, item.strike, item.contract.bid)
+    print(stream.fields.underlyingPrice)
+
+The scanner does not validate the JSON between the items; the items themselves
+are decoded with the decoder configured in the API.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import json
+import re
+
+import requests
+
+from ameritrade import decoding
+
+
+# A path of keys to a list, from the root object. '*' matches any key.
+Pattern = Tuple[str, ...]
+
+# A run of text without brackets, over complete strings.
+_SKIP = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*')
+
+# A complete string.
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+_QUOTE, _OPEN_BRACE, _OPEN_BRACKET = b'"{['
+
+# The modes of the containers being scanned.
+_FOLLOW = 0  # An object on the way to a list to stream, whose keys are tracked.
+_ITEMS = 1   # A list whose elements are streamed.
+
+
+class JsonStreamParser:
+    """An incremental parser yielding the elements of some lists of a document.
+
+    The lists to stream are given as patterns of keys from the root object,
+    e.g., ('callExpDateMap', '*', '*'). The elements of those lists which are
+    objects or lists are decoded and returned by feed() as they get completed,
+    along with the path of keys to their list. A pattern of () streams the
+    elements of a document which is a list.
+
+    The other members of the root object are collected, once the document is
+    complete, into the 'fields' attribute, with None in place of the streamed
+    containers. Anything else is skipped.
+    """
+
+    def __init__(self, patterns: Iterable[Pattern],
+                 decode: decoding.Decoder = decoding.decode_decimal):
+        self.patterns = [tuple(pattern) for pattern in patterns]
+        self.decode = decode
+        self.fields = None
+
+        # The unprocessed data, the position to scan from, and the position of
+        # the text after the last bracket processed.
+        self.buffer = b''
+        self.pos = 0
+        self.mark = 0
+        # The stack of containers being followed, as (mode, path) pairs.
+        self.stack: List[Tuple[int, Tuple[str, ...]]] = []
+        # The depth within a container being skipped or captured.
+        self.skip_depth = 0
+        # The start of the container being captured, and the key of the root
+        # field it is the value of, if any.
+        self.capture_start: Optional[int] = None
+        self.capture_key: Optional[str] = None
+        # The text of the root object without its containers, and the values
+        # of the containers captured as fields.
+        self.root_pieces: List[bytes] = []
+        self.root_values = {}
+        self.done = False
+
+    def feed(self, chunk: bytes) -> List[Tuple[Tuple[str, ...], Any]]:
+        """Add a chunk of the document. Return the items completed, with their path."""
+        items = []
+        buffer = self.buffer = self.buffer + chunk
+        pos = self.pos
+        size = len(buffer)
+        skip = _SKIP.match
+        while not self.done:
+            pos = skip(buffer, pos).end()
+            if pos >= size:
+                break
+            char = buffer[pos]
+            if char == _QUOTE:
+                break  # Wait for the rest of the string.
+            # The brackets within a container being skipped or captured are
+            # the most common; count them inline.
+            depth = self.skip_depth
+            if char == _OPEN_BRACE or char == _OPEN_BRACKET:
+                if depth:
+                    self.skip_depth = depth + 1
+                else:
+                    self._open(pos, items)
+            elif depth > 1:
+                self.skip_depth = depth - 1
+            else:
+                self._close(pos, items)
+            pos += 1
+        self.pos = pos
+        self._compact()
+        if not items:
+            return []
+        # Decode all the items completed in this chunk at once, which is much
+        # faster than decoding them one by one.
+        values = self.decode(b'[' + b','.join(text for _, text in items) + b']')
+        return [(path, value) for (path, _), value in zip(items, values)]
+
+    def close(self) -> Any:
+        """Check that the document was complete. Return the root fields."""
+        if not self.done:
+            raise ValueError("Incomplete JSON document")
+        return self.fields
+
+    def _open(self, pos: int, items: List[Tuple[Tuple[str, ...], bytes]]):
+        """Process an opening bracket, outside of skipped containers."""
+        buffer = self.buffer
+        is_list = buffer[pos] == ord('[')
+        if not self.stack:
+            # The root container.
+            if not is_list:
+                self.stack.append((_FOLLOW, ()))
+                self.root_pieces.append(b'{')
+            elif () in self.patterns:
+                self.stack.append((_ITEMS, ()))
+            else:
+                self.skip_depth = 1
+            self.mark = pos + 1
+            return
+
+        mode, path = self.stack[-1]
+        if mode == _ITEMS:
+            self._capture(pos, None)
+        else:
+            strings = _STRING.findall(buffer, self.mark, pos)
+            key = json.loads(strings[-1]) if strings else None
+            child = path + (key,)
+            at_root = len(self.stack) == 1
+            if at_root:
+                self.root_pieces.append(buffer[self.mark:pos])
+                self.root_pieces.append(b'null')
+            if is_list and any(_matches(child, pattern) for pattern in self.patterns):
+                self.stack.append((_ITEMS, child))
+            elif not is_list and any(_is_prefix(child, pattern)
+                                     for pattern in self.patterns):
+                self.stack.append((_FOLLOW, child))
+            elif at_root:
+                self._capture(pos, key)
+            else:
+                self.skip_depth = 1
+        self.mark = pos + 1
+
+    def _capture(self, pos: int, key: Optional[str]):
+        """Start capturing a container, as an item or as the value of a root field."""
+        self.skip_depth = 1
+        self.capture_start = pos
+        self.capture_key = key
+
+    def _close(self, pos: int, items: List[Tuple[Tuple[str, ...], bytes]]):
+        """Process a closing bracket, ending a skipped container or not."""
+        mark, self.mark = self.mark, pos + 1
+        if self.skip_depth:
+            self.skip_depth = 0
+            if self.capture_start is not None:
+                # A captured container is complete.
+                text = self.buffer[self.capture_start:pos + 1]
+                if self.capture_key is None:
+                    items.append((self.stack[-1][1], text))
+                else:
+                    self.root_values[self.capture_key] = self.decode(text)
+                self.capture_start = self.capture_key = None
+        else:
+            self.stack.pop()
+        if not self.stack and not self.skip_depth:
+            self.done = True
+            if self.root_pieces:
+                self.root_pieces.append(self.buffer[mark:pos + 1])
+                self.fields = self.decode(b''.join(self.root_pieces))
+                self.fields.update(self.root_values)
+                self.root_pieces = []
+
+    def _compact(self):
+        """Drop the data which has been processed."""
+        if self.capture_start is not None:
+            keep = self.capture_start
+        elif self.skip_depth:
+            keep = self.pos
+        else:
+            keep = min(self.mark, self.pos)
+        if keep:
+            self.buffer = self.buffer[keep:]
+            self.pos -= keep
+            self.mark = max(0, self.mark - keep)
+            if self.capture_start is not None:
+                self.capture_start -= keep
+
+
+def _matches(path: Tuple[str, ...], pattern: Pattern) -> bool:
+    """Return true if a path matches a pattern."""
+    return len(path) == len(pattern) and all(
+        pat == '*' or pat == key for key, pat in zip(path, pattern))
+
+
+def _is_prefix(path: Tuple[str, ...], pattern: Pattern) -> bool:
+    """Return true if a path matches the beginning of a pattern."""
+    return len(path) < len(pattern) and all(
+        pat == '*' or pat == key for key, pat in zip(path, pattern))
+
+
+# The size of the chunks the body of a response is read by.
+CHUNK_SIZE = 1 << 16
+
+
+class ItemStream:
+    """An iterator over the items of a response, decoded as they arrive.
+
+    The items are produced by 'convert' from the path of their list and their
+    decoded value. Once the iteration is complete, the other fields of the
+    response are available in 'fields'. The response is closed when the
+    iteration completes, or by calling close().
+    """
+
+    def __init__(self, response: requests.Response, patterns: Iterable[Pattern],
+                 decode: decoding.Decoder,
+                 convert: Callable[[Tuple[str, ...], Any], Any],
+                 chunk_size: int = CHUNK_SIZE):
+        self.response = response
+        self.parser = JsonStreamParser(patterns, decode)
+        self.convert = convert
+        self.chunk_size = chunk_size
+        self.fields = None
+        self.iterator = self._iterate()
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        return next(self.iterator)
+
+    def _iterate(self) -> Iterator[Any]:
+        convert = self.convert
+        try:
+            for chunk in self.response.iter_content(self.chunk_size):
+                for path, value in self.parser.feed(chunk):
+                    yield convert(path, value)
+            self.fields = self.parser.close()
+        finally:
+            self.response.close()
+
+    def close(self):
+        """Stop the iteration and close the response."""
+        self.iterator.close()
+        self.response.close()
+
+
+def stream(method: Any, patterns: Iterable[Pattern], decode: decoding.Decoder,
+           convert: Callable[[Tuple[str, ...], Any], Any],
+           chunk_size: int = CHUNK_SIZE, **kw) -> ItemStream:
+    """Call a method of the API and stream the items of some lists of its response.
+
+    Args:
+      method: A method of an AmeritradeAPI instance, e.g., api.GetPriceHistory.
+      patterns: The paths of keys to the lists to stream; see JsonStreamParser.
+      decode: The decoder of the items and fields.
+      convert: A function of the path and value of an item, returning the item.
+      chunk_size: The size of the chunks to read the response by.
+      kw: The arguments of the method.
+    Returns:
+      An ItemStream.
+    Raises:
+      IOError: If the call failed.
+    """
+    response = method.stream(**kw)
+    if response.status_code != requests.codes["ok"]:
+        # Errors are small; read them entirely.
+        with response:
+            raise IOError("HTTP Error {}: {} ({})".format(
+                response.status_code, response.reason, response.text))
+    return ItemStream(response, patterns, decode, convert, chunk_size)
+
+
+def iter_candles(api: Any, chunk_size: int = CHUNK_SIZE, **kw) -> ItemStream:
+    """Call GetPriceHistory() and stream its candles.
+
+    The other fields of the response, e.g., 'symbol' and 'empty', are available
+    in the 'fields' attribute of the stream once it is exhausted.
+    """
+    return stream(api.GetPriceHistory, [('candles',)], api.decode,
+                  lambda path, candle: candle, chunk_size, **kw)
+
+
+# A contract of an option chain.
+OptionItem = NamedTuple('OptionItem', [
+    # 'CALL' or 'PUT'.
+    ('putCall', str),
+    # The key of the expiration in the chain, e.g., '2021-01-15:3'.
+    ('expiration', str),
+    # The key of the strike in the chain, e.g., '300.0'.
+    ('strike', str),
+    # The decoded contract.
+    ('contract', Any),
+])
+
+_PUT_CALL = {'callExpDateMap': 'CALL', 'putExpDateMap': 'PUT'}
+
+
+def iter_option_chain(api: Any, chunk_size: int = CHUNK_SIZE, **kw) -> ItemStream:
+    """Call GetOptionChain() and stream its contracts, as OptionItem.
+
+    The other fields of the response, e.g., 'underlyingPrice' and 'underlying',
+    are available in the 'fields' attribute of the stream once it is exhausted,
+    with None in place of the expiration maps.
+    """
+    return stream(api.GetOptionChain,
+                  [('callExpDateMap', '*', '*'), ('putExpDateMap', '*', '*')],
+                  api.decode, _option_item, chunk_size, **kw)
+
+
+def _option_item(path: Tuple[str, ...], contract: Any) -> OptionItem:
+    field, expiration, strike = path
+    return OptionItem(_PUT_CALL[field], expiration, strike, contract)
@@ -0,0 +1,116 @@
+"""Unit tests for the streaming decoder."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from decimal import Decimal
+from unittest import mock
+import json
+
+import pytest
+import requests
+
+from ameritrade import api
+from ameritrade import decoding
+from ameritrade import examples
+from ameritrade import streaming
+
+
+CHAIN_PATTERNS = [('callExpDateMap', '*', '*'), ('putExpDateMap', '*', '*')]
+
+
+def feed_all(parser, data, size):
+    items = []
+    for pos in range(0, len(data), size):
+        items.extend(parser.feed(data[pos:pos + size]))
+    return items
+
+
+@pytest.mark.parametrize('size', [1, 7, 1000, 1 << 20])
+def test_option_chain(size):
+    chain = examples.synthesize_option_chain(3, 4)
+    chain['escaped'] = 'a "quoted" {brace} \\ back\\"slash ]'
+    data = json.dumps(chain).encode('utf8')
+    expected = decoding.decode_decimal(data)
+
+    parser = streaming.JsonStreamParser(CHAIN_PATTERNS)
+    items = feed_all(parser, data, size)
+    assert items == [((field, expiration, strike), contract)
+                     for field in ['callExpDateMap', 'putExpDateMap']
+                     for expiration, strikes in expected[field].items()
+                     for strike, contracts in strikes.items()
+                     for contract in contracts]
+    fields = parser.close()
+    assert fields.callExpDateMap is None
+    assert fields.underlying == expected.underlying
+    assert fields.escaped == expected.escaped
+    assert fields.keys() == expected.keys()
+
+
+def test_bounded_buffer():
+    candles = {'candles': [{'open': 1.5, 'close': 2.5, 'datetime': 0}] * 10000,
+               'symbol': 'SPY', 'empty': False}
+    data = json.dumps(candles).encode('utf8')
+    parser = streaming.JsonStreamParser([('candles',)])
+    count = 0
+    for pos in range(0, len(data), 4096):
+        count += len(parser.feed(data[pos:pos + 4096]))
+        assert len(parser.buffer) < 4096 + 100
+    assert count == 10000
+    assert parser.close() == {'candles': None, 'symbol': 'SPY', 'empty': False}
+
+
+def test_root_list():
+    parser = streaming.JsonStreamParser([()], decoding.decode_float)
+    assert parser.feed(b' [{"a": 1}, [2, "]"], 3, {"b": "}') == [
+        ((), {'a': 1}), ((), [2, ']'])]
+    with pytest.raises(ValueError):
+        parser.close()
+    assert parser.feed(b'"}]') == [((), {'b': '}'})]
+    assert parser.close() is None
+
+
+def make_stream_response(status_code, body):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp._content = json.dumps(body).encode('utf8')
+    resp._content_consumed = True
+    return resp
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_iter_option_chain(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None))
+    chain = examples.synthesize_option_chain(2, 3)
+    resp = make_stream_response(200, chain)
+    with mock.patch.object(iapi.session, 'request', return_value=resp) as request:
+        stream = streaming.iter_option_chain(iapi, symbol='SPY', chunk_size=100)
+        items = list(stream)
+    assert request.call_args[1]['stream'] is True
+    assert len(items) == 12
+    assert items[0].putCall == 'CALL' and items[-1].putCall == 'PUT'
+    assert items[0].expiration == '2021-01-01:0'
+    assert items[0].strike == '100.0'
+    assert items[0].contract.strikePrice == Decimal('100.0')
+    assert stream.fields.symbol == 'SPY'
+    assert stream.fields.putExpDateMap is None
+    iapi.close()
+
+
+@mock.patch('ameritrade.auth.get_headers', return_value={})
+@mock.patch('ameritrade.auth.read_or_create_secrets')
+def test_iter_candles(_, __):
+    iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                               json_decoder='float'))
+    resp = make_stream_response(200, {'candles': [{'open': 1.5}, {'open': 2.5}],
+                                      'symbol': 'SPY', 'empty': False})
+    with mock.patch.object(iapi.session, 'request', return_value=resp):
+        stream = streaming.iter_candles(iapi, symbol='SPY', frequencyType='minute')
+        assert [candle.open for candle in stream] == [1.5, 2.5]
+    assert stream.fields == {'candles': None, 'symbol': 'SPY', 'empty': False}
+
+    resp = make_stream_response(400, {'error': 'Bad request'})
+    with mock.patch.object(iapi.session, 'request', return_value=resp):
+        with pytest.raises(IOError):
+            streaming.iter_candles(iapi, symbol='SPY')
+    iapi.close()
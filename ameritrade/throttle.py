@@ -0,0 +1,285 @@
+"""Rate limiters used to throttle calls to the API.
+
+The API enforces a limit on the number of calls per minute for each app key. A
+limiter hands out slots for calls: reserve() books the next available slot and
+returns how long the caller must wait before making its call. Reservation and
+waiting are separate so that the same limiters work from threads and from
+coroutines (see maybe_throttle() and AsyncAmeritradeAPI.throttle()).
+
+Two implementations are provided:
+
+- TokenBucketLimiter, which throttles the calls made from a single process.
+
+- SharedWindowLimiter, which keeps a sliding window of the latest calls in a
+  file, under the configuration directory by default, so that all the processes
+  using the same credentials stay within the limit together.
+
+Optionally, an AdaptiveRate controller lowers the rate of a limiter when the
+server responds that the limit has been reached, and raises it again slowly
+while responses are clean.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, NamedTuple, Optional
+import fcntl
+import logging
+import os
+import re
+import struct
+import threading
+import time
+
+
+# Statistics on the time spent waiting for the limiter.
+ThrottleStats = NamedTuple('ThrottleStats', [
+    # Number of calls that went through the limiter.
+    ('num_calls', int),
+    # Number of calls that had to wait.
+    ('num_throttled', int),
+    # Total and maximum time waited, in seconds.
+    ('total_wait', float),
+    ('max_wait', float),
+])
+
+
+class RateLimiter:
+    """Base class for rate limiters. Keeps statistics on waits."""
+
+    def __init__(self):
+        self.stats_lock = threading.Lock()
+        self.num_calls = 0
+        self.num_throttled = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    def reserve(self) -> float:
+        """Reserve a slot for a call. Return the number of seconds to wait."""
+        dt = max(0., self._reserve(time.time()))
+        with self.stats_lock:
+            self.num_calls += 1
+            if dt > 0:
+                self.num_throttled += 1
+                self.total_wait += dt
+                self.max_wait = max(self.max_wait, dt)
+        return dt
+
+    def _reserve(self, now: float) -> float:
+        raise NotImplementedError
+
+    def set_rate(self, rate_per_minute: int):
+        """Change the rate of the limiter."""
+        raise NotImplementedError
+
+    def stats(self) -> ThrottleStats:
+        """Return statistics on waits."""
+        with self.stats_lock:
+            return ThrottleStats(self.num_calls, self.num_throttled,
+                                 self.total_wait, self.max_wait)
+
+
+class TokenBucketLimiter(RateLimiter):
+    """An in-process, thread-safe token bucket.
+
+    The bucket holds up to 'burst' tokens and refills at a rate such that no
+    more than 'rate_per_minute' calls are made in any period of sixty seconds.
+    (The burst is capped to half the rate.) The reservations are made in order,
+    so waiting callers are served first-come, first-served.
+    """
+
+    def __init__(self, rate_per_minute: int, burst: int):
+        super().__init__()
+        self.max_burst = burst
+        self.burst = max(1, min(burst, rate_per_minute // 2))
+        self.rate_per_minute = rate_per_minute
+        self.lock = threading.Lock()
+        self.tokens = float(self.burst)
+        self.last = time.time()
+
+    def set_rate(self, rate_per_minute: int):
+        with self.lock:
+            self.rate_per_minute = rate_per_minute
+            self.burst = max(1, min(self.max_burst, rate_per_minute // 2))
+            self.tokens = min(self.tokens, self.burst)
+
+    def _reserve(self, now: float) -> float:
+        with self.lock:
+            refill = max(1, self.rate_per_minute - self.burst) / 60.
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * refill)
+            self.last = now
+            # Tokens may go negative, which queues up the callers.
+            self.tokens -= 1
+            return -self.tokens / refill if self.tokens < 0 else 0.
+
+
+class SharedWindowLimiter(RateLimiter):
+    """A sliding window of the latest calls, shared between processes.
+
+    The window is stored in a small file as a ring of timestamps, protected by
+    an exclusive file lock. Each call is scheduled at least a minute after the
+    call 'rate_per_minute' calls before it, across all the processes sharing
+    the file. The window holds 'capacity' calls, which bounds the rate that may
+    be set later on.
+    """
+
+    _HEADER = struct.Struct('<qq')  # (capacity, head)
+    _SLOT = struct.Struct('<d')
+
+    def __init__(self, filename: str, rate_per_minute: int,
+                 capacity: Optional[int] = None):
+        super().__init__()
+        self.filename = filename
+        self.rate_per_minute = rate_per_minute
+        self.capacity = max(rate_per_minute, capacity or 0)
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate_per_minute: int):
+        with self.lock:
+            self.rate_per_minute = min(rate_per_minute, self.capacity)
+
+    def _reserve(self, now: float) -> float:
+        with self.lock:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                capacity, head, slots = self._read(fd)
+                newest = slots[(head - 1) % capacity]
+                oldest = slots[(head - self.rate_per_minute) % capacity]
+                slot = max(now, newest, oldest + 60.)
+                slots[head] = slot
+                self._write(fd, capacity, (head + 1) % capacity, slots)
+            finally:
+                os.close(fd)
+        return slot - now
+
+    def _read(self, fd):
+        """Read the window, or create a new, empty one."""
+        header = os.pread(fd, self._HEADER.size, 0)
+        if len(header) == self._HEADER.size:
+            capacity, head = self._HEADER.unpack(header)
+            if capacity >= self.capacity:
+                data = os.pread(fd, capacity * self._SLOT.size, self._HEADER.size)
+                if len(data) == capacity * self._SLOT.size and 0 <= head < capacity:
+                    slots = list(struct.unpack('<{}d'.format(capacity), data))
+                    return capacity, head, slots
+        logging.info("Initializing rate limit window in %s", self.filename)
+        return self.capacity, 0, [0.] * self.capacity
+
+    def _write(self, fd, capacity, head, slots):
+        os.pwrite(fd, (self._HEADER.pack(capacity, head) +
+                       struct.pack('<{}d'.format(capacity), *slots)), 0)
+
+
+class AdaptiveRate:
+    """Adjust the rate of a limiter from the responses of the server.
+
+    This is an additive-increase, multiplicative-decrease controller: a
+    rate-limited response cuts the rate by a factor of 'decrease' (no lower than
+    'min_rate'), and every 'increase_every' clean responses in a row raise it by
+    one call per minute, up to 'max_rate'. Rate-limited responses arriving
+    within 'cooldown' seconds of a decrease, e.g., from other calls that were
+    already in flight, don't decrease it further.
+    """
+
+    def __init__(self, limiter: RateLimiter, max_rate: int,
+                 min_rate: int = 10,
+                 decrease: float = 0.5,
+                 increase_every: int = 10,
+                 cooldown: float = 1.):
+        self.limiter = limiter
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, limiter.rate_per_minute)
+        self.decrease = decrease
+        self.increase_every = increase_every
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.num_clean = 0
+        self.last_decrease = 0.
+
+    def on_rate_limited(self):
+        """Register a rate-limited response."""
+        with self.lock:
+            self.num_clean = 0
+            now = time.time()
+            if now - self.last_decrease < self.cooldown:
+                return
+            self.last_decrease = now
+            rate = max(self.min_rate,
+                       int(self.limiter.rate_per_minute * self.decrease))
+            logging.warning("Rate limited; lowering rate to %d calls/min", rate)
+            self.limiter.set_rate(rate)
+
+    def on_success(self):
+        """Register a clean response."""
+        with self.lock:
+            self.num_clean += 1
+            if (self.num_clean >= self.increase_every and
+                self.limiter.rate_per_minute < self.max_rate):
+                self.num_clean = 0
+                self.limiter.set_rate(self.limiter.rate_per_minute + 1)
+
+
+def make_limiter(config) -> Optional[RateLimiter]:
+    """Create the rate limiter for a configuration, if throttling is enabled."""
+    if not config.rate_per_minute:
+        return None
+    if config.rate_limit_file:
+        return SharedWindowLimiter(config.rate_limit_file, config.rate_per_minute,
+                                   config.max_rate_per_minute)
+    return TokenBucketLimiter(config.rate_per_minute, config.rate_burst)
+
+
+def make_rate_control(config, limiter: Optional[RateLimiter]) -> Optional[AdaptiveRate]:
+    """Create the adaptive rate controller for a configuration, if enabled."""
+    if limiter is None or not config.max_rate_per_minute:
+        return None
+    return AdaptiveRate(limiter, config.max_rate_per_minute)
+
+
+# The error message returned by the server when over the rate limit.
+RATE_LIMITED_ERROR = re.compile("transactions per seconds restriction reached")
+
+# Base delay before retrying a rate-limited call, if the server does not
+# provide one.
+RATE_LIMITED_DELAY = 1.0  # secs
+
+
+def is_rate_limited(status_code: int, response: Any) -> bool:
+    """Predicate for whether a call has been rate limited.
+
+    Args:
+      status_code: The HTTP status code of the response.
+      response: The decoded JSON response, if any.
+    """
+    if status_code == 429:  # Too Many Requests
+        return True
+    return (isinstance(response, dict) and
+            isinstance(response.get('error', None), str) and
+            bool(RATE_LIMITED_ERROR.search(response['error'])))
+
+
+def retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    """Compute the delay before retrying a rate-limited call.
+
+    Args:
+      retry_after: The value of the 'Retry-After' header, if present.
+      attempt: The number of the attempt which was rate-limited, from zero.
+    """
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass  # An HTTP date; ignore it.
+    return RATE_LIMITED_DELAY * 2 ** attempt
+
+
+def maybe_throttle(limiter: Optional[RateLimiter]) -> float:
+    """Wait for a slot from the limiter, if there is one. Return the time waited."""
+    if limiter is None:
+        return 0.
+    dt = limiter.reserve()
+    if dt > 0:
+        logging.info(f"Throttling for {dt:.1f} secs")
+        time.sleep(dt)
+    return dt
@@ -0,0 +1,106 @@
+"""Unit tests for rate limiters."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from unittest import mock
+import concurrent.futures
+import multiprocessing
+
+import pytest
+
+from ameritrade import api
+from ameritrade import throttle
+
+
+def test_token_bucket():
+    limiter = throttle.TokenBucketLimiter(120, 10)
+    with mock.patch('time.time', return_value=1000.):
+        limiter.last = 1000.
+        delays = [limiter.reserve() for _ in range(13)]
+    assert delays[:10] == [0.] * 10
+    # Refill at 110 calls/min to stay within 120 calls in any minute.
+    assert delays[10:] == pytest.approx([60/110, 2*60/110, 3*60/110])
+
+    # The bucket refills over time, up to the burst.
+    with mock.patch('time.time', return_value=1600.):
+        assert limiter.reserve() == 0.
+    assert limiter.tokens == 9
+
+    stats = limiter.stats()
+    assert stats.num_calls == 14
+    assert stats.num_throttled == 3
+    assert stats.max_wait == pytest.approx(3*60/110)
+
+
+def test_token_bucket_threads():
+    limiter = throttle.TokenBucketLimiter(60, 30)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        delays = sorted(executor.map(lambda _: limiter.reserve(), range(40)))
+    # Every reservation got its own distinct slot.
+    assert len(set(delays[30:])) == 10
+    assert limiter.stats().num_calls == 40
+
+
+def test_shared_window(tmpdir):
+    filename = path.join(tmpdir, 'ratelimit')
+    limiter1 = throttle.SharedWindowLimiter(filename, 4)
+    limiter2 = throttle.SharedWindowLimiter(filename, 4)
+    with mock.patch('time.time', return_value=1000.):
+        delays = [limiter.reserve()
+                  for limiter in [limiter1, limiter2, limiter1, limiter2,
+                                  limiter1, limiter2]]
+    assert delays == [0, 0, 0, 0, 60, 60]
+    assert limiter1.stats().total_wait == 60
+
+
+def _reserve_in_process(filename):
+    limiter = throttle.SharedWindowLimiter(filename, 10)
+    return [limiter.reserve() for _ in range(5)]
+
+
+def test_shared_window_processes(tmpdir):
+    filename = path.join(tmpdir, 'ratelimit')
+    with multiprocessing.Pool(4) as pool:
+        delays = sorted(sum(pool.map(_reserve_in_process, [filename] * 4), []))
+    # Across all processes, only ten calls go through in the first minute.
+    assert all(dt < 5 for dt in delays[:10])
+    assert all(dt > 55 for dt in delays[10:])
+
+
+def test_make_limiter(tmpdir):
+    assert throttle.make_limiter(api.Config(rate_per_minute=None)) is None
+    assert isinstance(throttle.make_limiter(api.Config()),
+                      throttle.TokenBucketLimiter)
+    config = api.config_from_dir(tmpdir, client_id='TEST@AMER.OAUTHAP')
+    assert isinstance(throttle.make_limiter(config), throttle.SharedWindowLimiter)
+
+
+def test_adaptive_rate():
+    limiter = throttle.TokenBucketLimiter(120, 10)
+    control = throttle.AdaptiveRate(limiter, 130, min_rate=20, increase_every=2)
+    control.on_rate_limited()
+    assert limiter.rate_per_minute == 60
+    # Further responses right after the decrease are from calls in flight.
+    control.on_rate_limited()
+    assert limiter.rate_per_minute == 60
+    control.last_decrease = 0
+    control.on_rate_limited()
+    assert limiter.rate_per_minute == 30
+    control.last_decrease = 0
+    control.on_rate_limited()
+    assert limiter.rate_per_minute == 20
+    for _ in range(300):
+        control.on_success()
+    assert limiter.rate_per_minute == 130
+    assert limiter.burst == 10
+
+
+def test_is_rate_limited():
+    error = {'error': ("Individual App's transactions per seconds restriction "
+                       "reached. Please contact us with further questions")}
+    assert throttle.is_rate_limited(200, error)
+    assert throttle.is_rate_limited(429, None)
+    assert not throttle.is_rate_limited(200, {'error': 'Not found.'})
+    assert not throttle.is_rate_limited(200, [error])
+    assert not throttle.is_rate_limited(200, None)
@@ -0,0 +1,197 @@
+"""Recording and replay of the HTTP traffic with the server.
+
+A RecordingAdapter is a transport adapter for the HTTP session of the API
+which appends every request and its response to a journal: a file of JSON
+lines, each compressed as its own gzip member so that the file can be appended
+to by several processes and read back with gzip. Each record holds the time,
+duration, method, URL, headers and bodies of an exchange. The Authorization
+header and the bodies of token requests are redacted.
+
+A ReplayAdapter serves the responses of a journal back, without any network
+access, at their original latency or faster. This allows running and
+benchmarking client code offline against real captured traffic. Set the
+'record_file' or 'replay_file' options of the configuration to use them.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import collections
+import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+import requests.adapters
+import requests.structures
+import requests.utils
+
+
+# The headers whose values are never recorded.
+REDACTED_HEADERS = frozenset({'authorization'})
+
+# The endpoints whose bodies are never recorded, because they hold tokens.
+REDACTED_PATHS = ('/oauth2/token',)
+
+REDACTED = '<redacted>'
+
+
+# The key of an exchange, used to match requests on replay.
+Key = Tuple[str, str, str]
+
+
+def _text(body: Any) -> str:
+    """Convert a request or response body to text."""
+    if body is None:
+        return ''
+    if isinstance(body, bytes):
+        return body.decode('utf8', 'surrogateescape')
+    return str(body)
+
+
+def _redact_headers(headers: Any) -> Dict[str, str]:
+    return {name: (REDACTED if name.lower() in REDACTED_HEADERS else value)
+            for name, value in headers.items()}
+
+
+def _is_redacted(url: str) -> bool:
+    return urllib.parse.urlsplit(url).path.endswith(REDACTED_PATHS)
+
+
+def exchange_key(method: str, url: str, body: str) -> Key:
+    """Compute the key of an exchange, ignoring the order of query parameters."""
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query)))
+    url = urllib.parse.urlunsplit(parts._replace(query=query))
+    return (method, url, body)
+
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+    """A transport adapter appending all the exchanges to a journal.
+
+    Note that responses get read entirely before being returned, even if they
+    were requested as streams.
+    """
+
+    def __init__(self, filename: str, **kwargs):
+        super().__init__(**kwargs)
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        start = time.time()
+        resp = super().send(request, **kwargs)
+        content = resp.content
+        redacted = _is_redacted(request.url)
+        record = {
+            'time': start,
+            'elapsed': time.time() - start,
+            'request': {
+                'method': request.method,
+                'url': request.url,
+                'headers': _redact_headers(request.headers),
+                'body': REDACTED if redacted else _text(request.body),
+            },
+            'response': {
+                'status': resp.status_code,
+                'reason': resp.reason,
+                'headers': dict(resp.headers),
+                'body': REDACTED if redacted else _text(content),
+            },
+        }
+        self.write(record)
+        return resp
+
+    def write(self, record: Dict[str, Any]):
+        """Append a record to the journal."""
+        member = gzip.compress(json.dumps(record).encode('utf8') + b'\n')
+        with self.lock:
+            # A single write to a file opened for appending is atomic with
+            # respect to the other processes writing to it.
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, member)
+            finally:
+                os.close(fd)
+
+
+def read_journal(filename: str) -> Iterator[Dict[str, Any]]:
+    """Read the records of a journal, ignoring a truncated last record."""
+    with gzip.open(filename, 'rt', encoding='utf8') as infile:
+        try:
+            for line in infile:
+                yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError):
+            logging.warning("Ignoring the truncated end of journal %s", filename)
+
+
+class ReplayMissError(requests.RequestException):
+    """A request has no recorded response."""
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    """A transport adapter serving the responses recorded in journals.
+
+    The responses to identical requests are served in the order they were
+    recorded; once they are exhausted, the last one keeps being served.
+    """
+
+    def __init__(self, filenames: List[str], speed: Optional[float] = None):
+        """Load the journals.
+
+        Args:
+          filenames: The journal files.
+          speed: The speed of the replay relative to the original latency of
+            the responses, e.g., 1 for the original latency or 10 for ten times
+            faster. None serves responses immediately.
+        """
+        super().__init__()
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.exchanges: Dict[Key, collections.deque] = collections.defaultdict(
+            collections.deque)
+        for filename in filenames:
+            for record in read_journal(filename):
+                req = record['request']
+                self.exchanges[exchange_key(req['method'], req['url'],
+                                            req['body'])].append(record)
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False,
+             **kwargs) -> requests.Response:
+        body = REDACTED if _is_redacted(request.url) else _text(request.body)
+        key = exchange_key(request.method, request.url, body)
+        with self.lock:
+            records = self.exchanges.get(key)
+            if not records:
+                raise ReplayMissError("No recorded response for {} {}".format(
+                    request.method, request.url), request=request)
+            record = records.popleft() if len(records) > 1 else records[0]
+        if self.speed:
+            time.sleep(record['elapsed'] / self.speed)
+        return build_response(request, record)
+
+    def close(self):
+        pass
+
+
+def build_response(request: requests.PreparedRequest,
+                   record: Dict[str, Any]) -> requests.Response:
+    """Build a response from a record."""
+    data = record['response']
+    resp = requests.Response()
+    resp.status_code = data['status']
+    resp.reason = data['reason']
+    resp.headers = requests.structures.CaseInsensitiveDict(data['headers'])
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    resp._content = data['body'].encode('utf8', 'surrogateescape')
+    resp._content_consumed = True
+    resp.url = request.url
+    resp.request = request
+    resp.elapsed = datetime.timedelta(seconds=record['elapsed'])
+    return resp
@@ -0,0 +1,96 @@
+"""Unit tests for the recording and replay of traffic."""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from unittest import mock
+import json
+
+import pytest
+import requests
+import requests.adapters
+
+from ameritrade import api
+from ameritrade import transport
+
+
+def make_response(request, body, status_code=200):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.reason = 'OK'
+    resp.headers['Content-Type'] = 'application/json'
+    resp._content = json.dumps(body).encode('utf8')
+    resp.url = request.url
+    resp.request = request
+    return resp
+
+
+def fake_send(request, **kwargs):
+    if request.url.endswith('/oauth2/token'):
+        return make_response(request, {'access_token': 'secret'})
+    symbol = request.url.split('/')[-2]
+    return make_response(request, {symbol: {'lastPrice': 1.5}})
+
+
+@mock.patch.object(requests.adapters.HTTPAdapter, 'send', side_effect=fake_send)
+def test_record_and_replay(_, tmp_path):
+    journal = str(tmp_path / 'traffic.jsonl.gz')
+    secrets = {'token_type': 'Bearer', 'access_token': 'secret',
+               'refresh_token': 'refresh'}
+    with mock.patch('ameritrade.auth.read_or_create_secrets', return_value=secrets):
+        iapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP',
+                                   rate_per_minute=None, record_file=journal))
+    assert iapi.GetQuote(symbol='SPY') == {'SPY': {'lastPrice': 1.5}}
+    assert iapi.GetQuote(symbol='QQQ') == {'QQQ': {'lastPrice': 1.5}}
+    iapi.session.post('https://api.tdameritrade.com/v1/oauth2/token',
+                      data={'refresh_token': 'refresh'})
+
+    records = list(transport.read_journal(journal))
+    assert len(records) == 3
+    request = records[0]['request']
+    assert request['method'] == 'GET'
+    assert request['url'] == 'https://api.tdameritrade.com/v1/marketdata/SPY/quotes'
+    assert request['headers']['Authorization'] == transport.REDACTED
+    assert records[0]['response']['status'] == 200
+    assert records[0]['elapsed'] >= 0
+    assert 'secret' not in json.dumps(records)
+    assert 'refresh' not in json.dumps(records)
+
+    # A truncated record at the end is ignored.
+    with open(journal, 'ab') as outfile:
+        outfile.write(b'\x1f\x8b\x08')
+    assert len(list(transport.read_journal(journal))) == 3
+
+    # Replay without authenticating nor connecting.
+    with mock.patch('ameritrade.auth.read_or_create_secrets') as read_secrets:
+        rapi = api.open(api.Config(client_id='TEST@AMER.OAUTHAP', rate_per_minute=None,
+                                   replay_file=journal, retry_policy=None))
+    assert not read_secrets.called
+    _.reset_mock()
+    assert rapi.GetQuote(symbol='QQQ') == {'QQQ': {'lastPrice': 1.5}}
+    assert rapi.GetQuote(symbol='QQQ') == {'QQQ': {'lastPrice': 1.5}}
+    assert not _.called
+    with pytest.raises(transport.ReplayMissError):
+        rapi.GetQuote(symbol='IWM')
+    iapi.close()
+    rapi.close()
+
+
+def test_exchange_key():
+    assert (transport.exchange_key('GET', 'https://host/path?b=2&a=1', '') ==
+            transport.exchange_key('GET', 'https://host/path?a=1&b=2', ''))
+
+
+@mock.patch('time.sleep')
+def test_replay_speed(sleep, tmp_path):
+    journal = str(tmp_path / 'traffic.jsonl.gz')
+    recorder = transport.RecordingAdapter(journal)
+    request = requests.Request('GET', 'https://host/path').prepare()
+    recorder.write({'time': 0., 'elapsed': 0.5,
+                    'request': {'method': 'GET', 'url': request.url, 'headers': {},
+                                'body': ''},
+                    'response': {'status': 200, 'reason': 'OK', 'headers': {},
+                                 'body': '{}'}})
+    replayer = transport.ReplayAdapter([journal], speed=10)
+    resp = replayer.send(request)
+    assert resp.json() == {}
+    sleep.assert_called_once_with(0.05)
@@ -7,6 +7,7 @@ import re
 from typing import Any, Dict, Optional, Union
 
 import ameritrade as td
+from ameritrade import throttle
 
 
 JSON = Dict[str, Union[str, float, int, 'JSON']]
@@ -14,8 +15,7 @@ JSON = Dict[str, Union[str, float, int, 'JSON']]
 
 def IsRateLimited(resp: JSON) -> bool:
     """Predicate for whether the response has been rate limited."""
-    return ('error' in resp and
-            re.search("transactions per seconds restriction reached", resp["error"]))
+    return throttle.is_rate_limited(200, resp)
 
 
 def GetMainAccount(api: td.AmeritradeAPI, acctype: Optional[str]=None) -> str:
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Measure the per-call overhead of the client, with the network mocked out.
+
+The HTTP session of the API is replaced by a stub returning a canned response
+immediately, so the timings only reflect the work done by the client itself:
+method lookup, argument checking, building the request, throttling bookkeeping
+and decoding a tiny response.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import argparse
+import timeit
+
+from ameritrade import api
+
+
+class StubResponse:
+    """A canned, successful response."""
+    status_code = 200
+    reason = 'OK'
+    text = '{}'
+    content = b'{}'
+    headers = {}
+
+    def json(self, **kwargs):
+        return {}
+
+
+class StubSession:
+    """A session returning the canned response for all requests."""
+
+    def request(self, *args, **kwargs):
+        return StubResponse()
+
+    def close(self):
+        pass
+
+
+def open_stubbed(**kwargs) -> api.AmeritradeAPI:
+    """Open an API with fake secrets and a stub session."""
+    config = api.Config(client_id='BENCH@AMER.OAUTHAP', lazy=True,
+                        rate_per_minute=None, **kwargs)
+    tdapi = api.open(config)
+    tdapi.secrets = {'token_type': 'Bearer', 'access_token': 'TOKEN'}
+    tdapi.session = StubSession()
+    return tdapi
+
+
+CALLS = {
+    'GetQuote': lambda tdapi: tdapi.GetQuote(symbol='SPY'),
+    'GetPriceHistory': lambda tdapi: tdapi.GetPriceHistory(
+        symbol='SPY', periodType='day', period=5, frequencyType='minute',
+        frequency=1, needExtendedHoursData=False),
+    'GetAccount': lambda tdapi: tdapi.GetAccount(accountId='123456789',
+                                                 fields='positions'),
+}
+
+
+def run(number: int):
+    """Time the calls. Return a dict of per-call time in microseconds."""
+    tdapi = open_stubbed()
+    results = {}
+    for name, call in CALLS.items():
+        timer = timeit.Timer(lambda: call(tdapi))
+        best = min(timer.repeat(repeat=5, number=number))
+        results[name] = best / number * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--number', type=int, default=20000,
+                        help="Number of calls per timing run.")
+    args = parser.parse_args()
+    for name, usecs in run(args.number).items():
+        print('{:<20} {:8.2f} us/call'.format(name, usecs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Compare the JSON decoders on documents built from the bundled examples.
+
+Each 'example.json' file under ameritrade/schemas is loaded, its placeholder
+values are filled in with plausible numbers and its lists are replicated
+'--repeat' times, to approximate the size of real responses. Each decoder is
+then timed on the encoded document, and the peak memory it allocates is
+measured with tracemalloc. A full option chain is added, as the largest of
+the usual responses.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, List, Tuple
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from ameritrade import decoding
+from ameritrade import examples
+
+
+def build_documents(repeat: int) -> List[Tuple[str, bytes]]:
+    """Build the encoded documents to decode, one per example file.
+
+    The example of GetOptionChain has empty expiration maps, so a full option
+    chain is added as well.
+    """
+    documents = []
+    for filename in examples.find_example_files():
+        values = [examples.synthesize(example.value, repeat)
+                  for example in examples.load_examples(filename)]
+        name = path.basename(path.dirname(filename))
+        documents.append((name, json.dumps(values).encode('utf8')))
+    chain = examples.synthesize_option_chain(repeat // 2 + 1, repeat * 2)
+    documents.append(('OptionChain (full)', json.dumps(chain).encode('utf8')))
+    return documents
+
+
+def measure(decoder: decoding.Decoder, data: bytes, number: int) -> Tuple[float, int]:
+    """Return the time per decode in milliseconds and the peak memory in bytes."""
+    timer = timeit.Timer(lambda: decoder(data))
+    secs = min(timer.repeat(repeat=3, number=number)) / number
+    tracemalloc.start()
+    try:
+        decoder(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return secs * 1e3, peak
+
+
+def run(repeat: int, number: int) -> Dict[str, Dict[str, Tuple[float, int]]]:
+    """Run the benchmark. Return (msecs, peak bytes) by document and decoder.
+
+    The totals over all the documents are under the name 'TOTAL'.
+    """
+    results = {}
+    totals = {name: (0., 0) for name in decoding.DECODERS}
+    for docname, data in build_documents(repeat):
+        results[docname] = row = {}
+        for name, decoder in decoding.DECODERS.items():
+            msecs, peak = measure(decoder, data, number)
+            row[name] = (msecs, peak)
+            total_msecs, total_peak = totals[name]
+            totals[name] = (total_msecs + msecs, total_peak + peak)
+    results['TOTAL'] = totals
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-r', '--repeat', type=int, default=50,
+                        help="Number of times to replicate the items of lists.")
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help="Number of decodes per timing run.")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.number)
+    names = list(decoding.DECODERS)
+    print('{:<34}'.format('') + ''.join('{:>20}'.format(name) for name in names))
+    for docname, row in results.items():
+        print('{:<34}'.format(docname) + ''.join(
+            '{:>9.2f}ms {:>6.0f}KiB'.format(row[name][0], row[name][1] / 1024)
+            for name in names))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Compare lazy decoding to full decoding for partial accesses of responses.
+
+Each scenario decodes a large response built from the bundled examples and
+accesses a part of it, like client code does. The time includes both decoding
+and access, and the memory is the peak allocated during both, measured with
+tracemalloc.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, Tuple
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from ameritrade import decoding
+from ameritrade import examples
+
+
+DECODERS = ['decimal', 'float', 'lazy']
+
+
+def build_accounts(num_accounts: int, num_positions: int) -> bytes:
+    """Build a GetAccounts response."""
+    filename = path.join(examples.SCHEMAS_DIR, 'AccountsAndTrading', 'GetAccounts',
+                         'example.json')
+    objects = {example.label: example.value
+               for example in examples.load_examples(filename)}
+    accounts = []
+    for number in range(num_accounts):
+        account = examples.synthesize(objects['MarginAccount'], num_positions)
+        account['accountId'] = str(100000000 + number)
+        accounts.append({'securitiesAccount': account})
+    return json.dumps(accounts).encode('utf8')
+
+
+def main_account(accounts: Any) -> Any:
+    """Access the liquidation values only, like utils.GetMainAccount()."""
+    return max((acc['securitiesAccount']['currentBalances']['liquidationValue'],
+                acc['securitiesAccount']['accountId'])
+               for acc in accounts)
+
+
+def one_expiration(chain: Any) -> Any:
+    """Access the quotes of a single expiration."""
+    strikes = next(iter(chain.callExpDateMap.values()))
+    return [(option.bidPrice, option.askPrice)
+            for options in strikes.values()
+            for option in options]
+
+
+def all_columns(chain: Any) -> Any:
+    """Access a few columns of all the options."""
+    return [(option.strikePrice, option.bidPrice, option.askPrice)
+            for expmap in (chain.callExpDateMap, chain.putExpDateMap)
+            for strikes in expmap.values()
+            for options in strikes.values()
+            for option in options]
+
+
+def measure(call: Callable[[], Any], number: int) -> Tuple[float, int]:
+    """Return the time per call in milliseconds and the peak memory in bytes."""
+    secs = min(timeit.Timer(call).repeat(repeat=3, number=number)) / number
+    tracemalloc.start()
+    try:
+        result = call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return secs * 1e3, peak
+
+
+def run(scale: int, number: int) -> Dict[str, Dict[str, Tuple[float, int]]]:
+    """Run the scenarios. Return (msecs, peak bytes) by scenario and decoder."""
+    accounts = build_accounts(4, scale * 4)
+    chain = json.dumps(examples.synthesize_option_chain(scale // 4 + 1, scale * 2))
+    chain = chain.encode('utf8')
+    scenarios = {
+        'GetAccounts, main account': (accounts, main_account),
+        'GetOptionChain, 1 expiration': (chain, one_expiration),
+        'GetOptionChain, 3 columns': (chain, all_columns),
+    }
+    results = {}
+    for scenario, (data, access) in scenarios.items():
+        results[scenario] = row = {}
+        for name in DECODERS:
+            decoder = decoding.get_decoder(name)
+            row[name] = measure(lambda: access(decoder(data)), number)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-s', '--scale', type=int, default=50,
+                        help="Size of the responses.")
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help="Number of runs per timing.")
+    args = parser.parse_args()
+
+    results = run(args.scale, args.number)
+    print('{:<32}'.format('') + ''.join('{:>20}'.format(name) for name in DECODERS))
+    for scenario, row in results.items():
+        print('{:<32}'.format(scenario) + ''.join(
+            '{:>9.2f}ms {:>6.0f}KiB'.format(row[name][0], row[name][1] / 1024)
+            for name in DECODERS))
+
+
+if __name__ == '__main__':
+    main()
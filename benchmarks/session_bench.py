@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Measure call latency with and without the pooled keep-alive HTTP session.
+
+This starts a local HTTPS stand-in server (with a throwaway self-signed
+certificate) that answers every request with a small JSON body, similar in size
+to a GetQuote response, and times a series of calls made with one-shot
+requests.get() calls versus the pooled session created by api.make_session().
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import argparse
+import http.server
+import socketserver
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+import urllib3
+
+from ameritrade import api
+
+
+BODY = b'{"SPY": {"symbol": "SPY", "bidPrice": 420.69, "askPrice": 420.71}}'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Respond to all requests with a small JSON document."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def make_certificate(tmpdir):
+    """Create a self-signed key and certificate for localhost."""
+    key_file = path.join(tmpdir, 'key.pem')
+    certificate_file = path.join(tmpdir, 'certificate.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-newkey', 'rsa:2048', '-nodes', '-x509', '-days', '1',
+         '-subj', '/CN=localhost',
+         '-keyout', key_file, '-out', certificate_file],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return key_file, certificate_file
+
+
+def start_server(key_file, certificate_file):
+    """Start the HTTPS server in a thread. Return it and its URL."""
+    server = Server(('127.0.0.1', 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=certificate_file, keyfile=key_file)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'https://127.0.0.1:{}/v1/marketdata/SPY/quotes'.format(
+        server.server_address[1])
+
+
+def time_calls(call, url, num_calls):
+    """Time a number of calls. Return a list of latencies in seconds."""
+    latencies = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        resp = call(url, verify=False)
+        resp.content
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print('{:<12} mean {:7.3f} ms   median {:7.3f} ms   p99 {:7.3f} ms'.format(
+        name,
+        statistics.mean(latencies) * 1000,
+        statistics.median(latencies) * 1000,
+        p99 * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--num-calls', type=int, default=200,
+                        help="Number of calls to make in each mode.")
+    args = parser.parse_args()
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        server, url = start_server(*make_certificate(tmpdir))
+        try:
+            report('unpooled', time_calls(requests.get, url, args.num_calls))
+            session = api.make_session(api.Config())
+            report('pooled', time_calls(session.get, url, args.num_calls))
+            session.close()
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
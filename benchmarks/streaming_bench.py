@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Compare streaming decoding to full decoding of large responses.
+
+Each scenario feeds a response built from the bundled examples in chunks, as
+they arrive from the server, and visits all its items. The peak memory is the
+peak allocated while decoding and visiting, measured with tracemalloc,
+excluding the raw response itself. Streaming should stay flat as the size of
+the responses grows.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, List, Tuple
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from ameritrade import decoding
+from ameritrade import examples
+from ameritrade import streaming
+
+
+def build_candles(num_candles: int) -> bytes:
+    """Build a GetPriceHistory response."""
+    filename = path.join(examples.SCHEMAS_DIR, 'PriceHistory', 'GetPriceHistory',
+                         'example.json')
+    candles = examples.load_examples(filename)[0].value
+    return json.dumps(examples.synthesize(candles, num_candles)).encode('utf8')
+
+
+def build_chain(num_expirations: int) -> bytes:
+    """Build a GetOptionChain response."""
+    chain = examples.synthesize_option_chain(num_expirations, 40)
+    return json.dumps(chain).encode('utf8')
+
+
+def chunks(data: bytes) -> List[bytes]:
+    """Split a response in chunks, as read from the connection."""
+    size = streaming.CHUNK_SIZE
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+def decode_full(pieces: List[bytes], patterns: List[streaming.Pattern]) -> int:
+    """Accumulate the response and decode it entirely. Return the item count."""
+    value = decoding.decode_decimal(b''.join(pieces))
+    count = 0
+    for pattern in patterns:
+        containers = [value]
+        for key in pattern:
+            containers = [child
+                          for container in containers
+                          for child in (container.values() if key == '*'
+                                        else [container[key]])]
+        count += sum(len(items) for items in containers)
+    return count
+
+
+def decode_streaming(pieces: List[bytes], patterns: List[streaming.Pattern]) -> int:
+    """Feed the response to a streaming parser. Return the item count."""
+    parser = streaming.JsonStreamParser(patterns)
+    count = 0
+    for piece in pieces:
+        count += len(parser.feed(piece))
+    parser.close()
+    return count
+
+
+def measure(call: Callable[[], Any], number: int) -> Tuple[float, int]:
+    """Return the time per call in milliseconds and the peak memory in bytes."""
+    secs = min(timeit.Timer(call).repeat(repeat=3, number=number)) / number
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return secs * 1e3, peak
+
+
+def run(scales: List[int], number: int) -> Dict[str, Dict[str, Tuple[float, int]]]:
+    """Run the scenarios. Return (msecs, peak bytes) by scenario and method."""
+    chain_patterns = [('callExpDateMap', '*', '*'), ('putExpDateMap', '*', '*')]
+    scenarios = {}
+    for scale in scales:
+        scenarios['GetPriceHistory, {} candles'.format(scale * 1000)] = (
+            build_candles(scale * 1000), [('candles',)])
+        scenarios['GetOptionChain, {} contracts'.format(scale * 80)] = (
+            build_chain(scale), chain_patterns)
+    results = {}
+    for scenario, (data, patterns) in scenarios.items():
+        pieces = chunks(data)
+        results[scenario] = {
+            'full': measure(lambda: decode_full(pieces, patterns), number),
+            'streaming': measure(lambda: decode_streaming(pieces, patterns), number),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-s', '--scales', type=int, nargs='+', default=[5, 20, 80],
+                        help="Sizes of the responses.")
+    parser.add_argument('-n', '--number', type=int, default=3,
+                        help="Number of runs per timing.")
+    args = parser.parse_args()
+
+    results = run(args.scales, args.number)
+    methods = ['full', 'streaming']
+    print('{:<36}'.format('') + ''.join('{:>20}'.format(name) for name in methods))
+    for scenario, row in results.items():
+        print('{:<36}'.format(scenario) + ''.join(
+            '{:>9.2f}ms {:>6.0f}KiB'.format(row[name][0], row[name][1] / 1024)
+            for name in methods))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""Run the microbenchmarks of the client hot paths and compare to a baseline.
+
+The suite times, with the network mocked out:
+
+- call.*: the per-call overhead of the client (see call_overhead_bench.py),
+- decode.*: the decoding of each bundled 'example.json' with the default decoder,
+- cache.*: the hit and miss paths of CachedMethod over an on-disk store,
+- throttle.*: maybe_throttle() and the shared limiter under thread contention,
+- options.*: the parsing and building of option symbols and CUSIPs, one at a
+  time (with and without the memo) and in bulk, and the conversions of
+  OptionTable.
+- chains.*: the conversion of a GetOptionChain response to columns, in one
+  pass and by way of a dict per row.
+
+The results are written as JSON with '--output', and compared to the results
+of a previous run with '--baseline'. The exit status is 1 if any benchmark got
+slower than the baseline by more than '--threshold'.
+
+    PYTHONPATH=. python3 benchmarks/suite.py --output results.json
+    PYTHONPATH=. python3 benchmarks/suite.py --baseline results.json
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from decimal import Decimal
+from os import path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import timeit
+
+from ameritrade import api
+from ameritrade import cache
+from ameritrade import chains
+from ameritrade import decoding
+from ameritrade import examples
+from ameritrade import options
+from ameritrade import throttle
+
+import call_overhead_bench
+
+
+# The format version of the results files.
+RESULTS_VERSION = 1
+
+# A benchmark: a name, a function making one operation, and a multiplier of
+# the default number of operations per timing run, for the slower ones.
+Benchmark = Tuple[str, Callable[[], Any], float]
+
+
+def call_benchmarks() -> Iterator[Benchmark]:
+    """The per-call overhead of the client, with a stub session."""
+    tdapi = call_overhead_bench.open_stubbed()
+    for name, call in call_overhead_bench.CALLS.items():
+        yield 'call.' + name, lambda call=call: call(tdapi), 1.
+
+
+def decode_benchmarks() -> Iterator[Benchmark]:
+    """The decoding of every example file, with the default decoder."""
+    for filename in examples.find_example_files():
+        values = [examples.synthesize(example.value)
+                  for example in examples.load_examples(filename)]
+        data = json.dumps(values).encode('utf8')
+        name = path.basename(path.dirname(filename))
+        yield 'decode.' + name, lambda data=data: decoding.decode_decimal(data), 0.1
+
+
+def cache_benchmarks(tmpdir: str) -> Iterator[Benchmark]:
+    """The hit and miss paths of CachedMethod."""
+    response = decoding.decode_decimal(json.dumps(
+        {'SPY': {'symbol': 'SPY', 'lastPrice': 123.45, 'totalVolume': 1000}}).encode())
+    store = cache.open_store(tmpdir)
+    method = api.CachedMethod(store, 'GetQuote', lambda **kw: response, False)
+    method(symbol='SPY')
+    yield 'cache.hit', lambda: method(symbol='SPY'), 0.1
+    counter = itertools.count()
+    yield 'cache.miss', lambda: method(symbol='S{}'.format(next(counter))), 0.01
+
+
+def contended(call: Callable[[], Any], num_threads: int) -> Callable[[], Any]:
+    """Wrap a call into an operation made by many threads at once.
+
+    The time of an operation is that of one call by each of the threads. The
+    threads are daemons which live until the end of the process.
+    """
+    barrier = threading.Barrier(num_threads + 1)
+    def worker():
+        while True:
+            barrier.wait()
+            call()
+            barrier.wait()
+    for _ in range(num_threads):
+        threading.Thread(target=worker, daemon=True).start()
+    def operation():
+        barrier.wait()
+        barrier.wait()
+    return operation
+
+
+def throttle_benchmarks(tmpdir: str, num_threads: int) -> Iterator[Benchmark]:
+    """The bookkeeping of the limiters, with many threads calling them at once.
+
+    The rates are set high enough that no call ever waits.
+    """
+    bucket = throttle.TokenBucketLimiter(10 ** 9, 10 ** 8)
+    yield 'throttle.maybe_throttle', lambda: throttle.maybe_throttle(bucket), 1.
+    yield ('throttle.maybe_throttle.contended',
+           contended(lambda: throttle.maybe_throttle(bucket), num_threads), 0.01)
+    # The shared window would make the callers wait, so only reserve slots.
+    shared = throttle.SharedWindowLimiter(path.join(tmpdir, 'ratelimit'), 120)
+    yield 'throttle.shared', shared.reserve, 0.1
+    yield 'throttle.shared.contended', contended(shared.reserve, num_threads), 0.01
+
+
+def options_benchmarks() -> Iterator[Benchmark]:
+    """The conversions of option symbols and CUSIPs."""
+    symbol = 'SPY_081718C290'
+    cusip = '0SPY..HH80290000'
+    option = options.ParseOptionSymbol(symbol)
+    yield 'options.ParseOptionSymbol', lambda: options.ParseOptionSymbol(symbol), 1.
+    yield ('options.ParseOptionSymbol.uncached',
+           lambda: options.ParseOptionSymbol.__wrapped__(symbol), 1.)
+    yield 'options.ParseOptionCusip', lambda: options.ParseOptionCusip(cusip, 2018), 1.
+    yield ('options.ParseOptionCusip.uncached',
+           lambda: options._ParseOptionCusip.__wrapped__(cusip, 2018), 1.)
+    yield 'options.MakeOptionCusip', lambda: options.MakeOptionCusip(option), 1.
+
+    # A chain's worth of distinct contracts, parsed per symbol without the memo
+    # and in bulk.
+    opts = [options.Option(underlying, expiration, Decimal(strike), side)
+            for underlying in ('SPY', 'QQQ', 'IWM', 'NDXP')
+            for expiration in (datetime.date(2021, 1, 15) + datetime.timedelta(weeks=week)
+                               for week in range(25))
+            for strike in range(100, 150)
+            for side in 'CP']
+    symbols = [options.MakeOptionSymbol(opt) for opt in opts]
+    cusips = [options.MakeOptionCusip(opt) for opt in opts]
+    name = '.{}'.format(len(opts))
+    parse_symbol = options.ParseOptionSymbol.__wrapped__
+    parse_cusip = options._ParseOptionCusip.__wrapped__
+    yield ('options.ParseOptionSymbol.loop' + name,
+           lambda: [parse_symbol(symbol) for symbol in symbols], 0.0001)
+    yield ('options.ParseOptionCusip.loop' + name,
+           lambda: [parse_cusip(cusip, 2021) for cusip in cusips], 0.0001)
+    if options.numpy is not None:
+        yield ('options.ParseOptionSymbols' + name,
+               lambda: options.ParseOptionSymbols(symbols), 0.0001)
+        yield ('options.ParseOptionCusips' + name,
+               lambda: options.ParseOptionCusips(cusips, 2021), 0.0001)
+        table = options.OptionTable.from_options(opts)
+        yield ('options.MakeOptionSymbol.loop' + name,
+               lambda: [options.MakeOptionSymbol(opt) for opt in opts], 0.0001)
+        yield ('options.MakeOptionSymbols' + name,
+               lambda: options.MakeOptionSymbols(table), 0.0001)
+        yield ('options.MakeOptionCusip.loop' + name,
+               lambda: [options.MakeOptionCusip(opt) for opt in opts], 0.0001)
+        yield ('options.MakeOptionCusips' + name,
+               lambda: options.MakeOptionCusips(table), 0.0001)
+        yield ('options.OptionTable.from_options' + name,
+               lambda: options.OptionTable.from_options(opts), 0.0001)
+        yield 'options.OptionTable.to_options' + name, table.to_options, 0.0001
+
+
+def chains_benchmarks() -> Iterator[Benchmark]:
+    """The conversion of an option chain response to columns."""
+    if chains.numpy is None:
+        return
+    chain = decoding.decode_fast(json.dumps(examples.synthesize_option_chain(20, 100)))
+    fields = [(name, field) for name, field, _ in chains.CONTRACT_COLUMNS]
+
+    def rows():
+        # The walk the scripts used to do: a dict per row, then the columns.
+        table = [dict({name: contract.get(field) for name, field in fields},
+                      expiration=key.partition(':')[0], side=side)
+                 for side, map_name in (('C', 'callExpDateMap'), ('P', 'putExpDateMap'))
+                 for key, strikes in chain[map_name].items()
+                 for contracts in strikes.values()
+                 for contract in contracts]
+        return {name: chains.numpy.array([row[name] for row in table])
+                for name in chains.COLUMNS}
+
+    name = '.{}'.format(sum(len(contracts)
+                            for map_name in ('callExpDateMap', 'putExpDateMap')
+                            for strikes in chain[map_name].values()
+                            for contracts in strikes.values()))
+    yield 'chains.rows' + name, rows, 0.0001
+    yield 'chains.chain_columns' + name, lambda: chains.chain_columns(chain), 0.0001
+
+
+def measure(operation: Callable[[], Any], number: int, repeat: int) -> Dict[str, float]:
+    """Time an operation. Return the best and median times in microseconds."""
+    number = max(1, number)
+    times = [secs / number * 1e6
+             for secs in timeit.Timer(operation).repeat(repeat=repeat, number=number)]
+    return {'usecs': min(times),
+            'median_usecs': statistics.median(times),
+            'number': number,
+            'repeat': repeat}
+
+
+def run(number: int, repeat: int, num_threads: int,
+        pattern: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """Run the benchmarks whose names match a regexp. Return results by name."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        benchmarks = itertools.chain(call_benchmarks(),
+                                     decode_benchmarks(),
+                                     cache_benchmarks(tmpdir),
+                                     throttle_benchmarks(tmpdir, num_threads),
+                                     options_benchmarks(),
+                                     chains_benchmarks())
+        for name, operation, scale in benchmarks:
+            if pattern and not re.search(pattern, name):
+                continue
+            results[name] = measure(operation, int(number * scale), repeat)
+    return results
+
+
+def metadata() -> Dict[str, Any]:
+    """Describe the environment of a run."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True,
+                                cwd=path.dirname(path.abspath(__file__)))
+        commit = commit.stdout.strip()
+    except OSError:
+        commit = ''
+    return {'version': RESULTS_VERSION,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit or None,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'platform': platform.platform()}
+
+
+def compare(results: Dict[str, Dict[str, float]],
+            baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> Tuple[Dict[str, Optional[float]], List[str]]:
+    """Compare results to a baseline.
+
+    Returns:
+      A dict of the ratios of the times to those of the baseline, by name
+      (None for new benchmarks), and the names of those slower by more than
+      the threshold, e.g., 0.2 for 20%.
+    """
+    ratios, regressions = {}, []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or not base['usecs']:
+            ratios[name] = None
+            continue
+        ratios[name] = ratio = result['usecs'] / base['usecs']
+        if ratio > 1. + threshold:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help="Number of operations per timing run, for the fastest.")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="Number of timing runs per benchmark.")
+    parser.add_argument('-t', '--threads', type=int, default=8,
+                        help="Number of threads of the contended benchmarks.")
+    parser.add_argument('-k', '--filter', help="Run the benchmarks matching this regexp.")
+    parser.add_argument('-o', '--output', help="Write the results to this JSON file.")
+    parser.add_argument('-b', '--baseline', help="Compare to the results in this JSON file.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    results = run(args.number, args.repeat, args.threads, args.filter)
+    ratios, regressions = {}, []
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)['results']
+        ratios, regressions = compare(results, baseline, args.threshold)
+
+    for name, result in results.items():
+        line = '{:<48} {:>12.3f} us'.format(name, result['usecs'])
+        if name in ratios:
+            ratio = ratios[name]
+            line += '   (new)' if ratio is None else '   {:>6.2f}x{}'.format(
+                ratio, '  REGRESSION' if name in regressions else '')
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'meta': metadata(), 'results': results}, outfile,
+                      indent=2, sort_keys=True)
+    if regressions:
+        print('{} regressions over {:.0%}'.format(len(regressions), args.threshold),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@
 from decimal import Decimal
 import argparse
 import logging
-from typing import Tuple
+from typing import List, Tuple
 
 import numpy
 import petl
@@ -23,8 +23,8 @@ Q = Decimal('0.001')
 PERIOD_TYPES = ['daily1yr', 'weekly3yr', 'monthly3yr', 'experimental']
 
 
-def GetReturns(api: AmeritradeAPI, symbol: str, periodType: str) -> Tuple[Array, Array]:
-    """Get a series of returns for a particular period type."""
+def GetPeriodArgs(periodType: str) -> JSON:
+    """Get the GetPriceHistory() arguments for a particular period type."""
     if periodType == 'daily1yr':
         kwargs = dict(period=1,
                       periodType='year',
@@ -54,10 +54,11 @@ def GetReturns(api: AmeritradeAPI, symbol: str, periodType: str) -> Tuple[Array,
                       frequencyType='minute')
     else:
         raise ValueError("Invalid periodType: {}".format(periodType))
+    return kwargs
 
-    hist = api.GetPriceHistory(symbol=symbol, **kwargs)
-    if 'candles' not in hist:
-        print(hist, symbol, kwargs)
+
+def GetReturns(hist: JSON) -> Tuple[Array, Array]:
+    """Get a series of returns from a price history response."""
     candles = hist.candles
 
     time = numpy.fromiter((bar.datetime for bar in candles), dtype=int)
@@ -69,11 +70,35 @@ def GetReturns(api: AmeritradeAPI, symbol: str, periodType: str) -> Tuple[Array,
     return time, returns
 
 
-def GetBeta(api: AmeritradeAPI, symbol: str) -> float:
-    """Get beta provided by portfolio fundamentals."""
-    inst = api.SearchInstruments(symbol=symbol, projection='fundamental')
-    value = next(iter(inst.values()))
-    return value.fundamental.beta
+def GetAllReturns(api: AmeritradeAPI,
+                  symbols: List[str],
+                  periodType: str) -> List[Tuple[Array, Array]]:
+    """Fetch the returns for many symbols concurrently."""
+    kwargs = GetPeriodArgs(periodType)
+    results = api.map('GetPriceHistory', [dict(symbol=symbol, **kwargs)
+                                          for symbol in symbols])
+    all_returns = []
+    for symbol, result in zip(symbols, results):
+        if result.error is not None:
+            raise result.error
+        if 'candles' not in result.value:
+            print(result.value, symbol, kwargs)
+        all_returns.append(GetReturns(result.value))
+    return all_returns
+
+
+def GetBetas(api: AmeritradeAPI, symbols: List[str]) -> List[Decimal]:
+    """Get betas provided by portfolio fundamentals."""
+    results = api.map('SearchInstruments', [dict(symbol=symbol,
+                                                 projection='fundamental')
+                                            for symbol in symbols])
+    betas = []
+    for result in results:
+        if result.error is not None:
+            raise result.error
+        value = next(iter(result.value.values()))
+        betas.append(value.fundamental.beta)
+    return betas
 
 
 def main():
@@ -98,21 +123,19 @@ def main():
     positions.append(('SPY', Decimal('1')))
     positions = [list(x) for x in sorted(positions)]
 
+    symbols = [row[0] for row in positions]
+
     # Get betas from the API.
-    for row in positions:
-        symbol = row[0]
-        api_beta = GetBeta(api, symbol)
+    for row, api_beta in zip(positions, GetBetas(api, symbols)):
         row.append(api_beta.quantize(Q))
 
     # Get time series for the benchmark.
     for periodType in PERIOD_TYPES:
-        # Get benchmark returns for that period type.
-        time, bench_returns = GetReturns(api, args.betasym, periodType)
-
-        # Get price time series for all symbols.
-        for row in positions:
-            symbol = row[0]
-            ptime, returns = GetReturns(api, symbol, periodType)
+        # Get benchmark and price time series for all symbols for that period
+        # type, all at once.
+        all_returns = GetAllReturns(api, [args.betasym] + symbols, periodType)
+        time, bench_returns = all_returns[0]
+        for row, (ptime, returns) in zip(positions, all_returns[1:]):
             if time.shape != ptime.shape:
                 print((time.shape, ptime.shape, row))
                 pyplot.plot(time, bench_returns)
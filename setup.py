@@ -6,6 +6,8 @@ __license__ = "GNU GPLv2"
 
 import sys
 
+from setuptools import setup
+
 if sys.version_info[:2] < (3,):
     raise SystemExit("ERROR: Insufficient Python version; you need v3 or higher.")
 
@@ -24,5 +26,15 @@ setup(
 
     install_requires = [
         'requests',
-    ]
+    ],
+
+    extras_require = {
+        # The asyncio API, see async_api.py.
+        'async': ['aiohttp'],
+        'test': ['pytest', 'aiohttp'],
+    },
+    tests_require = [
+        'pytest',
+        'aiohttp',
+    ],
 )